@@ -27,14 +27,31 @@ from fastapi import FastAPI, HTTPException, Depends, Header, Request
 from fastapi.responses import JSONResponse, FileResponse
 from pydantic import BaseModel, HttpUrl
 import asyncio
-import json
 import logging
 from typing import Optional, Union, Dict, List, Any, Tuple
 from scraper import WebScraper
+from scheduler import ScrapeScheduler, ScrapeJob, parse_priority_classes, parse_key_weights
+from quotas import KeyQuotas, QuotaExceeded, KeyBlocked
+from domain_limiter import DomainLimiter, parse_domain_limits
+from resource_monitor import ResourceMonitor
+from scrape_watchdog import ScrapeWatchdog, current_job_id
+from browser_reaper import BrowserReaper
+from shared_state import get_state
+from session_store import DomainSessionStore, SessionCapturePolicy
+from warm_contexts import WarmContextPool
+from browser_profiles import get_profile_manager
+from asset_cache import get_asset_cache
+from proxy_registry import ProxyEntry, get_proxy_registry
+from proxy_prober import ProxyProber
+from bandwidth import BandwidthAccounting
+from hedging import HedgePolicy
+from preflight import Preflight, PreflightError
 import time
+import math
 import uuid
 import re
 import base64
+import hashlib
 import aiohttp
 from urllib.parse import urlparse
 
@@ -43,42 +60,128 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(
 logger = logging.getLogger(__name__)
 
 VALID_API_KEYS = os.getenv('VALID_API_KEYS', 'sk-demo-key-12345').split(',')
+# Keys (also listed in VALID_API_KEYS) that may see every tenant's queue state and usage
+ADMIN_API_KEYS = {key.strip() for key in os.getenv('ADMIN_API_KEYS', '').split(',') if key.strip()}
+
+
+def _is_admin(api_key: Optional[str]) -> bool:
+    return bool(api_key) and api_key in ADMIN_API_KEYS
+
+
+def _key_owner(api_key: str) -> str:
+    """Non-reversible tag of an API key, stored with job records instead of the key itself."""
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16]
 
 # Debug screenshots: folder and retention
 DEBUG_DIR = "debug"
 DEBUG_MAX_AGE_DAYS = 5
 
-# Domain sessions: keep per-domain storage_state + sticky proxy for 30 days
+# Domain sessions: keep per-domain storage_state + sticky proxy for 30 days (in the shared state,
+# so every worker process sees the same sessions; see shared_state.py)
 SESSION_TTL_SECONDS = 30 * 24 * 60 * 60  # 30 days
-domain_sessions: Dict[str, Dict[str, Any]] = {}
+# Worker processes (uvicorn --workers); all state that must be consistent lives in the shared state
+API_WORKERS = max(1, int(os.getenv("API_WORKERS", "1")))
+# Domain-affinity sharding: with API_WORKERS > 1, a front dispatcher routes each target domain to one
+# worker process (consistent hashing), spilling over when that shard has SHARD_SPILL_THRESHOLD requests
+# in flight (default MAX_CONCURRENT_SCRAPES); see shard_dispatcher.py
+SHARD_BY_DOMAIN = os.getenv("SHARD_BY_DOMAIN", "false").lower() == "true"
+SHARD_INDEX = os.getenv("SHARD_INDEX")  # set by the dispatcher in each shard process
+# Job status records (POST /queue/{job_id} from any worker) are kept this long after the job finished
+JOB_STATUS_TTL_SEC = 3600
 
 # Scrape queue: limit concurrent browser instances (configurable via MAX_CONCURRENT_SCRAPES)
 MAX_CONCURRENT_SCRAPES = max(1, int(os.getenv("MAX_CONCURRENT_SCRAPES", "10")))
 MAX_QUEUE_SIZE = max(1, int(os.getenv("MAX_QUEUE_SIZE", "100")))
-LOAD_THRESHOLD = float(os.getenv("LOAD_THRESHOLD", "10"))
 # Overall per-request timeout: prevents stuck jobs from blocking the queue indefinitely
 SCRAPE_TIMEOUT_SEC = max(60, float(os.getenv("SCRAPE_TIMEOUT_SEC", "180")))
-scrape_semaphore = asyncio.Semaphore(MAX_CONCURRENT_SCRAPES)
-# When load > threshold: only 1 new job can start at a time (no burst)
-_load_gate_semaphore = asyncio.Semaphore(1)
-_load_condition = asyncio.Condition()
+# Priority classes in priority order, with optional reserved slots: "interactive:2,default,bulk"
+PRIORITY_CLASSES = parse_priority_classes(os.getenv("PRIORITY_CLASSES", "interactive,default,bulk"))
+DEFAULT_PRIORITY_CLASS = os.getenv("DEFAULT_PRIORITY_CLASS", "default")
+# Weighted fair queuing across API keys within a class: "sk-key-a:3,sk-key-b:1" (default weight 1)
+API_KEY_WEIGHTS = parse_key_weights(os.getenv("API_KEY_WEIGHTS", ""))
+scrape_scheduler = ScrapeScheduler(
+    MAX_CONCURRENT_SCRAPES,
+    PRIORITY_CLASSES,
+    key_weights=API_KEY_WEIGHTS,
+    default_class=DEFAULT_PRIORITY_CLASS,
+)
+# Per-API-key rate limits and concurrency/queue quotas (JSON file, see quotas.py). Empty = unlimited.
+API_KEY_LIMITS_FILE = os.getenv("API_KEY_LIMITS_FILE", "")
+key_quotas = KeyQuotas(API_KEY_LIMITS_FILE or None, state=get_state())
+scrape_scheduler.add_key_check(lambda key: key_quotas.can_start(key, scrape_scheduler.active_for_key(key)))
+# Per-target-domain politeness: max in-flight requests and min interval between starts.
+# Overrides: "example.com:2:1.5,slow-site.org:1:10" (domain:max_in_flight:min_interval_sec, covers subdomains)
+DOMAIN_MAX_IN_FLIGHT = max(1, int(os.getenv("DOMAIN_MAX_IN_FLIGHT", "3")))
+DOMAIN_MIN_INTERVAL_SEC = max(0.0, float(os.getenv("DOMAIN_MIN_INTERVAL_SEC", "0.5")))
+domain_limiter = DomainLimiter(
+    DOMAIN_MAX_IN_FLIGHT,
+    DOMAIN_MIN_INTERVAL_SEC,
+    overrides=parse_domain_limits(os.getenv("DOMAIN_LIMITS", "")),
+    on_ready=scrape_scheduler.notify,
+    # Adaptive backoff on 429/503: rate *= factor per throttle, += step (req/s) per success; Retry-After capped
+    backoff_factor=float(os.getenv("DOMAIN_BACKOFF_FACTOR", "0.5")),
+    recovery_step=float(os.getenv("DOMAIN_RECOVERY_STEP", "0.05")),
+    max_backoff_sec=float(os.getenv("DOMAIN_MAX_BACKOFF_SEC", "300")),
+)
+# Throttled domains are skipped at dispatch, so other domains' jobs overtake them instead of idling slots
+scrape_scheduler.add_admission_check(lambda job: domain_limiter.can_start(job.domain))
+scrape_scheduler.add_start_listener(lambda job: domain_limiter.on_start(job.domain))
+scrape_scheduler.add_release_listener(lambda job: domain_limiter.on_finish(job.domain))
+# Resource admission: a scrape starts only if cgroup/host memory covers one more browser
+# (SCRAPE_MEMORY_HEADROOM_MB or the measured browser RSS per scrape) and enough fds are free.
+# New requests are rejected (503) when available memory drops below MEMORY_REJECT_MB.
+SCRAPE_MEMORY_HEADROOM_MB = float(os.getenv("SCRAPE_MEMORY_HEADROOM_MB", "512"))
+SCRAPE_FD_HEADROOM = int(os.getenv("SCRAPE_FD_HEADROOM", "64"))
+MEMORY_REJECT_MB = float(os.getenv("MEMORY_REJECT_MB", "256"))
+# Re-check interval for queued jobs when memory is freed outside this process (releases wake waiters at once)
+RESOURCE_REFRESH_SEC = max(0.5, float(os.getenv("RESOURCE_REFRESH_SEC", "2")))
+resource_monitor = ResourceMonitor(
+    memory_headroom_mb=SCRAPE_MEMORY_HEADROOM_MB,
+    fd_headroom=SCRAPE_FD_HEADROOM,
+    reject_below_mb=MEMORY_REJECT_MB,
+    idle_browsers=lambda: len(warm_contexts),
+)
+scrape_scheduler.add_start_listener(lambda job: resource_monitor.on_start())
+scrape_scheduler.add_release_listener(lambda job: resource_monitor.on_finish())
+# Watchdog: SIGKILL the browser process tree of jobs still running WATCHDOG_GRACE_SEC after SCRAPE_TIMEOUT_SEC
+# (hung playwright calls ignore asyncio timeouts), reclaim their slot, and reap orphaned Chromium processes
+scrape_watchdog = ScrapeWatchdog(
+    grace_sec=float(os.getenv("WATCHDOG_GRACE_SEC", "30")),
+    interval_sec=float(os.getenv("WATCHDOG_INTERVAL_SEC", "10")),
+    reap_orphans=os.getenv("WATCHDOG_REAP_ORPHANS", "true").lower() == "true",
+)
+# Browser teardown runs in the background with bounded concurrency (a hung close is killed after the timeout)
+REAPER_MAX_CONCURRENT = max(1, int(os.getenv("REAPER_MAX_CONCURRENT", "4")))
+REAPER_TIMEOUT_SEC = max(1.0, float(os.getenv("REAPER_TIMEOUT_SEC", "30")))
 _scrape_active_count = 0
 _scrape_pending_count = 0
 _scrape_active_starts: List[float] = []  # Start times for stuck-job detection
 _queue_log_task: Optional[asyncio.Task] = None
-_load_monitor_task: Optional[asyncio.Task] = None
-
-# Reject new requests when load exceeds this (prevents complete deadlock under overload)
-LOAD_REJECT_THRESHOLD = float(os.getenv("LOAD_REJECT_THRESHOLD", "25"))
-
-
-def _get_system_load() -> float:
-    """Return 1-min load average. On Windows or error, returns 0 (no throttling)."""
-    try:
-        load_1min, _, _ = os.getloadavg()
-        return load_1min
-    except (OSError, AttributeError):
-        return 0.0
+_resource_refresh_task: Optional[asyncio.Task] = None
+_watchdog_task: Optional[asyncio.Task] = None
+_session_flush_task: Optional[asyncio.Task] = None
+_warm_sweep_task: Optional[asyncio.Task] = None
+_profile_quota_task: Optional[asyncio.Task] = None
+_proxy_probe_task: Optional[asyncio.Task] = None
+
+# Domain sessions: persisted (compressed) in the shared state, loaded per domain on first use and
+# written in the background. Other workers' updates are picked up after SESSION_CACHE_REFRESH_SEC.
+# In memory, sessions are kept compressed in an LRU cache bounded by SESSION_CACHE_MAX_MB / _MAX_ENTRIES.
+session_store = DomainSessionStore(
+    get_state(),
+    ttl_sec=SESSION_TTL_SECONDS,
+    refresh_sec=float(os.getenv("SESSION_CACHE_REFRESH_SEC", "30")) if API_WORKERS > 1 else 0.0,
+    cache_max_bytes=int(float(os.getenv("SESSION_CACHE_MAX_MB", "64")) * 1024 * 1024),
+    cache_max_entries=int(os.getenv("SESSION_CACHE_MAX_ENTRIES", "10000")),
+    cache_idle_ttl_sec=float(os.getenv("SESSION_CACHE_IDLE_SEC", "3600")),
+)
+# Capture storage_state after a success at most every SESSION_CAPTURE_INTERVAL_SEC per domain, only
+# write it when cookies/localStorage changed, and stop capturing domains that never set any state
+session_capture = SessionCapturePolicy(
+    min_interval_sec=float(os.getenv("SESSION_CAPTURE_INTERVAL_SEC", "300")),
+    stateless_after=int(os.getenv("SESSION_STATELESS_AFTER", "3")),
+    stateless_recheck_sec=float(os.getenv("SESSION_STATELESS_RECHECK_SEC", "3600")),
+)
 
 
 def _ensure_debug_dir() -> str:
@@ -117,17 +220,26 @@ def _get_domain_from_url(url: str) -> Optional[str]:
         return None
 
 
+def _record_navigation_response(scraper: WebScraper, url: str) -> None:
+    """Feed the last navigation's HTTP status to the domain limiter (adaptive backoff on 429/503)."""
+    domain_limiter.record_response(
+        _get_domain_from_url(url),
+        getattr(scraper, "last_response_status", None),
+        getattr(scraper, "last_retry_after", None),
+    )
+
+
 def _get_session_refresh_interval_sec() -> int:
     """Session refresh interval (force new session after this age). Inspired by cloudscraper."""
     return int(os.getenv("SESSION_REFRESH_INTERVAL_SEC", "3600"))
 
 
-def _get_valid_domain_session(domain: Optional[str]) -> Optional[Dict[str, Any]]:
+async def _get_valid_domain_session(domain: Optional[str]) -> Optional[Dict[str, Any]]:
     """Return cached session for domain if it exists and is not expired."""
     if not domain:
         return None
 
-    session = domain_sessions.get(domain)
+    session = await session_store.get(domain)
     if not session:
         return None
 
@@ -136,37 +248,83 @@ def _get_valid_domain_session(domain: Optional[str]) -> Optional[Dict[str, Any]]
         return None
 
     if time.time() - created_at > SESSION_TTL_SECONDS:
-        domain_sessions.pop(domain, None)
+        _drop_domain_session(domain)
         logger.info(f"🗑️ Domain session expired for {domain}")
         return None
 
     # Optional: force refresh after shorter interval (session health, like cloudscraper)
     refresh_interval = _get_session_refresh_interval_sec()
     if refresh_interval > 0 and (time.time() - created_at) > refresh_interval:
-        domain_sessions.pop(domain, None)
+        _drop_domain_session(domain)
         logger.info(f"🔄 Domain session refreshed for {domain} (age > {refresh_interval}s)")
         return None
 
     return session
 
 
+def _drop_domain_session(domain: Optional[str]) -> bool:
+    """Forget the stored session of a domain (all workers). True if one existed."""
+    if not domain:
+        return False
+    warm_contexts.discard(domain)
+    return session_store.drop(domain)
+
+
+def _touch_domain_session(domain: str, session: Optional[Dict[str, Any]]) -> None:
+    """
+    Mark a still-working session as fresh (created_at = now), like a rewrite after every success did.
+    Written only once it has aged a quarter of its refresh interval (or TTL), not on every request.
+    """
+    created_at = session.get("created_at") if session else None
+    if not isinstance(created_at, (int, float)):
+        return
+    refresh_interval = _get_session_refresh_interval_sec()
+    max_age = min(refresh_interval, SESSION_TTL_SECONDS) if refresh_interval > 0 else SESSION_TTL_SECONDS
+    if time.time() - created_at >= max_age / 4:
+        session_store.put(domain, {**session, "created_at": time.time()})
+
+
 async def _store_domain_session(scraper: WebScraper, url: str) -> None:
-    """Store storage_state + proxy index for a domain after successful load."""
+    """Store storage_state + proxy index for a domain after successful load (only when changed)."""
     domain = _get_domain_from_url(url)
     if not domain:
         return
 
     try:
-        storage_state = None
-        if getattr(scraper, "context", None) is not None:
-            storage_state = await scraper.context.storage_state()
-
+        session = await session_store.get(domain)
         proxy_index = getattr(scraper, "current_proxy_index", None)
-        domain_sessions[domain] = {
-            "created_at": time.time(),
-            "proxy_index": proxy_index,
-            "storage_state": storage_state,
-        }
+
+        if getattr(scraper, "context", None) is None or not session_capture.should_capture(domain, session, proxy_index):
+            # No capture: only remember a new sticky proxy (keeping the stored browser state)
+            if session is None or session.get("proxy_index") != proxy_index:
+                session_store.put(
+                    domain,
+                    {
+                        "created_at": time.time(),
+                        "proxy_index": proxy_index,
+                        "storage_state": session.get("storage_state") if session else None,
+                        "state_hash": session.get("state_hash") if session else None,
+                    },
+                )
+                logger.info(f"💾 Stored sticky proxy for {domain} (proxy_index={proxy_index})")
+            else:
+                _touch_domain_session(domain, session)
+            return
+
+        storage_state = await scraper.context.storage_state()
+        state_hash = session_capture.record_capture(domain, storage_state)
+        if not session_capture.is_changed(session, state_hash, proxy_index):
+            _touch_domain_session(domain, session)
+            return
+        session_store.put(
+            domain,
+            {
+                "created_at": time.time(),
+                "proxy_index": proxy_index,
+                "storage_state": storage_state,
+                "state_hash": state_hash,
+            },
+        )
         logger.info(f"💾 Stored domain session for {domain} (proxy_index={proxy_index})")
     except Exception as e:
         logger.warning(f"⚠️ Failed to store domain session for {domain}: {e}")
@@ -174,33 +332,24 @@ async def _store_domain_session(scraper: WebScraper, url: str) -> None:
 
 async def _test_proxy_connectivity(scraper: WebScraper) -> Dict[str, Any]:
     """
-    Test current proxy by hitting a fast external endpoint.
+    Test the scraper's current proxy with one lightweight HTTP request (PROXY_PROBE_URL, no browser page).
     Returns a small dict with success flag, ip (if any), and error message.
     """
-    test_url = "https://httpbin.org/ip"
     result: Dict[str, Any] = {
         "success": False,
         "ip": None,
         "error": None,
-        "test_url": test_url,
+        "test_url": proxy_prober.probe_url,
     }
-
-    if not scraper or not getattr(scraper, "page", None):
-        result["error"] = "No active page to run proxy test"
+    proxy_info = scraper.get_current_proxy_info() if scraper else None
+    if not proxy_info:
+        result["error"] = "No proxy in use"
         return result
-
-    try:
-        await scraper.page.goto(test_url, wait_until="domcontentloaded", timeout=8000)
-        try:
-            body = await scraper.page.evaluate("() => document.body.innerText")
-            ip_data = json.loads(body)
-            result["ip"] = ip_data.get("origin")
-            result["success"] = True
-        except Exception as parse_err:
-            result["error"] = f"IP parse failed: {parse_err}"
-    except Exception as e:
-        result["error"] = str(e)
-
+    probe = await proxy_prober.probe(scraper.proxy_list[scraper.current_proxy_index])
+    result["success"] = probe["working"]
+    result["ip"] = probe["ip"]
+    result["error"] = probe["error"]
+    result["latency_ms"] = probe["latency_ms"]
     return result
 
 
@@ -268,7 +417,7 @@ async def _attach_debug_video(scraper: WebScraper, request_id: str) -> Optional[
             return None
 
         # IMPORTANT: Playwright only finalizes the video file after the page is closed.
-        # Close page here (cleanup_scraper is tolerant to already-closed pages).
+        # Close page here (scraper teardown is tolerant to already-closed pages).
         try:
             if hasattr(page, "is_closed") and not page.is_closed():
                 logger.info("🎥 Closing page to finalize debug video")
@@ -565,8 +714,13 @@ def _log_queue_status():
     global _scrape_active_count, _scrape_pending_count, _scrape_active_starts
     total = _scrape_active_count + _scrape_pending_count
     if total > 0:
-        load = _get_system_load()
-        logger.info(f"📊 Queue: {_scrape_pending_count} waiting, {_scrape_active_count} active (max {MAX_CONCURRENT_SCRAPES}), load {load:.1f}")
+        logger.info(f"📊 Queue: {_scrape_pending_count} waiting, {_scrape_active_count} active (max {MAX_CONCURRENT_SCRAPES}), {resource_monitor.describe()}")
+        if browser_reaper.pending or browser_reaper.failed:
+            reaper = browser_reaper.snapshot()
+            logger.info(
+                f"🧹 Reaper: {reaper['pending']} teardowns pending, {reaper['reaped']} done, {reaper['failed']} failed, "
+                f"latency p95 {reaper['latency_sec']['p95']}s"
+            )
         # Stuck job detection: active jobs running longer than timeout
         if _scrape_active_starts and len(_scrape_active_starts) > 0:
             oldest = _scrape_active_starts[0]
@@ -574,50 +728,199 @@ def _log_queue_status():
             if age > SCRAPE_TIMEOUT_SEC:
                 logger.critical(
                     f"🚨 STUCK JOBS: {_scrape_active_count} active for {age:.0f}s (timeout {SCRAPE_TIMEOUT_SEC}s). "
-                    "Restart the server to recover."
+                    f"Watchdog kills their browsers after {scrape_watchdog.grace_sec:.0f}s grace."
                 )
 
 
+def _publish_worker_load() -> None:
+    """Share this worker's active/queued counts, so queue limits and /queue cover all workers."""
+    state = get_state()
+    state.submit(
+        state.set,
+        f"worker:{os.getpid()}",
+        {"active": _scrape_active_count, "queued": _scrape_pending_count, "updated_at": time.time()},
+        ttl=90,
+    )
+
+
+async def _worker_loads() -> Dict[str, Dict[str, Any]]:
+    """Active/queued counts per worker process (this worker's counts are always current)."""
+    loads: Dict[str, Dict[str, Any]] = {}
+    if API_WORKERS > 1:
+        try:
+            loads = {key.split(":", 1)[1]: value for key, value in (await get_state().aitems("worker:")).items()}
+        except Exception as e:
+            logger.warning(f"⚠️ Could not read worker loads: {e}")
+    loads[str(os.getpid())] = {"active": _scrape_active_count, "queued": _scrape_pending_count, "updated_at": time.time()}
+    return loads
+
+
+async def _cluster_queue_size() -> int:
+    """Running + waiting requests across all worker processes."""
+    return sum(load.get("active", 0) + load.get("queued", 0) for load in (await _worker_loads()).values())
+
+
+def _publish_job_status(job: ScrapeJob, state: str, **extra: Any) -> None:
+    """Record a job's state in the shared state, so POST /queue/{job_id} answers from any worker."""
+    record = {
+        "job_id": job.job_id,
+        "owner": _key_owner(job.api_key),
+        "state": state,
+        "priority": job.priority,
+        "domain": job.domain,
+        "worker": os.getpid(),
+        "enqueued_at": job.enqueued_at,
+        "started_at": job.started_at,
+        "updated_at": time.time(),
+    }
+    record.update(extra)
+    # Written in order on the state's writer thread (called from scheduler listeners on the event loop)
+    state = get_state()
+    state.submit(state.set, f"job:{job.job_id}", record, ttl=JOB_STATUS_TTL_SEC + SCRAPE_TIMEOUT_SEC)
+
+
+async def _job_in_flight_elsewhere(job_id: str) -> bool:
+    """True if another worker has this job id queued or running."""
+    try:
+        record = await get_state().aget(f"job:{job_id}")
+    except Exception:
+        return False
+    return bool(record) and record.get("state") in ("queued", "running")
+
+
+scrape_scheduler.add_start_listener(lambda job: _publish_job_status(job, "running"))
+scrape_scheduler.add_release_listener(
+    lambda job: _publish_job_status(job, "finished", duration=round(time.time() - (job.started_at or time.time()), 3))
+)
+
+
 async def _queue_status_logger():
     """Background task: log queue status periodically when there is activity."""
     while True:
         await asyncio.sleep(30)
         _log_queue_status()
+        _publish_worker_load()
+        domain_limiter.prune()
+        try:
+            await get_state().apurge_expired()
+        except Exception as e:
+            logger.warning(f"⚠️ Shared state purge failed: {e}")
 
 
-async def _load_monitor():
-    """Notify waiters when load drops below threshold (no fixed sleep in request path)."""
+async def _resource_refresh():
+    """Re-sample resources for queued jobs (memory freed by other processes does not trigger a release)."""
     while True:
-        await asyncio.sleep(1)
-        if _get_system_load() <= LOAD_THRESHOLD:
-            async with _load_condition:
-                _load_condition.notify_all()
+        await asyncio.sleep(RESOURCE_REFRESH_SEC)
+        if scrape_scheduler.queued_count:
+            try:
+                resource_monitor.invalidate()
+                scrape_scheduler.notify()
+            except Exception as e:
+                logger.warning(f"⚠️ Resource refresh failed: {e}")
+
+
+async def _profile_quota_loop(interval_sec: float = 60.0):
+    """Background task: keep persistent browser profiles within PROFILE_TOTAL_MAX_MB (LRU eviction)."""
+    profiles = get_profile_manager()
+    while True:
+        try:
+            await asyncio.to_thread(profiles.enforce_quota)
+        except Exception as e:
+            logger.warning(f"⚠️ Profile quota check failed: {e}")
+        await asyncio.sleep(interval_sec)
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Lifespan event handler for startup and shutdown"""
-    global _queue_log_task, _load_monitor_task
+    global _queue_log_task, _resource_refresh_task, _watchdog_task, _session_flush_task, _warm_sweep_task, _profile_quota_task, _proxy_probe_task
     # Startup
     logger.info("🚀 Starting Web Scraper API...")
-    logger.info(f"📊 Queue: max_concurrent={MAX_CONCURRENT_SCRAPES}, max_queue={MAX_QUEUE_SIZE}, load_threshold={LOAD_THRESHOLD}, load_reject={LOAD_REJECT_THRESHOLD}, scrape_timeout={SCRAPE_TIMEOUT_SEC}s")
+    logger.info(f"📊 Queue: max_concurrent={MAX_CONCURRENT_SCRAPES}, max_queue={MAX_QUEUE_SIZE}, scrape_timeout={SCRAPE_TIMEOUT_SEC}s")
+    logger.info(f"📊 Resources: headroom={SCRAPE_MEMORY_HEADROOM_MB:.0f} MB/scrape, fd_headroom={SCRAPE_FD_HEADROOM}, reject_below={MEMORY_REJECT_MB:.0f} MB ({resource_monitor.describe()})")
+    logger.info(f"📊 Priority classes: {scrape_scheduler.class_order} (reserved {scrape_scheduler.reserved}), default={scrape_scheduler.default_class}")
+    logger.info(f"📊 Domain limits: max_in_flight={DOMAIN_MAX_IN_FLIGHT}, min_interval={DOMAIN_MIN_INTERVAL_SEC}s, overrides={len(domain_limiter.overrides)}")
     _queue_log_task = asyncio.create_task(_queue_status_logger())
-    _load_monitor_task = asyncio.create_task(_load_monitor())
+    _resource_refresh_task = asyncio.create_task(_resource_refresh())
+    _watchdog_task = asyncio.create_task(scrape_watchdog.run())
+    _session_flush_task = asyncio.create_task(session_store.run())
+    if WARM_CONTEXTS_ENABLED:
+        logger.info(f"📊 Warm contexts: max={WARM_CONTEXT_MAX}, max_memory={WARM_CONTEXT_MAX_MB:.0f} MB, idle={WARM_CONTEXT_IDLE_SEC:.0f}s")
+        _warm_sweep_task = asyncio.create_task(warm_contexts.run())
+    if get_profile_manager() is not None:
+        profiles = get_profile_manager()
+        logger.info(f"📊 Persistent profiles: {profiles.root} (cache {profiles.max_cache_bytes // (1024 * 1024)} MB/profile, total {profiles.max_total_bytes // (1024 * 1024)} MB)")
+        _profile_quota_task = asyncio.create_task(_profile_quota_loop())
+    if PROXY_PROBE_ENABLED and len(get_proxy_registry()):
+        logger.info(f"📊 Proxy probe: {len(get_proxy_registry())} proxies every {proxy_prober.interval_sec:.0f}s via {proxy_prober.probe_url} (concurrency {proxy_prober.concurrency})")
+        _proxy_probe_task = asyncio.create_task(proxy_prober.run())
+    if get_asset_cache() is not None:
+        assets = get_asset_cache()
+        indexed = await asyncio.to_thread(assets.load_index)
+        logger.info(f"📊 Asset cache: {assets.root} ({indexed} entries, {assets.bytes // (1024 * 1024)}/{assets.max_bytes // (1024 * 1024)} MB)")
     yield
     # Shutdown
     logger.info("🛑 Shutting down Web Scraper API...")
-    if _load_monitor_task:
-        _load_monitor_task.cancel()
+    if _watchdog_task:
+        _watchdog_task.cancel()
         try:
-            await _load_monitor_task
+            await _watchdog_task
         except asyncio.CancelledError:
             pass
+        except Exception as e:
+            logger.warning(f"⚠️ Background task _watchdog_task ended with an error: {e}")
+    if _resource_refresh_task:
+        _resource_refresh_task.cancel()
+        try:
+            await _resource_refresh_task
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            logger.warning(f"⚠️ Background task _resource_refresh_task ended with an error: {e}")
     if _queue_log_task:
         _queue_log_task.cancel()
         try:
             await _queue_log_task
         except asyncio.CancelledError:
             pass
+        except Exception as e:
+            logger.warning(f"⚠️ Background task _queue_log_task ended with an error: {e}")
+    if _profile_quota_task:
+        _profile_quota_task.cancel()
+        try:
+            await _profile_quota_task
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            logger.warning(f"⚠️ Background task _profile_quota_task ended with an error: {e}")
+    if _proxy_probe_task:
+        _proxy_probe_task.cancel()
+        try:
+            await _proxy_probe_task
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            logger.warning(f"⚠️ Background task _proxy_probe_task ended with an error: {e}")
+    await proxy_prober.close()
+    if _warm_sweep_task:
+        _warm_sweep_task.cancel()
+        try:
+            await _warm_sweep_task
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            logger.warning(f"⚠️ Background task _warm_sweep_task ended with an error: {e}")
+    warm_contexts.clear()
+    await browser_reaper.drain(timeout_sec=REAPER_TIMEOUT_SEC + 5)
+    if _session_flush_task:
+        _session_flush_task.cancel()
+        try:
+            await _session_flush_task
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            logger.warning(f"⚠️ Background task _session_flush_task ended with an error: {e}")
+    await session_store.flush()
     for scraper in scraper_pool:
         await scraper.close()
     scraper_pool.clear()
@@ -650,6 +953,16 @@ class UnifiedScrapeRequest(BaseModel):
     click: Optional[List[Union[str, int]]] = None
     get: Optional[Dict[str, Union[str, Dict[str, Any]]]] = None
     collect: Optional[Dict[str, Dict[str, Any]]] = None
+    # Infinite scroll: scroll until max_items / max_time and extract 'collect' items incrementally.
+    # Example: {"max_items": 200, "max_time": 30, "step_wait": 1500, "idle_steps": 3, "container": null}
+    scroll: Optional[Dict[str, Any]] = None
+    # Scheduling: priority class (see PRIORITY_CLASSES, e.g. "interactive", "default", "bulk")
+    priority: Optional[str] = None
+    # Optional client-chosen job id, to poll POST /queue/{job_id} while the request waits
+    job_id: Optional[str] = None
+    # Seconds until the result is needed: rejected early (429 + Retry-After) if the expected queue wait
+    # plus scrape duration exceeds it, and dropped from the queue if it has not started by then
+    deadline: Optional[float] = None
 
 class UnifiedScrapeResponse(BaseModel):
     success: bool
@@ -720,6 +1033,18 @@ class SelectorScrapeResponse(BaseModel):
     error: Optional[str] = None
     debug_html: str = ""  # Page HTML for debugging
 
+class ProxyListRequest(BaseModel):
+    page: int = 1
+    page_size: int = 50  # Max 500
+    state: Optional[str] = None  # "healthy" or "banned"
+    type: Optional[str] = None  # "HTTP", "SOCKS4", "SOCKS5"
+    search: Optional[str] = None  # Substring of the proxy URL
+    sort: str = "index"  # index, score, latency, failures, samples, bytes, active
+
+class ProxyTestRequest(BaseModel):
+    proxies: Optional[List[str]] = None  # Proxy URLs (URL or URL:username:password)
+    all: bool = False  # Test every configured proxy (PROXY_LIST)
+
 # Authentication dependency
 async def verify_api_key(x_api_key: str = Header(None)):
     """Verify API key from header"""
@@ -757,15 +1082,21 @@ def _parse_resolution(resolution: Optional[str]) -> Optional[Dict[str, int]]:
         return None
 
 
-async def get_scraper(domain: Optional[str] = None, light_mode: bool = False, resolution: Optional[str] = None):
-    """Get scraper instance with optional per-domain session and sticky proxy."""
+async def get_scraper(
+    domain: Optional[str] = None,
+    light_mode: bool = False,
+    resolution: Optional[str] = None,
+    avoid_proxy: Optional[int] = None,
+    url: Optional[str] = None,
+):
+    """
+    Get scraper instance with optional per-domain session and sticky proxy (other than index avoid_proxy).
+    With url (and PREFLIGHT_ENABLED), its host is checked through the proxy first: PreflightError before any browser starts.
+    """
     import random
 
     scraper = None
     try:
-        # Create new scraper
-        scraper = WebScraper()
-
         # Viewport: resolution from request (e.g. "1024x768"), or 800x600 in light mode, else 1920x1080
         parsed = _parse_resolution(resolution)
         if parsed:
@@ -774,28 +1105,43 @@ async def get_scraper(domain: Optional[str] = None, light_mode: bool = False, re
             viewport = {"width": 800, "height": 600}
         else:
             viewport = {"width": 1920, "height": 1080}
+
+        # Live context kept warm from a previous request for this domain (cache, connections, JS state)
+        if WARM_CONTEXTS_ENABLED and domain and avoid_proxy is None:
+            scraper = await warm_contexts.checkout(domain, viewport)
+            if scraper is not None:
+                scrape_watchdog.attach(scraper)
+                scraper.traffic = bandwidth.counter_for(current_job_id.get())
+                scraper._viewport_override = viewport
+                logger.info(f"🔥 Reusing warm browser context for {domain} (proxy index {scraper.current_proxy_index})")
+                return scraper
+
+        # Create new scraper (registered with the watchdog of the current job before its browser starts)
+        scraper = WebScraper()
+        scrape_watchdog.attach(scraper)
+        scraper.traffic = bandwidth.counter_for(current_job_id.get())
         scraper._viewport_override = viewport
 
         # Try to reuse existing domain session (storage_state + proxy index)
-        session = _get_valid_domain_session(domain) if domain else None
-
-        if session and scraper.proxy_list:
-            proxy_index = session.get("proxy_index")
-            if isinstance(proxy_index, int) and 0 <= proxy_index < len(scraper.proxy_list):
-                scraper.current_proxy_index = proxy_index
-                logger.info(f"🎯 Reusing session proxy index {proxy_index} for domain {domain}")
-            elif scraper.proxy_list:
-                scraper.current_proxy_index = random.randint(0, len(scraper.proxy_list) - 1)
-                logger.info(f"🎲 Random proxy selected: index {scraper.current_proxy_index}")
-        else:
-            # No existing session, keep current behaviour: random proxy rotation
-            if scraper.proxy_list:
-                scraper.current_proxy_index = random.randint(0, len(scraper.proxy_list) - 1)
-                logger.info(f"🎲 Random proxy selected: index {scraper.current_proxy_index}")
+        session = await _get_valid_domain_session(domain) if domain else None
+
+        proxy_index = session.get("proxy_index") if session else None
+        if scraper.proxy_list and isinstance(proxy_index, int) and 0 <= proxy_index < len(scraper.proxy_list) and proxy_index != avoid_proxy and scraper.proxies.is_available(proxy_index):
+            # Sticky proxy of the domain session
+            scraper.current_proxy_index = proxy_index
+            logger.info(f"🎯 Reusing session proxy index {proxy_index} for domain {domain}")
+        elif scraper.proxy_list:
+            # Latency/success/challenge-weighted choice (PROXY_SELECTION)
+            entry = scraper.proxies.choose(domain, exclude=avoid_proxy)
+            scraper.current_proxy_index = entry.index if entry is not None else random.randint(0, len(scraper.proxy_list) - 1)
+            logger.info(f"🎲 Proxy selected ({scraper.proxies.selection}): index {scraper.current_proxy_index}")
+
+        if PREFLIGHT_ENABLED and url:
+            await _preflight(scraper, url, domain)
 
         storage_state = session.get("storage_state") if session else None
 
-        await scraper.setup_browser(storage_state=storage_state)
+        await scraper.setup_browser(storage_state=storage_state, domain=domain)
         return scraper
     except Exception as e:
         error_msg = str(e)
@@ -803,49 +1149,225 @@ async def get_scraper(domain: Optional[str] = None, light_mode: bool = False, re
         # Cleanup if scraper was created but setup failed
         if scraper:
             try:
-                await cleanup_scraper(scraper)
+                reap_scraper(scraper)
             except:
                 pass
         raise
 
-async def cleanup_scraper(scraper: WebScraper):
-    """Cleanup scraper resources with robust error handling"""
+def reap_scraper(scraper: Optional[WebScraper]) -> None:
+    """Hand a scraper to the background reaper: the response and the queue slot do not wait for teardown."""
+    if scraper:
+        warm_contexts.forget(scraper)
+        browser_reaper.submit(scraper)
+
+
+async def release_scraper(scraper: Optional[WebScraper], domain: Optional[str]) -> None:
+    """After a successful request: keep the browser warm for its domain (WARM_CONTEXTS_ENABLED), else reap it."""
     if not scraper:
         return
-    
+    if WARM_CONTEXTS_ENABLED:
+        await warm_contexts.park(scraper, domain)
+    else:
+        reap_scraper(scraper)
+
+
+def _on_browser_reaped() -> None:
+    # A browser is gone: re-sample memory and let queued jobs start
+    resource_monitor.invalidate()
+    scrape_scheduler.notify()
+
+
+browser_reaper = BrowserReaper(REAPER_MAX_CONCURRENT, REAPER_TIMEOUT_SEC, on_reaped=_on_browser_reaped)
+
+# Warm contexts (optional): idle live browsers kept per domain for WARM_CONTEXT_IDLE_SEC after a successful
+# request, at most WARM_CONTEXT_MAX per worker and WARM_CONTEXT_MAX_MB of browser RSS (LRU eviction)
+WARM_CONTEXTS_ENABLED = os.getenv("WARM_CONTEXTS_ENABLED", "false").lower() == "true"
+WARM_CONTEXT_MAX = max(1, int(os.getenv("WARM_CONTEXT_MAX", "4")))
+WARM_CONTEXT_MAX_MB = float(os.getenv("WARM_CONTEXT_MAX_MB", "1024"))
+WARM_CONTEXT_IDLE_SEC = float(os.getenv("WARM_CONTEXT_IDLE_SEC", "180"))
+warm_contexts = WarmContextPool(
+    reap_scraper,
+    max_entries=WARM_CONTEXT_MAX,
+    max_memory_mb=WARM_CONTEXT_MAX_MB,
+    idle_sec=WARM_CONTEXT_IDLE_SEC,
+    max_uses=int(os.getenv("WARM_CONTEXT_MAX_USES", "50")),
+)
+
+# Bytes per scrape (CDP Network events, BANDWIDTH_ACCOUNTING), aggregated per domain / request mode / API key
+bandwidth = BandwidthAccounting()
+
+# Background proxy health probe: every PROXY_TEST_INTERVAL seconds, all configured proxies are checked
+# concurrently against PROXY_PROBE_URL over pooled HTTP connections (no browser); results feed bans and weights
+PROXY_PROBE_ENABLED = os.getenv("PROXY_PROBE_ENABLED", "true").lower() == "true"
+proxy_prober = ProxyProber(
+    get_proxy_registry(),
+    probe_url=os.getenv("PROXY_PROBE_URL", "http://httpbin.org/ip"),
+    timeout_sec=float(os.getenv("PROXY_PROBE_TIMEOUT_SEC", "5")),
+    concurrency=int(os.getenv("PROXY_PROBE_CONCURRENCY", "100")),
+    interval_sec=int(os.getenv("PROXY_TEST_INTERVAL", "3600")),
+)
+
+# Hedged navigation (optional): if the first navigation has not committed after the domain's HEDGE_PERCENTILE
+# latency, the same URL is opened on another proxy and the first success is used; hedges stay below
+# HEDGE_MAX_RATIO of navigations (per worker)
+HEDGE_ENABLED = os.getenv("HEDGE_ENABLED", "false").lower() == "true"
+hedge_policy = HedgePolicy(
+    percentile=float(os.getenv("HEDGE_PERCENTILE", "0.9")),
+    min_samples=int(os.getenv("HEDGE_MIN_SAMPLES", "20")),
+    max_ratio=float(os.getenv("HEDGE_MAX_RATIO", "0.05")),
+    min_delay_sec=float(os.getenv("HEDGE_MIN_DELAY_SEC", "1.0")),
+)
+
+
+# Pre-flight (optional, on by default): before a browser is launched, the target host is checked through the chosen
+# proxy (DNS, TCP, CONNECT, TLS handshake) within PREFLIGHT_TIMEOUT_SEC; results are cached per host and proxy
+PREFLIGHT_ENABLED = os.getenv("PREFLIGHT_ENABLED", "true").lower() == "true"
+preflight = Preflight(
+    timeout_sec=float(os.getenv("PREFLIGHT_TIMEOUT_SEC", "3")),
+    cache_sec=float(os.getenv("PREFLIGHT_CACHE_SEC", "30")),
+)
+
+
+async def _preflight(scraper: WebScraper, url: str, domain: Optional[str]) -> None:
+    """Check url through the proxy the scraper will use; an unusable proxy is banned and replaced once."""
+    for attempt in range(2):
+        entry = None
+        if scraper.config.PROXY_ENABLED and scraper.proxy_list:
+            entry = scraper.proxies.next_available(scraper.current_proxy_index)
+        result = await preflight.check(url, entry)
+        if result["ok"]:
+            if result["inconclusive"]:
+                logger.info(f"🐢 Pre-flight inconclusive for {url} ({result['error']}), leaving it to the browser")
+            return
+        replacement = None
+        if result["blame"] == "proxy" and entry is not None:
+            logger.warning(f"⚠️ Pre-flight: proxy {entry.url} unusable ({result['error']})")
+            scraper.mark_proxy_failed(entry.url)
+            if not attempt:
+                replacement = scraper.proxies.choose(domain, exclude=entry.index)
+        if replacement is None:
+            logger.warning(f"🚫 Pre-flight failed for {url}: {result['error']}")
+            raise PreflightError(f"Pre-flight failed: {result['error']}", result["stage"], result["blame"])
+        scraper.current_proxy_index = replacement.index
+
+
+def _record_hedge_latency(scraper: WebScraper, domain: Optional[str]) -> None:
+    status = scraper.last_response_status
+    if status is None or status < 400:
+        hedge_policy.record(domain, scraper.last_navigation_sec)
+
+
+def _reap_launched(task: asyncio.Task) -> None:
+    """Done callback of a backup browser launch whose navigation lost (or never started): reap it, free its slot."""
+    resource_monitor.on_finish()
+    if not task.cancelled() and task.exception() is None:
+        reap_scraper(task.result())
+
+
+async def _navigate_hedged(
+    scraper: WebScraper, url: str, light_mode: bool = False, resolution: Optional[str] = None
+) -> WebScraper:
+    """
+    scraper.navigate_to_url(url), hedged when HEDGE_ENABLED: if the main frame has not committed after the
+    domain's latency percentile, the navigation also starts on another proxy and the first success wins.
+    The losing browser is cancelled and reaped. Returns the scraper to continue with; if both attempts fail,
+    the first attempt's error is raised (its scraper is left to the caller, as without hedging).
+    """
+    domain = _get_domain_from_url(url)
+    hedge_policy.note_navigation()
+    delay = hedge_policy.delay_for(domain) if HEDGE_ENABLED and scraper.proxy_entry is not None else None
+    if delay is None:
+        await scraper.navigate_to_url(url)
+        _record_hedge_latency(scraper, domain)
+        return scraper
+
+    started = time.monotonic()
+    primary = asyncio.create_task(scraper.navigate_to_url(url))
+    launch: Optional[asyncio.Task] = None
+    backup: Optional[asyncio.Task] = None
+    winner: Optional[asyncio.Task] = None
+
+    async def _backup() -> WebScraper:
+        # Shielded: a cancelled race must not abandon a half-started browser (it is reaped by _reap_launched)
+        backup_scraper = await asyncio.shield(launch)
+        backup_scraper._light_mode = light_mode
+        if backup_scraper.current_proxy_index == scraper.current_proxy_index:
+            raise RuntimeError("no other proxy available")
+        await backup_scraper.navigate_to_url(url)
+        return backup_scraper
+
     try:
-        # Set a maximum timeout for cleanup (30 seconds)
-        await asyncio.wait_for(scraper.close(), timeout=30.0)
-    except asyncio.TimeoutError:
-        logger.error("❌ Cleanup timeout - browser resources may not be fully released")
-        # Force cleanup by setting resources to None
-        try:
-            scraper.page = None
-            scraper.context = None
-            scraper.browser = None
-            if hasattr(scraper, 'playwright'):
-                scraper.playwright = None
-        except:
-            pass
-    except Exception as e:
-        error_msg = str(e)
-        # EPIPE errors are expected when browser process already terminated
-        if 'EPIPE' not in error_msg and 'broken pipe' not in error_msg.lower():
-            logger.error(f"❌ Cleanup error: {e}")
-        else:
-            logger.debug(f"Cleanup EPIPE error (expected): {e}")
-        # Ensure resources are cleaned up even on error
-        try:
-            scraper.page = None
-            scraper.context = None
-            scraper.browser = None
-            if hasattr(scraper, 'playwright'):
-                scraper.playwright = None
-        except:
-            pass
+        await asyncio.wait({primary}, timeout=delay)
+        if primary.done() or scraper.navigation_committed or not resource_monitor.can_start() or not hedge_policy.try_acquire():
+            await primary
+            _record_hedge_latency(scraper, domain)
+            return scraper
+
+        logger.info(f"🪁 No commit from {domain} after {delay:.1f}s (proxy index {scraper.current_proxy_index}), hedging on another proxy")
+        # The backup browser counts as a running scrape until one of the two browsers is reaped
+        resource_monitor.on_start()
+        launch = asyncio.create_task(
+            get_scraper(domain=domain, light_mode=light_mode, resolution=resolution, avoid_proxy=scraper.current_proxy_index, url=url)
+        )
+        backup = asyncio.create_task(_backup())
+        pending = {primary, backup}
+        while pending and winner is None:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            # On a tie the first attempt wins (its context already holds the domain session)
+            for task in (primary, backup):
+                if winner is None and task in done and task.exception() is None:
+                    winner = task
     finally:
-        # Don't remove from pool since we're not using pool anymore
-        pass
+        unfinished = [task for task in (primary, backup) if task is not None and not task.done()]
+        for task in unfinished:
+            task.cancel()
+        if launch is not None and (winner is None or winner is primary):
+            launch.add_done_callback(_reap_launched)
+        if unfinished:
+            await asyncio.gather(*unfinished, return_exceptions=True)
+
+    backup_scraper = None
+    if launch.done() and not launch.cancelled() and launch.exception() is None:
+        backup_scraper = launch.result()
+    # A failed attempt counts against its proxy like any failed navigation (the caller's error path does
+    # it for the first attempt when both failed)
+    failed = []
+    if winner is backup and primary.done() and not primary.cancelled() and primary.exception() is not None:
+        failed.append(scraper)
+    if backup_scraper is not None and backup_scraper.current_proxy_index != scraper.current_proxy_index:
+        if not backup.cancelled() and backup.exception() is not None:
+            failed.append(backup_scraper)
+    for failed_scraper in failed:
+        proxy_info = failed_scraper.get_current_proxy_info()
+        if proxy_info:
+            failed_scraper.mark_proxy_failed(proxy_info["url"])
+    if winner is None:
+        raise primary.exception()
+
+    hedge_policy.record_outcome(winner is backup)
+    winning_scraper = scraper if winner is primary else backup_scraper
+    _record_hedge_latency(winning_scraper, domain)
+    if winner is backup:
+        # The slow attempt never finished: its elapsed time is still a (lower bound) latency sample for the proxy
+        if primary.cancelled() and scraper.proxy_entry is not None:
+            scraper.proxies.record_navigation(scraper.proxy_entry.index, domain, time.monotonic() - started, True)
+        logger.info(f"🪁 Backup navigation won for {domain} (proxy index {backup_scraper.current_proxy_index})")
+        reap_scraper(scraper)
+        # The job's own slot now covers the backup browser
+        resource_monitor.on_finish()
+    return winning_scraper
+
+
+def _resource_admission(job: ScrapeJob) -> bool:
+    """Memory/fd admission; under pressure, idle warm browsers are the first memory given back."""
+    if resource_monitor.can_start():
+        return True
+    if len(warm_contexts) and not browser_reaper.pending and warm_contexts.evict_oldest():
+        logger.info("🧊 Memory pressure: closed an idle warm browser")
+    return False
+
+
+scrape_scheduler.add_admission_check(_resource_admission)
 
 @app.post("/")
 async def root():
@@ -856,6 +1378,8 @@ async def root():
         "endpoints": [
             "/health",
             "/scrape",
+            "/queue",
+            "/usage",
             "/proxies",
             "/test-proxy"
         ]
@@ -871,6 +1395,79 @@ async def health_check(api_key: str = Depends(verify_api_key)):
         "api_key": api_key[:20] + "..."
     }
 
+@app.post("/queue")
+async def queue_status(api_key: str = Depends(verify_api_key)):
+    """
+    Scheduler state plus position and estimated wait of the caller's queued jobs. Admin keys get every
+    tenant's jobs and the sections naming target domains, proxies and worker processes.
+    """
+    if not _is_admin(api_key):
+        return {
+            "scheduler": scrape_scheduler.snapshot(api_key=api_key),
+            "resources": resource_monitor.snapshot(),
+            "hedging": hedge_policy.snapshot() if HEDGE_ENABLED else None,
+            "preflight": preflight.snapshot() if PREFLIGHT_ENABLED else None,
+            "jobs": scrape_scheduler.queue_estimates(api_key=api_key),
+            "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
+        }
+    return {
+        "scheduler": scrape_scheduler.snapshot(),
+        "domains": domain_limiter.snapshot(),
+        "resources": resource_monitor.snapshot(),
+        "watchdog": scrape_watchdog.snapshot(),
+        "reaper": browser_reaper.snapshot(),
+        "sessions": {**session_store.snapshot(), "capture": session_capture.stats()},
+        "warm_contexts": warm_contexts.snapshot() if WARM_CONTEXTS_ENABLED else None,
+        "profiles": get_profile_manager().snapshot() if get_profile_manager() is not None else None,
+        "asset_cache": get_asset_cache().snapshot() if get_asset_cache() is not None else None,
+        "proxies": {**get_proxy_registry().snapshot(), "top": get_proxy_registry().proxy_stats(limit=20), "probe": proxy_prober.snapshot()},
+        "bandwidth": bandwidth.snapshot(),
+        "hedging": hedge_policy.snapshot() if HEDGE_ENABLED else None,
+        "preflight": preflight.snapshot() if PREFLIGHT_ENABLED else None,
+        "workers": await _worker_loads(),
+        "shard": int(SHARD_INDEX) if SHARD_INDEX is not None else None,
+        "state_backend": get_state().name,
+        "jobs": scrape_scheduler.queue_estimates(),
+        "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
+    }
+
+@app.post("/queue/{job_id}")
+async def queue_job_status(job_id: str, api_key: str = Depends(verify_api_key)):
+    """Queue position and estimated wait (or running time) of one of the caller's jobs (any job for admin keys)."""
+    tenant = None if _is_admin(api_key) else api_key
+    status = scrape_scheduler.job_status(job_id, api_key=tenant)
+    if status is None:
+        # Queued or running on another worker, or finished recently
+        try:
+            record = await get_state().aget(f"job:{job_id}")
+        except Exception:
+            record = None
+        if isinstance(record, dict):
+            status = {k: v for k, v in record.items() if k != "owner"}
+            if tenant is not None and record.get("owner") != _key_owner(tenant):
+                # Other tenants' jobs are indistinguishable from unknown ones
+                status = None
+    if status is None:
+        raise HTTPException(status_code=404, detail="Job not found (expired or unknown)")
+    return status
+
+@app.post("/usage")
+async def key_usage(api_key: str = Depends(verify_api_key)):
+    """Caller's usage against its rate limit and quotas; every API key's for admin keys (capacity planning)."""
+    keys = set(VALID_API_KEYS) | await key_quotas.known_keys() if _is_admin(api_key) else {api_key}
+    usage = {}
+    for key in sorted(keys):
+        # Short label: enough to tell keys apart, not enough to reconstruct one
+        usage[key[:8] + "..."] = {
+            **await key_quotas.usage(key, scrape_scheduler.active_for_key(key), scrape_scheduler.queued_for_key(key)),
+            "bandwidth": await bandwidth.key_usage(key),
+        }
+    return {
+        "api_keys": usage,
+        "limits_file": API_KEY_LIMITS_FILE or None,
+        "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
+    }
+
 def clean_text(text: str) -> str:
     """Clean text by removing excessive whitespace"""
     if not text:
@@ -1481,8 +2078,17 @@ async def extract_collection_attributes(scraper: WebScraper, selector: str, attr
         }}
     """)
 
-async def extract_collection_with_fields(scraper: WebScraper, selector: str, fields: Dict[str, Union[str, FieldSelector]], debug: bool = False) -> List[Dict[str, Any]]:
-    """Extract collection with multiple fields"""
+def _build_collection_fields_script(
+    fields: Dict[str, Union[str, FieldSelector]],
+    elements_js: str,
+    debug: bool = False,
+    params: str = "",
+) -> str:
+    """
+    Build the page function that extracts `fields` from every element returned by `elements_js`.
+    `elements_js` is a JS expression yielding an array-like of elements (e.g. querySelectorAll,
+    or the pending nodes drained from a scroll observer); `params` is the function parameter list.
+    """
     # Parse fields to extract selectors and attributes
     field_configs = {}
     for field_name, field_value in fields.items():
@@ -1774,11 +2380,10 @@ async def extract_collection_with_fields(scraper: WebScraper, selector: str, fie
     # Debug: Log the JavaScript code
     logger.info(f"🔍 JavaScript code for collection: {js_code}")
     
-    results = await scraper.page.evaluate(f"""
-        () => {{
-            const elements = document.querySelectorAll('{selector}');
+    return f"""
+        ({params}) => {{
+            const elements = {elements_js};
             console.log('Found elements:', elements.length);
-            console.log('Selector:', '{selector}');
             let currentCategory = '';
             const results = [];
             
@@ -1804,10 +2409,11 @@ async def extract_collection_with_fields(scraper: WebScraper, selector: str, fie
             console.log('Final results:', results);
             return results;
         }}
-    """)
-    
-    logger.info(f"🔍 Collection results: {results}")
-    
+    """
+
+
+async def _clean_collection_results(scraper: WebScraper, results: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Clean whitespace in extracted field values and resolve `<field>_url` image fields to binary data."""
     # Clean up whitespace in Python and process image URLs
     cleaned_results = []
     for result in results:
@@ -1856,6 +2462,19 @@ async def extract_collection_with_fields(scraper: WebScraper, selector: str, fie
     return cleaned_results
 
 
+async def extract_collection_with_fields(scraper: WebScraper, selector: str, fields: Dict[str, Union[str, FieldSelector]], debug: bool = False) -> List[Dict[str, Any]]:
+    """Extract collection with multiple fields"""
+    logger.info(f"🔍 Collection selector: {selector}")
+    script = _build_collection_fields_script(
+        fields, f"document.querySelectorAll('{selector}')", debug=debug
+    )
+    results = await scraper.page.evaluate(script)
+    
+    logger.info(f"🔍 Collection results: {results}")
+    
+    return await _clean_collection_results(scraper, results)
+
+
 @app.get("/scrape")
 async def scrape_usage():
     """Return usage hint when GET is used instead of POST."""
@@ -1898,6 +2517,9 @@ async def scrape_website(
     - resolution: Viewport size, e.g. "1024x768" (optional)
     - get: Dictionary of single element extractions
     - collect: Dictionary of collection extractions
+    - priority: Priority class (default: DEFAULT_PRIORITY_CLASS)
+    - job_id: Optional client-chosen id for POST /queue/{job_id}
+    - deadline: Seconds until the result is needed (early 429 + Retry-After if the queue cannot make it)
     
     Supported Proxy Types:
     - HTTP: http://proxy.com:8080
@@ -1908,27 +2530,119 @@ async def scrape_website(
     """
     global _scrape_active_count, _scrape_pending_count, _scrape_active_starts
 
-    # Reject if system overloaded (high load can starve event loop, preventing timeouts)
-    load = _get_system_load()
-    if load > LOAD_REJECT_THRESHOLD:
-        logger.warning(f"⚠️ Load {load:.1f} > {LOAD_REJECT_THRESHOLD}, rejecting request (system overloaded)")
+    # Malformed scroll options are a client error, rejected before the request is queued
+    if request.scroll is not None:
+        try:
+            _parse_scroll_options(request.scroll)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    # Priority classes are per key (limits file): a key cannot jump ahead of others on its own say-so
+    priority_class = scrape_scheduler.resolve_class(request.priority)
+    if not key_quotas.allows_priority(api_key, priority_class):
+        allowed = ", ".join(key_quotas.limits_for(api_key).priorities or [])
+        logger.warning(f"⚠️ API key {api_key[:20]}... asked for priority class '{priority_class}' (allowed: {allowed})")
         return JSONResponse(
-            status_code=503,
+            status_code=403,
             content={
                 "success": False,
-                "error": f"System overloaded (load {load:.1f}). Try again later or restart the server.",
+                "error": f"Priority class '{priority_class}' is not allowed for this API key (allowed: {allowed or 'none'})",
                 "url": str(request.url),
             },
         )
 
-    # Reject if queue is full
-    if _scrape_pending_count + _scrape_active_count >= MAX_QUEUE_SIZE:
-        logger.warning(f"⚠️ Queue full ({_scrape_pending_count} waiting, {_scrape_active_count} active), rejecting request")
+    # Reject if memory or file descriptors are nearly exhausted (queueing would only delay an OOM kill)
+    overload = resource_monitor.overload_reason()
+    if overload:
+        logger.warning(f"⚠️ System overloaded: {overload}, rejecting request")
         return JSONResponse(
             status_code=503,
+            content={
+                "success": False,
+                "error": f"System overloaded: {overload}. Try again later.",
+                "url": str(request.url),
+            },
+        )
+
+    # Reject if queue is full (across all workers): Retry-After = time for enough jobs to finish to make room
+    queue_size = await _cluster_queue_size()
+    if queue_size >= MAX_QUEUE_SIZE:
+        excess = queue_size - MAX_QUEUE_SIZE + 1
+        retry_after = max(1, math.ceil(
+            excess * scrape_scheduler.average_duration(scrape_scheduler.default_class) / (MAX_CONCURRENT_SCRAPES * API_WORKERS)
+        ))
+        logger.warning(f"⚠️ Queue full ({_scrape_pending_count} waiting, {_scrape_active_count} active), rejecting request (retry after {retry_after}s)")
+        return JSONResponse(
+            status_code=429,
+            headers={"Retry-After": str(retry_after)},
             content={
                 "success": False,
                 "error": "Too busy, try again",
+                "retry_after": retry_after,
+                "url": str(request.url),
+            },
+        )
+
+    # Expected queue wait from moving averages of duration and arrival rate; reject early if past the deadline
+    estimate = scrape_scheduler.estimate_admission(request.priority, api_key, request.deadline)
+    if not estimate["feasible"]:
+        retry_after = max(1, math.ceil(estimate["retry_after_sec"]))
+        logger.warning(
+            f"⚠️ Deadline {request.deadline:g}s not reachable (wait ~{estimate['estimated_wait_sec']}s + "
+            f"scrape ~{estimate['expected_duration_sec']}s), rejecting request (retry after {retry_after}s)"
+        )
+        return JSONResponse(
+            status_code=429,
+            headers={"Retry-After": str(retry_after)},
+            content={
+                "success": False,
+                "error": "Deadline cannot be met: expected queue wait plus scrape time exceeds it",
+                "estimated_wait_sec": estimate["estimated_wait_sec"],
+                "expected_start": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(time.time() + estimate["estimated_wait_sec"])),
+                "expected_duration_sec": estimate["expected_duration_sec"],
+                "retry_after": retry_after,
+                "url": str(request.url),
+            },
+        )
+
+    job_id = request.job_id or str(uuid.uuid4())[:8]
+    if scrape_scheduler.has_job(job_id) or await _job_in_flight_elsewhere(job_id):
+        job_id = str(uuid.uuid4())[:8]
+    job = ScrapeJob(
+        job_id,
+        api_key,
+        request.priority,
+        domain=_get_domain_from_url(str(request.url)),
+        url=str(request.url),
+    )
+
+    # Per-key rate limit and queue quota (max concurrent is enforced by the scheduler)
+    try:
+        await key_quotas.check_request(
+            api_key,
+            scrape_scheduler.queued_for_key(api_key),
+            retry_hint_sec=scrape_scheduler.average_duration(scrape_scheduler.resolve_class(request.priority)),
+        )
+    except KeyBlocked as e:
+        logger.warning(f"⚠️ API key {api_key[:20]}... rejected: {e.reason}")
+        return JSONResponse(
+            status_code=403,
+            content={
+                "success": False,
+                "error": e.reason,
+                "url": str(request.url),
+            },
+        )
+    except QuotaExceeded as e:
+        retry_after = max(1, math.ceil(e.retry_after))
+        logger.warning(f"⚠️ API key {api_key[:20]}... over limit: {e.reason} (retry after {retry_after}s)")
+        return JSONResponse(
+            status_code=429,
+            headers={"Retry-After": str(retry_after)},
+            content={
+                "success": False,
+                "error": e.reason,
+                "retry_after": retry_after,
                 "url": str(request.url),
             },
         )
@@ -1936,31 +2650,49 @@ async def scrape_website(
     _scrape_pending_count += 1
     _log_queue_status()
 
-    # Load <= threshold: acquire scrape_semaphore directly (up to max 10). Load > threshold: wait, then only 1 passes (load gate).
+    # Start-time hint while the request waits: POST /queue/{job_id} returns it from the queued status
+    expected_start = time.time() + estimate["estimated_wait_sec"]
+    logger.info(f"🕒 Job {job.job_id} expected to start in ~{estimate['estimated_wait_sec']}s")
+    _publish_job_status(
+        job,
+        "queued",
+        estimated_wait_sec=estimate["estimated_wait_sec"],
+        expected_start=time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(expected_start)),
+    )
+
+    # Wait for a scheduler slot (admission covers priority, quotas, domain politeness and resources)
     acquired = False
-    load_gate_held = False
     scrape_held = False
     try:
-        if _get_system_load() > LOAD_THRESHOLD:
-            while True:
-                async with _load_condition:
-                    while _get_system_load() > LOAD_THRESHOLD:
-                        await _load_condition.wait()
-                await _load_gate_semaphore.acquire()
-                load_gate_held = True
-                if _get_system_load() <= LOAD_THRESHOLD:
-                    break
-                _load_gate_semaphore.release()
-                load_gate_held = False
-
-        await scrape_semaphore.acquire()
+        try:
+            await asyncio.wait_for(scrape_scheduler.acquire(job), timeout=request.deadline)
+        except asyncio.TimeoutError:
+            _scrape_pending_count -= 1
+            _publish_job_status(job, "dropped")
+            retry_after = max(1, math.ceil(scrape_scheduler.average_duration(job.priority)))
+            logger.warning(f"⏱️ Job {job.job_id} not started within its {request.deadline:g}s deadline, dropped from queue")
+            return JSONResponse(
+                status_code=429,
+                headers={"Retry-After": str(retry_after)},
+                content={
+                    "success": False,
+                    "error": f"Deadline ({request.deadline:g}s) passed while queued",
+                    "job_id": job.job_id,
+                    "retry_after": retry_after,
+                    "url": str(request.url),
+                },
+            )
         scrape_held = True
         acquired = True
         _scrape_pending_count -= 1
         _scrape_active_count += 1
         _scrape_active_starts.append(time.time())
+        # Hard deadline: if the scrape hangs past the timeout, the watchdog kills its browsers and frees the slot
+        watch_token = scrape_watchdog.track(job.job_id, SCRAPE_TIMEOUT_SEC, on_expire=lambda: scrape_scheduler.release(job))
+        result = None
         try:
-            logger.info(f"▶️ Request started (load {_get_system_load():.1f}), queue: {_scrape_pending_count} waiting, {_scrape_active_count} active")
+            queue_wait = job.started_at - job.enqueued_at
+            logger.info(f"▶️ Request started (job {job.job_id}, {job.priority}, waited {queue_wait:.1f}s, {resource_monitor.describe()}), queue: {_scrape_pending_count} waiting, {_scrape_active_count} active")
             async def _run_scrape():
                 if not request.get and not request.collect:
                     logger.info("🎯 Simple HTML source request")
@@ -1968,14 +2700,23 @@ async def scrape_website(
                 else:
                     logger.info("🎯 Using unified format")
                     return await scrape_unified(request, api_key, http_request)
-            return await asyncio.wait_for(_run_scrape(), timeout=SCRAPE_TIMEOUT_SEC)
+            result = await asyncio.wait_for(_run_scrape(), timeout=SCRAPE_TIMEOUT_SEC)
+            if isinstance(result, dict):
+                result["job_id"] = job.job_id
+                result["priority"] = job.priority
+                result["queue_wait"] = round(queue_wait, 3)
+            return result
         finally:
+            # Bytes of all browsers of this job (also on failure); the returned dict gets its totals
+            traffic = bandwidth.finish(job.job_id, job.domain, api_key, "light" if request.light_mode else "full")
+            if isinstance(result, dict):
+                result["bandwidth"] = traffic
+            scrape_watchdog.untrack(job.job_id, watch_token)
             _scrape_active_count -= 1
             if _scrape_active_starts:
                 _scrape_active_starts.pop(0)
-            scrape_semaphore.release()
-            if load_gate_held:
-                _load_gate_semaphore.release()
+            scrape_scheduler.release(job)
+            _publish_worker_load()
             logger.info(f"✅ Request finished, queue: {_scrape_pending_count} waiting, {_scrape_active_count} active")
     except asyncio.TimeoutError:
         logger.warning(f"⏱️ Scrape timeout after {SCRAPE_TIMEOUT_SEC}s - slot released, queue: {_scrape_pending_count} waiting, {_scrape_active_count} active")
@@ -1990,10 +2731,8 @@ async def scrape_website(
     except Exception as e:
         if not acquired:
             _scrape_pending_count -= 1
-            if load_gate_held:
-                _load_gate_semaphore.release()
             if scrape_held:
-                scrape_semaphore.release()
+                scrape_scheduler.release(job)
         logger.exception("❌ Scrape endpoint error")
         return JSONResponse(
             status_code=500,
@@ -2018,34 +2757,53 @@ _CHALLENGE_TITLE_PATTERNS = (
     "attention required",
     "one more step",
 )
-_CHALLENGE_BODY_PATTERNS = (
+_CHALLENGE_TEXT_PATTERNS = (
     "performing security verification",
-    "cf-turnstile",
     "enable javascript and cookies",
     "checking your browser before accessing",
     "please allow up to 5 seconds",
-    "cf-browser-verification",
-    "challenge-running",
-    "jschl-answer",
+)
+# Elements only challenge pages have (cf-turnstile, cf-browser-verification, challenge-running, jschl-answer)
+_CHALLENGE_MARKERS = (
+    ".cf-turnstile",
+    "#cf-browser-verification",
+    ".cf-browser-verification",
+    "#challenge-running",
+    ".challenge-running",
+    "#jschl-answer",
+    "[name='jschl-answer']",
 )
 # Broad patterns: may appear on normal pages using Cloudflare CDN - require iframe to confirm
-_CHALLENGE_BODY_PATTERNS_BROAD = ("cloudflare", "ray id")
-
-
-async def _has_challenge_iframe(scraper: WebScraper) -> bool:
-    """True if challenge/turnstile iframe is present (strong signal of actual challenge)."""
-    try:
-        if not scraper or not scraper.page or scraper.page.is_closed():
-            return False
-        for sel in ["iframe[src*='turnstile']", "iframe[src*='challenges']"]:
-            try:
-                if scraper.page.locator(sel).count() > 0:
-                    return True
-            except Exception:
-                continue
-        return False
-    except Exception:
-        return False
+_CHALLENGE_TEXT_PATTERNS_BROAD = ("cloudflare", "ray id")
+_CHALLENGE_IFRAMES = ("iframe[src*='turnstile']", "iframe[src*='challenges']")
+
+
+def _alternation(patterns: Tuple[str, ...]) -> str:
+    """One case-insensitive regex source matching any of patterns (valid in Python and JS)."""
+    return "|".join(re.escape(p) for p in patterns)
+
+
+# Arguments of the in-page check, built once: each pattern set is a single alternation (one scan per set;
+# V8 caches the compiled RegExp by source) and each selector list a single querySelector
+_CHALLENGE_CHECK_ARGS = [
+    _alternation(_CHALLENGE_TITLE_PATTERNS),
+    _alternation(_CHALLENGE_TEXT_PATTERNS),
+    _alternation(_CHALLENGE_TEXT_PATTERNS_BROAD),
+    ", ".join(_CHALLENGE_MARKERS),
+    ", ".join(_CHALLENGE_IFRAMES),
+]
+# Verdict {challenge, reason, iframe} from one evaluate: no HTML serialization or transfer to Python
+_CHALLENGE_CHECK_JS = """
+([title, text, broad, markers, iframes]) => {
+    const iframe = document.querySelector(iframes) !== null;
+    if (new RegExp(title, 'i').test(document.title || '')) return {challenge: true, reason: 'title', iframe};
+    if (document.querySelector(markers) !== null) return {challenge: true, reason: 'marker', iframe};
+    const body = document.body ? (document.body.textContent || '') : '';
+    if (new RegExp(text, 'i').test(body)) return {challenge: true, reason: 'text', iframe};
+    if (iframe && new RegExp(broad, 'i').test(body)) return {challenge: true, reason: 'iframe', iframe};
+    return {challenge: false, reason: null, iframe};
+}
+"""
 
 
 async def _is_challenge_page(scraper: WebScraper) -> bool:
@@ -2057,23 +2815,21 @@ async def _is_challenge_page(scraper: WebScraper) -> bool:
     try:
         if not scraper or not scraper.page or scraper.page.is_closed():
             return False
-        title = (await scraper.page.title()).lower()
-        for p in _CHALLENGE_TITLE_PATTERNS:
-            if p in title:
-                return True
-        body = (await scraper.page.content()).lower()
-        has_iframe = await _has_challenge_iframe(scraper)
-        for p in _CHALLENGE_BODY_PATTERNS:
-            if p in body:
-                return True
-        for p in _CHALLENGE_BODY_PATTERNS_BROAD:
-            if p in body and has_iframe:
-                return True
-        return False
+        challenged = await _detect_challenge(scraper)
+        scraper.record_challenge(challenged)
+        return challenged
     except Exception:
         return False
 
 
+async def _detect_challenge(scraper: WebScraper) -> bool:
+    verdict = await scraper.page.evaluate(_CHALLENGE_CHECK_JS, _CHALLENGE_CHECK_ARGS)
+    if verdict.get("challenge"):
+        logger.debug(f"🛡️ Challenge page ({verdict.get('reason')}, iframe={verdict.get('iframe')})")
+        return True
+    return False
+
+
 def _challenge_wait_sec() -> float:
     """Random wait for challenge page (human-like)."""
     try:
@@ -2433,6 +3189,250 @@ async def execute_clicks(
     logger.info(f"✅ All click operations completed")
     return True
 
+
+# Infinite scroll: page-side observer state is kept under this window property (one entry per collect key)
+_SCROLL_STATE_JS = "window.__fairscrapperScroll"
+
+# Installs a MutationObserver that queues every element matching the selector exactly once
+# (WeakSet of seen nodes). Existing matches are queued immediately; new ones as they are added.
+_SCROLL_OBSERVER_JS = f"""
+([key, selector]) => {{
+    const root = {_SCROLL_STATE_JS} = {_SCROLL_STATE_JS} || {{}};
+    if (root[key]) return root[key].total;
+    const state = {{ seen: new WeakSet(), pending: [], total: 0, observer: null }};
+    const take = (el) => {{
+        if (state.seen.has(el)) return;
+        state.seen.add(el);
+        state.pending.push(el);
+        state.total++;
+    }};
+    const scan = (node) => {{
+        if (!node || node.nodeType !== 1) return;
+        if (node.matches(selector)) take(node);
+        node.querySelectorAll(selector).forEach(take);
+    }};
+    document.querySelectorAll(selector).forEach(take);
+    state.observer = new MutationObserver((mutations) => {{
+        for (const m of mutations) {{
+            for (const n of m.addedNodes) scan(n);
+        }}
+    }});
+    state.observer.observe(document.documentElement, {{ childList: true, subtree: true }});
+    root[key] = state;
+    return state.total;
+}}
+"""
+
+# Drains the pending queue of a collect key (JS expression used as the element source for extraction)
+_SCROLL_DRAIN_JS = f"(({_SCROLL_STATE_JS} || {{}})[key] || {{ pending: [] }}).pending.splice(0)"
+
+
+def _build_scroll_drain_script(selector: str, fields: Dict[str, Any], debug: bool = False) -> str:
+    """Page function (arg: collect key) that extracts only the newly observed items of a collect key."""
+    if fields:
+        return _build_collection_fields_script(fields, _SCROLL_DRAIN_JS, debug=debug, params="key")
+    _, attr = parse_selector_and_attr(selector)
+    if attr:
+        value_js = f"el.getAttribute('{attr}') || ''"
+    else:
+        value_js = "el.innerText || el.textContent || ''"
+    return f"""
+        (key) => {{
+            const elements = {_SCROLL_DRAIN_JS};
+            return elements.map(el => {value_js});
+        }}
+    """
+
+
+def _parse_scroll_options(scroll: Dict[str, Any]) -> Dict[str, Any]:
+    """Scroll options with defaults applied (ValueError on a malformed value)."""
+    options: Dict[str, Any] = {}
+    for name, cast, default, minimum in (
+        ("max_items", int, 100, 1),
+        ("max_time", float, 30.0, 0.0),
+        ("step_wait", int, 1500, 0),
+        ("idle_steps", int, 3, 1),
+    ):
+        value = scroll.get(name)
+        if value is None:
+            value = default
+        try:
+            number = cast(value)
+        except (TypeError, ValueError, OverflowError):
+            raise ValueError(f"scroll.{name} must be a number, got {value!r}")
+        if not math.isfinite(number):
+            raise ValueError(f"scroll.{name} must be a finite number, got {value!r}")
+        options[name] = max(minimum, number)
+    # The scroll runs inside the request: it cannot outlast the scrape timeout
+    options["max_time"] = min(options["max_time"], float(SCRAPE_TIMEOUT_SEC))
+    container = scroll.get("container")
+    if container is not None and not isinstance(container, str):
+        raise ValueError("scroll.container must be a CSS selector string")
+    options["container"] = container
+    return options
+
+
+async def execute_scroll_collect(
+    scraper: WebScraper,
+    collect: Dict[str, Dict[str, Any]],
+    scroll: Dict[str, Any],
+    debug: bool = False,
+    errors: Optional[List[str]] = None,
+) -> Tuple[Dict[str, List[Any]], Dict[str, Any]]:
+    """
+    Scroll an infinite-scroll page and extract 'collect' items incrementally.
+
+    A MutationObserver per collect key queues newly added nodes matching its selector; after each
+    scroll step only the queued nodes are extracted, so every item is extracted exactly once and
+    per-step cost is proportional to the new items, not to the whole page.
+
+    Scroll options (all optional):
+        max_items: stop when every collect key has this many items (default 100)
+        max_time: time budget in seconds (default 30)
+        step_wait: max wait for new items after each scroll, milliseconds (default 1500)
+        idle_steps: stop after this many consecutive steps without new items (default 3)
+        container: CSS selector of a scrollable element (default: the page)
+
+    Returns:
+        (items per collect key, scroll stats)
+    """
+    options = _parse_scroll_options(scroll)
+    max_items = options["max_items"]
+    max_time = options["max_time"]
+    step_wait_ms = options["step_wait"]
+    idle_steps = options["idle_steps"]
+    container = options["container"]
+
+    items: Dict[str, List[Any]] = {key: [] for key in collect}
+    scripts: Dict[str, str] = {}
+    with_fields: Dict[str, bool] = {}
+    start = time.time()
+
+    for key, config in collect.items():
+        try:
+            selector = config["selector"]
+            css_selector, _ = parse_selector_and_attr(selector)
+            raw_fields = config.get("fields")
+            fields = raw_fields if isinstance(raw_fields, dict) else {}
+            await scraper.page.evaluate(_SCROLL_OBSERVER_JS, [key, css_selector])
+            scripts[key] = _build_scroll_drain_script(selector, fields, debug=debug)
+            with_fields[key] = bool(fields)
+        except Exception as e:
+            msg = f"Scroll observer setup failed for '{key}': {e}"
+            logger.error(f"❌ {msg}")
+            if errors is not None:
+                errors.append(msg)
+
+    scroll_js = """
+        (sel) => {
+            const el = sel ? document.querySelector(sel) : (document.scrollingElement || document.documentElement);
+            if (!el) return false;
+            el.scrollTop = el.scrollHeight;
+            if (!sel) window.scrollTo(0, el.scrollHeight);
+            return true;
+        }
+    """
+    pending_js = f"""
+        (keys) => {{
+            const root = {_SCROLL_STATE_JS} || {{}};
+            return keys.some(k => root[k] && root[k].pending.length > 0);
+        }}
+    """
+    # A key that reached max_items stops observing (its queue would otherwise keep the wait above satisfied)
+    stop_js = f"""
+        (key) => {{
+            const state = ({_SCROLL_STATE_JS} || {{}})[key];
+            if (state) {{
+                if (state.observer) state.observer.disconnect();
+                state.pending = [];
+            }}
+        }}
+    """
+
+    steps = 0
+    idle = 0
+    stop_reason = "idle"
+    logger.info(f"📜 Scroll collect: keys={list(scripts)}, max_items={max_items}, max_time={max_time}s")
+
+    try:
+        while scripts:
+            # Extract only the items observed since the previous step
+            new_items = 0
+            for key, script in scripts.items():
+                if len(items[key]) >= max_items:
+                    continue
+                batch = await scraper.page.evaluate(script, key)
+                if not batch:
+                    continue
+                if with_fields[key]:
+                    batch = await _clean_collection_results(scraper, batch)
+                else:
+                    batch = [clean_text(v) for v in batch if isinstance(v, str) and v.strip()]
+                room = max_items - len(items[key])
+                items[key].extend(batch[:room])
+                new_items += len(batch)
+                if len(items[key]) >= max_items:
+                    await scraper.page.evaluate(stop_js, key)
+
+            if all(len(items[key]) >= max_items for key in scripts):
+                stop_reason = "max_items"
+                break
+            if time.time() - start >= max_time:
+                stop_reason = "max_time"
+                break
+            idle = 0 if new_items else idle + 1
+            if idle >= idle_steps:
+                stop_reason = "idle"
+                break
+
+            if not await scraper.page.evaluate(scroll_js, container):
+                msg = f"Scroll container not found: {container}"
+                logger.warning(f"⚠️ {msg}")
+                if errors is not None:
+                    errors.append(msg)
+                stop_reason = "no_container"
+                break
+            steps += 1
+
+            # Wait until the observer has queued something (or step_wait elapses), bounded by the budget
+            remaining_ms = max(0, int((max_time - (time.time() - start)) * 1000))
+            wait_ms = min(step_wait_ms, remaining_ms)
+            if wait_ms > 0:
+                try:
+                    active = [key for key in scripts if len(items[key]) < max_items]
+                    await scraper.page.wait_for_function(pending_js, arg=active, timeout=wait_ms)
+                except Exception:
+                    pass  # Timeout: no new items this step
+    except Exception as e:
+        error_msg = str(e)
+        if 'EPIPE' in error_msg or ('browser' in error_msg.lower() and 'closed' in error_msg.lower()):
+            raise
+        msg = f"Scroll collect interrupted: {error_msg}"
+        logger.error(f"❌ {msg}")
+        if errors is not None:
+            errors.append(msg)
+        stop_reason = "error"
+    finally:
+        try:
+            await scraper.page.evaluate(f"""
+                () => {{
+                    const root = {_SCROLL_STATE_JS} || {{}};
+                    Object.values(root).forEach(s => s.observer && s.observer.disconnect());
+                    {_SCROLL_STATE_JS} = {{}};
+                }}
+            """)
+        except Exception:
+            pass
+
+    stats = {
+        "steps": steps,
+        "items": {key: len(value) for key, value in items.items()},
+        "elapsed": round(time.time() - start, 3),
+        "stop_reason": stop_reason,
+    }
+    logger.info(f"📜 Scroll collect finished: {stats}")
+    return items, stats
+
 async def scrape_html_source(request: UnifiedScrapeRequest, api_key: str, http_request: Request):
     """Simple HTML source code scraping endpoint"""
     request_id = str(uuid.uuid4())[:8]
@@ -2451,7 +3451,7 @@ async def scrape_html_source(request: UnifiedScrapeRequest, api_key: str, http_r
 
         # Get scraper instance (per-domain session + sticky proxy when available)
         domain = _get_domain_from_url(str(request.url))
-        scraper = await get_scraper(domain=domain, light_mode=request.light_mode, resolution=request.resolution)
+        scraper = await get_scraper(domain=domain, light_mode=request.light_mode, resolution=request.resolution, url=str(request.url))
         scraper._light_mode = request.light_mode
 
         # Start random mouse wander (anti-detection) - skip in light mode to save resources
@@ -2490,7 +3490,22 @@ async def scrape_html_source(request: UnifiedScrapeRequest, api_key: str, http_r
         # Navigate to URL
         logger.info(f"Navigating to: {request.url}")
         try:
-            await scraper.navigate_to_url(str(request.url))
+            navigated = await _navigate_hedged(scraper, str(request.url), request.light_mode, request.resolution)
+            if navigated is not scraper:
+                # A hedged backup won on another browser: move the page tasks over to it
+                scraper = navigated
+                scraper._light_mode = request.light_mode
+                if mouse_wander_stop_event and mouse_wander_task:
+                    mouse_wander_stop_event.set()
+                    await asyncio.gather(mouse_wander_task, return_exceptions=True)
+                    mouse_wander_stop_event = asyncio.Event()
+                    mouse_wander_task = asyncio.create_task(_random_mouse_wander(scraper, mouse_wander_stop_event))
+                if frame_stop_event and frame_task:
+                    frame_stop_event.set()
+                    await asyncio.gather(frame_task, return_exceptions=True)
+                    frame_stop_event = asyncio.Event()
+                    frame_task = asyncio.create_task(_record_debug_frames(scraper, request_id, frame_stop_event, fps=1))
+            _record_navigation_response(scraper, str(request.url))
         except Exception as e:
             error_msg = f"Failed to navigate to URL: {str(e)}"
             logger.error(f"❌ {error_msg}")
@@ -2512,14 +3527,13 @@ async def scrape_html_source(request: UnifiedScrapeRequest, api_key: str, http_r
 
             try:
                 domain = _get_domain_from_url(str(request.url))
-                if domain and domain in domain_sessions:
-                    domain_sessions.pop(domain, None)
+                if domain and _drop_domain_session(domain):
                     logger.info(f"🗑️ Dropped domain session for {domain} due to navigation failure")
             except Exception:
                 pass
 
             try:
-                await cleanup_scraper(scraper)
+                reap_scraper(scraper)
             except Exception:
                 pass
             return {
@@ -2564,9 +3578,8 @@ async def scrape_html_source(request: UnifiedScrapeRequest, api_key: str, http_r
                 if not still_challenge:
                     break
                 logger.info(f"🛡️ Challenge retry {challenge_retries + 1}/{max_challenge_retries}: dropping session, new context")
-                if domain and domain in domain_sessions:
-                    domain_sessions.pop(domain, None)
-                await cleanup_scraper(scraper)
+                _drop_domain_session(domain)
+                reap_scraper(scraper)
                 challenge_retries += 1
                 scraper = await get_scraper(domain=domain, light_mode=request.light_mode, resolution=request.resolution)
                 scraper._light_mode = request.light_mode
@@ -2602,6 +3615,7 @@ async def scrape_html_source(request: UnifiedScrapeRequest, api_key: str, http_r
                 if nav_delay > 0:
                     await asyncio.sleep(nav_delay)
                 await scraper.navigate_to_url(url_str)
+                _record_navigation_response(scraper, url_str)
                 try:
                     await _wait_for_page_ready(scraper, label="retry", light_mode=request.light_mode)
                 except Exception as e:
@@ -2617,7 +3631,7 @@ async def scrape_html_source(request: UnifiedScrapeRequest, api_key: str, http_r
             if "about:blank" in current_url or not current_url:
                 error_msg = "Page failed to load: still about:blank after waits"
                 logger.error(f"❌ {error_msg}")
-                await cleanup_scraper(scraper)
+                reap_scraper(scraper)
                 return {
                     "success": False,
                     "url": str(request.url),
@@ -2735,8 +3749,8 @@ async def scrape_html_source(request: UnifiedScrapeRequest, api_key: str, http_r
             except Exception:
                 pass
 
-        # Return scraper to pool
-        await cleanup_scraper(scraper)
+        # Keep the browser warm for the next request to this domain, or tear it down
+        await release_scraper(scraper, domain)
         
         load_time = time.time() - start_time
         logger.info(f"✅ HTML source extraction completed {request_id}: {len(html_content)} chars in {load_time:.2f}s")
@@ -2746,6 +3760,7 @@ async def scrape_html_source(request: UnifiedScrapeRequest, api_key: str, http_r
             "url": str(request.url),
             "html_source": html_content,
             "content_length": len(html_content),
+            "status_code": scraper.last_response_status,
             "load_time": load_time,
             "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
             "screenshot_path": screenshot_path,
@@ -2782,7 +3797,7 @@ async def scrape_html_source(request: UnifiedScrapeRequest, api_key: str, http_r
         scraper_var = locals().get('scraper')
         if scraper_var:
             try:
-                await cleanup_scraper(scraper_var)
+                reap_scraper(scraper_var)
             except Exception as cleanup_error:
                 logger.error(f"❌ Cleanup failed in exception handler: {cleanup_error}")
         
@@ -2822,7 +3837,7 @@ async def scrape_unified(request: UnifiedScrapeRequest, api_key: str, http_reque
 
         # Get scraper instance (per-domain session + sticky proxy when available)
         domain = _get_domain_from_url(str(request.url))
-        scraper = await get_scraper(domain=domain, light_mode=request.light_mode, resolution=request.resolution)
+        scraper = await get_scraper(domain=domain, light_mode=request.light_mode, resolution=request.resolution, url=str(request.url))
         scraper._light_mode = request.light_mode
 
         # Start random mouse wander (anti-detection) - skip in light mode to save resources
@@ -2863,7 +3878,22 @@ async def scrape_unified(request: UnifiedScrapeRequest, api_key: str, http_reque
         # Navigate to URL
         logger.info(f"Navigating to: {request.url}")
         try:
-            await scraper.navigate_to_url(str(request.url))
+            navigated = await _navigate_hedged(scraper, str(request.url), request.light_mode, request.resolution)
+            if navigated is not scraper:
+                # A hedged backup won on another browser: move the page tasks over to it
+                scraper = navigated
+                scraper._light_mode = request.light_mode
+                if mouse_wander_stop_event and mouse_wander_task:
+                    mouse_wander_stop_event.set()
+                    await asyncio.gather(mouse_wander_task, return_exceptions=True)
+                    mouse_wander_stop_event = asyncio.Event()
+                    mouse_wander_task = asyncio.create_task(_random_mouse_wander(scraper, mouse_wander_stop_event))
+                if frame_stop_event and frame_task:
+                    frame_stop_event.set()
+                    await asyncio.gather(frame_task, return_exceptions=True)
+                    frame_stop_event = asyncio.Event()
+                    frame_task = asyncio.create_task(_record_debug_frames(scraper, request_id, frame_stop_event, fps=1))
+            _record_navigation_response(scraper, str(request.url))
         except Exception as e:
             error_msg = f"Failed to navigate to URL: {str(e)}"
             logger.error(f"❌ {error_msg}")
@@ -2885,14 +3915,13 @@ async def scrape_unified(request: UnifiedScrapeRequest, api_key: str, http_reque
 
             try:
                 domain = _get_domain_from_url(str(request.url))
-                if domain and domain in domain_sessions:
-                    domain_sessions.pop(domain, None)
+                if domain and _drop_domain_session(domain):
                     logger.info(f"🗑️ Dropped domain session for {domain} due to navigation failure")
             except Exception:
                 pass
 
             try:
-                await cleanup_scraper(scraper)
+                reap_scraper(scraper)
             except Exception:
                 pass
             return {
@@ -2937,9 +3966,8 @@ async def scrape_unified(request: UnifiedScrapeRequest, api_key: str, http_reque
                 if not still_challenge:
                     break
                 logger.info(f"🛡️ Challenge retry {challenge_retries + 1}/{max_challenge_retries}: dropping session, new context")
-                if domain and domain in domain_sessions:
-                    domain_sessions.pop(domain, None)
-                await cleanup_scraper(scraper)
+                _drop_domain_session(domain)
+                reap_scraper(scraper)
                 challenge_retries += 1
                 scraper = await get_scraper(domain=domain, light_mode=request.light_mode, resolution=request.resolution)
                 scraper._light_mode = request.light_mode
@@ -2975,6 +4003,7 @@ async def scrape_unified(request: UnifiedScrapeRequest, api_key: str, http_reque
                 if nav_delay > 0:
                     await asyncio.sleep(nav_delay)
                 await scraper.navigate_to_url(url_str)
+                _record_navigation_response(scraper, url_str)
                 try:
                     await _wait_for_page_ready(scraper, label="retry", light_mode=request.light_mode)
                 except Exception as e:
@@ -2990,7 +4019,7 @@ async def scrape_unified(request: UnifiedScrapeRequest, api_key: str, http_reque
             if "about:blank" in current_url or not current_url:
                 error_msg = "Page failed to load: still about:blank after waits"
                 logger.error(f"❌ {error_msg}")
-                await cleanup_scraper(scraper)
+                reap_scraper(scraper)
                 return {
                     "success": False,
                     "url": str(request.url),
@@ -3024,6 +4053,23 @@ async def scrape_unified(request: UnifiedScrapeRequest, api_key: str, http_reque
             await asyncio.sleep(0.5)
             logger.info("✅ All click operations completed, proceeding with scraping")
 
+        # Infinite scroll: incremental collect while scrolling (replaces the final collect pass)
+        scroll_items: Dict[str, List[Any]] = {}
+        scroll_stats = None
+        if request.scroll is not None:
+            if request.collect:
+                scroll_items, scroll_stats = await execute_scroll_collect(
+                    scraper,
+                    request.collect,
+                    request.scroll,
+                    debug=request.debug,
+                    errors=errors,
+                )
+            else:
+                msg = "'scroll' requires 'collect' selectors; scroll skipped"
+                logger.warning(f"⚠️ {msg}")
+                errors.append(msg)
+
         proxy_info = scraper.get_current_proxy_info()
 
         response_data = {
@@ -3057,6 +4103,10 @@ async def scrape_unified(request: UnifiedScrapeRequest, api_key: str, http_reque
         if request.collect:
             logger.info(f"📋 Processing {len(request.collect)} 'collect' operations")
             for key, config in request.collect.items():
+                if key in scroll_items:
+                    response_data["collect"][key] = scroll_items[key]
+                    logger.info(f"✅ Extracted '{key}': {len(scroll_items[key])} items (scroll)")
+                    continue
                 try:
                     selector = config["selector"]
                     # Ensure fields is a dict so multi-field collect (e.g. key/value) uses extract_collection_with_fields
@@ -3162,7 +4212,7 @@ async def scrape_unified(request: UnifiedScrapeRequest, api_key: str, http_reque
             except Exception:
                 pass
 
-        await cleanup_scraper(scraper)
+        await release_scraper(scraper, domain)
 
         load_time = time.time() - start_time
         logger.info(f"✅ Unified scraping completed {request_id}: {len(str(response_data))} chars in {load_time:.2f}s")
@@ -3171,6 +4221,7 @@ async def scrape_unified(request: UnifiedScrapeRequest, api_key: str, http_reque
             "success": True,
             "url": str(request.url),
             "data": response_data,
+            "status_code": scraper.last_response_status,
             "load_time": load_time,
             "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
             "screenshot_path": screenshot_path,
@@ -3178,6 +4229,8 @@ async def scrape_unified(request: UnifiedScrapeRequest, api_key: str, http_reque
             "proxy_used": proxy_info,
             "errors": errors,
         }
+        if scroll_stats is not None:
+            response["scroll"] = scroll_stats
         if request.debug:
             if debug_html:
                 response["debug_html"] = debug_html
@@ -3204,7 +4257,7 @@ async def scrape_unified(request: UnifiedScrapeRequest, api_key: str, http_reque
                 except Exception:
                     pass
 
-            await cleanup_scraper(scraper)
+            reap_scraper(scraper)
         except Exception:
             pass
 
@@ -3235,7 +4288,7 @@ async def scrape_legacy(request: ScrapeRequest, api_key: str):
     try:
         # Get scraper instance (per-domain session + sticky proxy when available)
         domain = _get_domain_from_url(str(request.url))
-        scraper = await get_scraper(domain=domain, light_mode=request.light_mode, resolution=request.resolution)
+        scraper = await get_scraper(domain=domain, light_mode=request.light_mode, resolution=request.resolution, url=str(request.url))
         
         # Configure proxy
         if request.use_proxy:
@@ -3255,7 +4308,8 @@ async def scrape_legacy(request: ScrapeRequest, api_key: str):
         # Navigate to URL
         logger.info(f"Navigating to: {request.url}")
         try:
-            await scraper.navigate_to_url(str(request.url))
+            scraper = await _navigate_hedged(scraper, str(request.url), request.light_mode, request.resolution)
+            _record_navigation_response(scraper, str(request.url))
         except Exception as e:
             error_msg = f"Failed to navigate to URL: {str(e)}"
             logger.error(f"❌ {error_msg}")
@@ -3277,15 +4331,14 @@ async def scrape_legacy(request: ScrapeRequest, api_key: str):
 
             try:
                 domain = _get_domain_from_url(str(request.url))
-                if domain and domain in domain_sessions:
-                    domain_sessions.pop(domain, None)
+                if domain and _drop_domain_session(domain):
                     logger.info(f"🗑️ Dropped domain session for {domain} due to navigation failure")
             except Exception:
                 pass
 
             # Return scraper to pool on error
             try:
-                await cleanup_scraper(scraper)
+                reap_scraper(scraper)
             except:
                 pass
 
@@ -3362,8 +4415,8 @@ async def scrape_legacy(request: ScrapeRequest, api_key: str):
         # Store domain session on successful page load
         await _store_domain_session(scraper, str(request.url))
 
-        # Return scraper to pool
-        await cleanup_scraper(scraper)
+        # Keep the browser warm for the next request to this domain, or tear it down
+        await release_scraper(scraper, domain)
         
         load_time = time.time() - start_time
         logger.info(f"✅ Legacy scraping completed {request_id}: {len(content)} bytes in {load_time:.2f}s")
@@ -3371,7 +4424,7 @@ async def scrape_legacy(request: ScrapeRequest, api_key: str):
         return {
             "success": True,
             "url": str(request.url),
-            "status_code": 200,
+            "status_code": scraper.last_response_status or 200,
             "content_length": len(content),
             "html_content": content,
             "text_content": text_content,
@@ -3391,7 +4444,7 @@ async def scrape_legacy(request: ScrapeRequest, api_key: str):
         
         # Return scraper to pool on error
         try:
-            await cleanup_scraper(scraper)
+            reap_scraper(scraper)
         except:
             pass
         
@@ -3413,72 +4466,72 @@ async def scrape_legacy(request: ScrapeRequest, api_key: str):
         }
 
 @app.post("/proxies")
-async def get_available_proxies(api_key: str = Depends(verify_api_key)):
-    """Get available proxy list"""
-    return {
-        "proxies": [
-            "http://57.129.81.201:8080",
-            "http://proxy1.example.com:8080",
-            "http://proxy2.example.com:8080"
-        ],
-        "default": "http://57.129.81.201:8080"
-    }
+async def get_available_proxies(request: Optional[ProxyListRequest] = None, api_key: str = Depends(verify_api_key)):
+    """Configured proxies with live state and stats (paginated, filterable)"""
+    request = request or ProxyListRequest()
+    if request.state not in (None, "healthy", "banned"):
+        raise HTTPException(status_code=400, detail="state must be 'healthy' or 'banned'")
+    return get_proxy_registry().list_proxies(
+        page=request.page,
+        page_size=request.page_size,
+        state=request.state,
+        proxy_type=request.type,
+        search=request.search,
+        sort=request.sort,
+    )
 
 @app.post("/test-proxy")
 async def test_proxy(
-    proxy_url: str,
+    request: Optional[ProxyTestRequest] = None,
+    proxy_url: Optional[str] = None,
     api_key: str = Depends(verify_api_key)
 ):
-    """Test proxy connection"""
-    scraper = None
-    try:
-        scraper = await get_scraper()
-        # Test with specific proxy URL
-        test_proxy_list = [{"url": proxy_url, "country": "Test", "type": "HTTP", "status": "working", "speed": "unknown", "last_tested": "2025-01-09"}]
-        scraper.proxy_list = test_proxy_list
-        scraper.current_proxy_index = 0
-        
-        try:
-            await scraper.navigate_to_url("https://httpbin.org/ip")
-        except Exception as e:
-            await cleanup_scraper(scraper)
-            return {
-                "proxy": proxy_url,
-                "working": False,
-                "error": f"Failed to navigate with proxy: {str(e)}"
-            }
-        
-        try:
-            ip_response = await scraper.page.evaluate("() => document.body.innerText")
-            ip_data = json.loads(ip_response)
-        except Exception as e:
-            await cleanup_scraper(scraper)
-            return {
-                "proxy": proxy_url,
-                "working": False,
-                "error": f"Failed to get IP response: {str(e)}"
-            }
-        
-        await cleanup_scraper(scraper)
-        
-        return {
-            "proxy": proxy_url,
-            "working": True,
-            "ip": ip_data.get("origin", "unknown")
-        }
-        
-    except Exception as e:
-        if scraper:
-            try:
-                await cleanup_scraper(scraper)
-            except:
-                pass
-        
-        return {
-            "proxy": proxy_url,
-            "working": False,
-            "error": f"Proxy test failed: {str(e)}"
-        }
+    """
+    Test proxies concurrently with one lightweight HTTP request each (PROXY_PROBE_URL, no browser).
+    Results of configured proxies update their bans and selection stats for admin keys only
+    (bans are shared by all tenants). Other keys can only test their own proxies: 'all' and
+    configured proxy URLs are refused, so the pool is neither listed nor probed by them.
+    """
+    registry = get_proxy_registry()
+    admin = _is_admin(api_key)
+    if request is not None and request.all:
+        if not admin:
+            raise HTTPException(status_code=403, detail="'all' requires an admin API key")
+        entries = list(registry.entries)
+    else:
+        items = list(request.proxies or []) if request is not None else []
+        if proxy_url:
+            items.insert(0, proxy_url)
+        if not items:
+            raise HTTPException(status_code=400, detail="Give proxy_url, a 'proxies' list or 'all': true")
+        entries = []
+        for i, item in enumerate(items):
+            parsed = ProxyEntry.parse(item, i)
+            configured = registry.get(parsed.url)
+            if configured is not None and not admin:
+                raise HTTPException(status_code=403, detail="Testing configured proxies requires an admin API key")
+            entries.append(configured or parsed)
+
+    started = time.time()
+    results = await proxy_prober.probe_many(entries, apply=admin)
+
+    if proxy_url and len(results) == 1:
+        # Single proxy (query parameter): same response shape as before
+        result = results[0]
+        response = {"proxy": proxy_url, "working": result["working"], "latency_ms": result["latency_ms"]}
+        if result["working"]:
+            response["ip"] = result["ip"] or "unknown"
+        else:
+            response["error"] = f"Proxy test failed: {result['error']}"
+        return response
+
+    return {
+        "tested": len(results),
+        "working": sum(1 for r in results if r["working"]),
+        "duration_sec": round(time.time() - started, 2),
+        "test_url": proxy_prober.probe_url,
+        "results": results,
+    }
 
 
 @app.get("/debug/{filename}")
@@ -3534,6 +4587,23 @@ if __name__ == "__main__":
     ssl_keyfile = os.getenv('SSL_KEY_FILE', './ssl/key.pem')
     ssl_certfile = os.getenv('SSL_CERT_FILE', './ssl/cert.pem')
     
+    # Several worker processes need an import string; they share state via shared_state
+    app_target = "api:app" if API_WORKERS > 1 else app
+    server_workers = API_WORKERS
+    if API_WORKERS > 1 and SHARD_BY_DOMAIN:
+        # One front process; each shard is its own `uvicorn api:app` process on a local port
+        from shard_dispatcher import create_dispatcher_app
+        app_target = create_dispatcher_app(
+            shard_count=API_WORKERS,
+            base_port=int(os.getenv("SHARD_BASE_PORT", str(api_port + 1))),
+            spill_threshold=int(os.getenv("SHARD_SPILL_THRESHOLD", str(MAX_CONCURRENT_SCRAPES))),
+            valid_api_keys=VALID_API_KEYS,
+        )
+        server_workers = 1
+        logger.info(f"🧩 Domain-affinity sharding across {API_WORKERS} workers (shared state: {get_state().name})")
+    elif API_WORKERS > 1:
+        logger.info(f"👥 Starting {API_WORKERS} workers (shared state: {get_state().name})")
+    
     if ssl_enabled:
         # Check if SSL files exist
         if os.path.exists(ssl_keyfile) and os.path.exists(ssl_certfile):
@@ -3541,9 +4611,10 @@ if __name__ == "__main__":
             logger.info(f"🔑 Using SSL certificate: {ssl_certfile}")
             logger.info(f"🔐 Using SSL key: {ssl_keyfile}")
             uvicorn.run(
-                app, 
+                app_target, 
                 host=api_host, 
                 port=api_port,
+                workers=server_workers,
                 ssl_keyfile=ssl_keyfile,
                 ssl_certfile=ssl_certfile
             )
@@ -3552,8 +4623,8 @@ if __name__ == "__main__":
             logger.error(f"   Missing: {ssl_keyfile if not os.path.exists(ssl_keyfile) else ssl_certfile}")
             logger.info("🔓 Falling back to HTTP mode")
             logger.info(f"🚀 Starting server on http://{api_host}:{api_port}")
-            uvicorn.run(app, host=api_host, port=api_port)
+            uvicorn.run(app_target, host=api_host, port=api_port, workers=server_workers)
     else:
         logger.info(f"🔓 HTTPS disabled - Starting HTTP server on http://{api_host}:{api_port}")
         logger.info("   To enable HTTPS, set SSL_ENABLED=true in .env file")
-        uvicorn.run(app, host=api_host, port=api_port) 
\ No newline at end of file
+        uvicorn.run(app_target, host=api_host, port=api_port, workers=server_workers) 
\ No newline at end of file
@@ -0,0 +1,309 @@
+"""
+Asset Cache Module
+Shared, size-bounded disk cache for static assets (JS, CSS, fonts) across all browser contexts
+
+Author: Volkan AYDIN
+Year: 2025
+License: CC BY-NC-SA 4.0 (Non-Commercial)
+
+Chromium reaches HTTPS sites through a proxy with CONNECT tunnels, so a caching forward proxy
+would only see encrypted bytes unless it intercepted TLS with its own CA. The cache therefore
+sits one layer up: a context.route() handler answers static asset requests from the shared
+store and fetches misses through the context's own upstream proxy (route.fetch), so every
+context and every proxy shares one copy of each asset.
+Note: Playwright disables Chromium's own HTTP cache in contexts that use routing.
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import re
+import time
+import logging
+from collections import OrderedDict
+from email.utils import parsedate_to_datetime
+from typing import Optional, Dict, Any, Tuple
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+_MB = 1024 * 1024
+# URLs routed through the cache (everything else never leaves Chromium's network stack)
+_STATIC_URL_RE = re.compile(r"\.(?:js|mjs|css|woff2?|ttf|otf|eot)(?:[?#]|$)", re.IGNORECASE)
+_STATIC_TYPES = ("script", "stylesheet", "font")
+# Response headers not replayed from the cache (body is stored decoded, length is recomputed)
+_DROP_HEADERS = {"content-encoding", "content-length", "transfer-encoding", "connection", "set-cookie", "age", "date"}
+# Heuristic freshness for responses with Last-Modified but no explicit lifetime (RFC 9111 4.2.2)
+_HEURISTIC_MAX_SEC = 86400
+
+
+def _directives(value: Optional[str]) -> Dict[str, Optional[str]]:
+    directives: Dict[str, Optional[str]] = {}
+    for part in (value or "").split(","):
+        name, _, arg = part.strip().partition("=")
+        if name:
+            directives[name.lower()] = arg.strip('"') or None
+    return directives
+
+
+def _http_date(value: Optional[str]) -> Optional[float]:
+    if not value:
+        return None
+    try:
+        return parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError, IndexError, OverflowError):
+        return None
+
+
+def freshness_lifetime(headers: Dict[str, str], now: Optional[float] = None) -> float:
+    """
+    Seconds a response may be served from a shared cache (0 = not cacheable): s-maxage / max-age,
+    else Expires - Date, else 10% of the Last-Modified age (max one day).
+    """
+    now = now or time.time()
+    cache_control = _directives(headers.get("cache-control"))
+    if any(d in cache_control for d in ("no-store", "no-cache", "private")):
+        return 0.0
+    if "set-cookie" in headers:
+        return 0.0
+    vary = {v.strip().lower() for v in headers.get("vary", "").split(",") if v.strip()}
+    if vary - {"accept-encoding"}:
+        return 0.0
+    for name in ("s-maxage", "max-age"):
+        if cache_control.get(name):
+            try:
+                return max(0.0, float(cache_control[name]) - float(headers.get("age", 0) or 0))
+            except ValueError:
+                return 0.0
+    expires = _http_date(headers.get("expires"))
+    if expires is not None:
+        return max(0.0, expires - (_http_date(headers.get("date")) or now))
+    last_modified = _http_date(headers.get("last-modified"))
+    if last_modified is not None:
+        return min(_HEURISTIC_MAX_SEC, max(0.0, ((_http_date(headers.get("date")) or now) - last_modified) * 0.1))
+    return 0.0
+
+
+class UpstreamStats:
+    """Cache counters of one upstream (proxy URL or "direct")."""
+
+    __slots__ = ("requests", "hits", "misses", "stored", "bytes_saved", "bytes_fetched")
+
+    def __init__(self):
+        self.requests = 0
+        self.hits = 0
+        self.misses = 0
+        self.stored = 0
+        self.bytes_saved = 0
+        self.bytes_fetched = 0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "requests": self.requests,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / self.requests, 3) if self.requests else None,
+            "stored": self.stored,
+            "bytes_saved": self.bytes_saved,
+            "bytes_fetched": self.bytes_fetched,
+        }
+
+
+class AssetCache:
+    """
+    Disk store of cacheable static responses, shared by all contexts, proxies and (through the
+    directory) worker processes. Each entry is <hash>.json (url, status, headers, expiry) plus
+    <hash>.bin (decoded body). The index is LRU-bounded by max_mb; entries stored by other
+    workers are picked up from disk on an index miss.
+    """
+
+    def __init__(self, root: str, max_mb: float = 1024, max_entry_mb: float = 10):
+        self.root = os.path.abspath(root)
+        self.max_bytes = int(max(1.0, float(max_mb)) * _MB)
+        self.max_entry_bytes = int(max(0.1, float(max_entry_mb)) * _MB)
+        # hash -> (size, expires_at), least recently used first
+        self._index: "OrderedDict[str, Tuple[int, float]]" = OrderedDict()
+        self.bytes = 0
+        self.evicted = 0
+        self.errors = 0
+        self._upstreams: Dict[str, UpstreamStats] = {}
+        os.makedirs(self.root, exist_ok=True)
+
+    @staticmethod
+    def key(url: str) -> str:
+        return hashlib.sha1(url.encode("utf-8")).hexdigest()
+
+    def _paths(self, key: str) -> Tuple[str, str]:
+        base = os.path.join(self.root, key[:2], key)
+        return base + ".json", base + ".bin"
+
+    def load_index(self) -> int:
+        """Index entries already on disk (blocking; run in a thread at startup)."""
+        entries = []
+        for root, _, files in os.walk(self.root):
+            for name in files:
+                if not name.endswith(".json"):
+                    continue
+                try:
+                    with open(os.path.join(root, name), "r") as f:
+                        meta = json.load(f)
+                    entries.append((meta.get("stored_at", 0), name[:-5], meta["size"], meta["expires_at"]))
+                except (OSError, ValueError, KeyError):
+                    continue
+        for _, key, size, expires_at in sorted(entries):
+            self._add(key, size, expires_at)
+        return len(entries)
+
+    def _add(self, key: str, size: int, expires_at: float) -> None:
+        old = self._index.pop(key, None)
+        if old is not None:
+            self.bytes -= old[0]
+        self._index[key] = (size, expires_at)
+        self.bytes += size
+        while self._index and self.bytes > self.max_bytes:
+            oldest, (oldest_size, _) = self._index.popitem(last=False)
+            self.bytes -= oldest_size
+            self.evicted += 1
+            self._remove_files(oldest)
+
+    def _remove_files(self, key: str) -> None:
+        for path in self._paths(key):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def _read(self, key: str) -> Optional[Tuple[Dict[str, Any], bytes]]:
+        meta_path, body_path = self._paths(key)
+        try:
+            with open(meta_path, "r") as f:
+                meta = json.load(f)
+            with open(body_path, "rb") as f:
+                body = f.read()
+        except (OSError, ValueError):
+            return None
+        return meta, body
+
+    def _write(self, key: str, meta: Dict[str, Any], body: bytes) -> None:
+        meta_path, body_path = self._paths(key)
+        os.makedirs(os.path.dirname(meta_path), exist_ok=True)
+        # Body first, then metadata: readers only trust entries whose metadata exists
+        for path, data, mode in ((body_path, body, "wb"), (meta_path, json.dumps(meta), "w")):
+            tmp = f"{path}.{os.getpid()}.tmp"
+            with open(tmp, mode) as f:
+                f.write(data)
+            os.replace(tmp, path)
+
+    async def get(self, url: str) -> Optional[Tuple[Dict[str, Any], bytes]]:
+        key = self.key(url)
+        indexed = self._index.get(key)
+        if indexed is None and not os.path.exists(self._paths(key)[0]):
+            return None
+        entry = await asyncio.to_thread(self._read, key)
+        if entry is None or entry[0].get("url") != url:
+            return None
+        meta, body = entry
+        if meta["expires_at"] <= time.time():
+            return None
+        if indexed is None:
+            self._add(key, meta["size"], meta["expires_at"])
+        else:
+            self._index.move_to_end(key)
+        return meta, body
+
+    async def put(self, url: str, status: int, headers: Dict[str, str], body: bytes, lifetime: float) -> bool:
+        if len(body) > self.max_entry_bytes or lifetime <= 0:
+            return False
+        key = self.key(url)
+        meta = {
+            "url": url,
+            "status": status,
+            "headers": {k: v for k, v in headers.items() if k.lower() not in _DROP_HEADERS},
+            "expires_at": time.time() + lifetime,
+            "stored_at": time.time(),
+            "size": len(body),
+        }
+        try:
+            await asyncio.to_thread(self._write, key, meta, body)
+        except OSError as e:
+            self.errors += 1
+            logger.warning(f"⚠️ Asset cache write failed: {e}")
+            return False
+        self._add(key, len(body), meta["expires_at"])
+        return True
+
+    def _stats(self, upstream: str) -> UpstreamStats:
+        stats = self._upstreams.get(upstream)
+        if stats is None:
+            stats = self._upstreams[upstream] = UpstreamStats()
+        return stats
+
+    async def attach(self, context: Any, upstream: Optional[str]) -> None:
+        """Serve a context's static asset requests from the cache; misses are fetched through its upstream."""
+        stats = self._stats(upstream or "direct")
+
+        async def handle(route):
+            request = route.request
+            if request.method != "GET" or request.resource_type not in _STATIC_TYPES:
+                await route.fallback()
+                return
+            stats.requests += 1
+            try:
+                cached = await self.get(request.url)
+            except Exception:
+                cached = None
+            if cached is not None:
+                meta, body = cached
+                stats.hits += 1
+                stats.bytes_saved += len(body)
+                await route.fulfill(status=meta["status"], headers=meta["headers"], body=body)
+                return
+            stats.misses += 1
+            try:
+                response = await route.fetch()
+                body = await response.body()
+            except Exception:
+                # Let the browser load it by itself (and report its own error)
+                await route.fallback()
+                return
+            stats.bytes_fetched += len(body)
+            headers = {k.lower(): v for k, v in response.headers.items()}
+            if response.status == 200 and await self.put(request.url, response.status, headers, body, freshness_lifetime(headers)):
+                stats.stored += 1
+            # body() is decoded, so the encoding/length headers of the wire response no longer apply
+            await route.fulfill(
+                status=response.status,
+                headers={k: v for k, v in headers.items() if k not in ("content-encoding", "content-length", "transfer-encoding")},
+                body=body,
+            )
+
+        await context.route(_STATIC_URL_RE, handle)
+
+    def snapshot(self) -> Dict[str, Any]:
+        requests = sum(s.requests for s in self._upstreams.values())
+        hits = sum(s.hits for s in self._upstreams.values())
+        return {
+            "entries": len(self._index),
+            "size_mb": round(self.bytes / _MB, 1),
+            "max_mb": round(self.max_bytes / _MB, 1),
+            "hit_ratio": round(hits / requests, 3) if requests else None,
+            "bytes_saved": sum(s.bytes_saved for s in self._upstreams.values()),
+            "evicted": self.evicted,
+            "errors": self.errors,
+            "upstreams": {name: stats.to_dict() for name, stats in self._upstreams.items()},
+        }
+
+
+_cache: Optional[AssetCache] = None
+
+
+def get_asset_cache() -> Optional[AssetCache]:
+    """Process-wide asset cache, None unless ASSET_CACHE_ENABLED."""
+    global _cache
+    if not Config.ASSET_CACHE_ENABLED:
+        return None
+    if _cache is None:
+        _cache = AssetCache(Config.ASSET_CACHE_DIR, Config.ASSET_CACHE_MAX_MB, Config.ASSET_CACHE_MAX_ENTRY_MB)
+    return _cache
@@ -0,0 +1,143 @@
+"""
+Bandwidth Module
+Request/response byte accounting per scrape, aggregated by target domain, API key and request mode
+
+Author: Volkan AYDIN
+Year: 2025
+License: CC BY-NC-SA 4.0 (Non-Commercial)
+
+Bytes come from Chromium's CDP Network events (see WebScraper.watch_traffic): received bytes are
+encodedDataLength of finished loads (wire size: compressed body + headers, 0 for cache hits),
+sent bytes are estimated from the request line, headers and post data (HTTP/2 header compression
+is not modelled). Per-proxy totals are kept by the proxy registry.
+"""
+
+import time
+import logging
+from collections import OrderedDict
+from typing import Optional, Dict, Any
+
+from shared_state import get_state
+
+logger = logging.getLogger(__name__)
+
+
+class TrafficCounter:
+    """Bytes and requests of one scrape (all its browsers and pages) or one aggregate."""
+
+    __slots__ = ("requests", "cached", "failed", "bytes_sent", "bytes_received", "scrapes")
+
+    def __init__(self):
+        self.requests = 0
+        self.cached = 0
+        self.failed = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.scrapes = 0
+
+    def merge(self, other: "TrafficCounter") -> None:
+        self.requests += other.requests
+        self.cached += other.cached
+        self.failed += other.failed
+        self.bytes_sent += other.bytes_sent
+        self.bytes_received += other.bytes_received
+        self.scrapes += 1
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "requests": self.requests,
+            "cached_requests": self.cached,
+            "failed_requests": self.failed,
+            "bytes_sent": self.bytes_sent,
+            "bytes_received": self.bytes_received,
+        }
+
+    def to_summary(self) -> Dict[str, Any]:
+        total = self.bytes_sent + self.bytes_received
+        return {
+            **self.to_dict(),
+            "scrapes": self.scrapes,
+            "total_mb": round(total / (1024 * 1024), 2),
+            "avg_kb_per_scrape": round(total / self.scrapes / 1024, 1) if self.scrapes else None,
+        }
+
+
+class BandwidthAccounting:
+    """
+    Hands out a TrafficCounter per job and folds it into the aggregates when the job ends:
+    per target domain (LRU-bounded by max_domains) and per request mode in this worker, and per
+    API key in the shared state (bw:{key}), so key totals cover all workers.
+    """
+
+    def __init__(self, max_domains: int = 1000):
+        self.max_domains = max(1, int(max_domains))
+        self._jobs: Dict[str, TrafficCounter] = {}
+        self.total = TrafficCounter()
+        self._domains: "OrderedDict[str, TrafficCounter]" = OrderedDict()
+        self._modes: Dict[str, TrafficCounter] = {}
+        self.started_at = time.time()
+
+    def counter_for(self, job_id: Optional[str]) -> TrafficCounter:
+        """Counter of a running job (a throwaway counter outside of a job)."""
+        if job_id is None:
+            return TrafficCounter()
+        counter = self._jobs.get(job_id)
+        if counter is None:
+            counter = self._jobs[job_id] = TrafficCounter()
+        return counter
+
+    def finish(self, job_id: str, domain: Optional[str], api_key: Optional[str], mode: str) -> Dict[str, Any]:
+        """Aggregate a finished job's traffic; returns its totals (for the response)."""
+        counter = self._jobs.pop(job_id, None) or TrafficCounter()
+        self.total.merge(counter)
+        if domain:
+            aggregate = self._domains.pop(domain, None) or TrafficCounter()
+            aggregate.merge(counter)
+            self._domains[domain] = aggregate
+            while len(self._domains) > self.max_domains:
+                self._domains.popitem(last=False)
+        self._modes.setdefault(mode, TrafficCounter()).merge(counter)
+        if api_key and (counter.bytes_sent or counter.bytes_received):
+            # Counted on the state's writer thread, the response does not wait for it
+            get_state().submit(_record_key_bytes, api_key, counter.bytes_sent, counter.bytes_received)
+        return counter.to_dict()
+
+    @staticmethod
+    async def key_usage(api_key: str) -> Dict[str, Any]:
+        """Bytes used by an API key across all workers."""
+        try:
+            state = get_state()
+            sent = await state.aget(f"bw:{api_key}:sent") or 0
+            received = await state.aget(f"bw:{api_key}:received") or 0
+            scrapes = await state.aget(f"bw:{api_key}:scrapes") or 0
+        except Exception:
+            return {}
+        return {
+            "bytes_sent": sent,
+            "bytes_received": received,
+            "total_mb": round((sent + received) / (1024 * 1024), 2),
+            "scrapes": scrapes,
+        }
+
+    def snapshot(self, top_domains: int = 20) -> Dict[str, Any]:
+        domains = sorted(
+            self._domains.items(), key=lambda item: item[1].bytes_sent + item[1].bytes_received, reverse=True
+        )[:top_domains]
+        return {
+            "since": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(self.started_at)),
+            "total": self.total.to_summary(),
+            "by_mode": {mode: counter.to_summary() for mode, counter in self._modes.items()},
+            "top_domains": {domain: counter.to_summary() for domain, counter in domains},
+            "in_flight_jobs": len(self._jobs),
+        }
+
+
+def _record_key_bytes(api_key: str, sent: int, received: int) -> None:
+    """Add one finished job's bytes to the key's shared counters (runs on the state's writer thread)."""
+    try:
+        state = get_state()
+        state.incr(f"bw:{api_key}:sent", sent)
+        state.incr(f"bw:{api_key}:received", received)
+        state.incr(f"bw:{api_key}:scrapes", 1)
+    except Exception as e:
+        logger.warning(f"Could not record bandwidth for API key: {e}")
@@ -0,0 +1,183 @@
+"""
+Browser Profiles Module
+Persistent Chromium profiles (disk HTTP cache) keyed by (domain group, proxy), with size quotas
+
+Author: Volkan AYDIN
+Year: 2025
+License: CC BY-NC-SA 4.0 (Non-Commercial)
+
+A profile is a Chromium user data dir used with launch_persistent_context, so static assets of
+repeat visits come from its disk cache instead of through the proxy. Chromium locks a profile
+while it runs, so each profile is leased to one browser at a time; a request whose profile is
+busy falls back to an ephemeral context.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+import logging
+from typing import Optional, Dict, Any, Set
+
+from config import Config
+from scrape_watchdog import process_alive
+
+logger = logging.getLogger(__name__)
+
+_MB = 1024 * 1024
+_META_FILE = "fairscrapper_profile.json"
+
+
+def domain_group(host: str) -> str:
+    """
+    Site a hostname belongs to (www.shop.example.co.uk -> example.co.uk): the last two labels,
+    or three for short second-level suffixes such as co.uk / com.au.
+    """
+    labels = [label for label in host.lower().strip(".").split(".") if label]
+    if len(labels) <= 2:
+        return ".".join(labels)
+    if len(labels[-1]) == 2 and len(labels[-2]) <= 3:
+        return ".".join(labels[-3:])
+    return ".".join(labels[-2:])
+
+
+def _dir_size(path: str) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                pass
+    return total
+
+
+class ProfileManager:
+    """
+    Hands out profile directories under root and keeps their total size below max_total_mb by
+    deleting the least recently used idle profiles. Each profile's HTTP cache is capped by
+    Chromium itself (--disk-cache-size, max_cache_mb).
+    """
+
+    def __init__(self, root: str, max_cache_mb: float = 256, max_total_mb: float = 4096):
+        self.root = os.path.abspath(root)
+        self.max_cache_bytes = int(max(1.0, float(max_cache_mb)) * _MB)
+        self.max_total_bytes = int(max(1.0, float(max_total_mb)) * _MB)
+        self._lock = threading.Lock()
+        self._leased: Set[str] = set()
+        self._sizes: Dict[str, int] = {}
+        self.leases = 0
+        self.busy = 0
+        self.evicted = 0
+        os.makedirs(self.root, exist_ok=True)
+
+    @staticmethod
+    def profile_id(domain: str, proxy_url: Optional[str]) -> str:
+        key = f"{domain_group(domain)}|{proxy_url or 'direct'}"
+        return hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+
+    def browser_args(self) -> list:
+        return [f"--disk-cache-size={self.max_cache_bytes}"]
+
+    def acquire(self, domain: str, proxy_url: Optional[str]) -> Optional[str]:
+        """Lease the profile dir of (domain group, proxy); None if another browser is using it."""
+        profile_id = self.profile_id(domain, proxy_url)
+        with self._lock:
+            if profile_id in self._leased:
+                self.busy += 1
+                return None
+            self._leased.add(profile_id)
+            self.leases += 1
+        path = os.path.join(self.root, profile_id)
+        if self._locked_elsewhere(path):
+            # Used by a browser of another worker process
+            self.release(path)
+            with self._lock:
+                self.busy += 1
+            return None
+        os.makedirs(path, exist_ok=True)
+        try:
+            with open(os.path.join(path, _META_FILE), "w") as f:
+                json.dump({"group": domain_group(domain), "proxy": proxy_url, "last_used": time.time()}, f)
+        except OSError as e:
+            logger.warning(f"⚠️ Could not write profile metadata in {path}: {e}")
+        return path
+
+    @staticmethod
+    def _locked_elsewhere(path: str) -> bool:
+        """Chromium's SingletonLock ("host-pid" symlink) points to a live process."""
+        try:
+            target = os.readlink(os.path.join(path, "SingletonLock"))
+            return process_alive(int(target.rsplit("-", 1)[-1]))
+        except (OSError, ValueError):
+            return False
+
+    def release(self, path: Optional[str]) -> None:
+        if not path:
+            return
+        with self._lock:
+            self._leased.discard(os.path.basename(path))
+
+    def _last_used(self, path: str) -> float:
+        try:
+            return os.path.getmtime(os.path.join(path, _META_FILE))
+        except OSError:
+            return 0.0
+
+    def enforce_quota(self) -> int:
+        """Measure profiles and delete least recently used idle ones above the total quota (blocking; run in a thread)."""
+        try:
+            names = [n for n in os.listdir(self.root) if os.path.isdir(os.path.join(self.root, n))]
+        except OSError:
+            return 0
+        sizes = {name: _dir_size(os.path.join(self.root, name)) for name in names}
+        total = sum(sizes.values())
+        removed = 0
+        for name in sorted(names, key=lambda n: self._last_used(os.path.join(self.root, n))):
+            if total <= self.max_total_bytes:
+                break
+            with self._lock:
+                if name in self._leased:
+                    continue
+                # Lease while deleting so no browser starts on a half-deleted profile
+                self._leased.add(name)
+            try:
+                shutil.rmtree(os.path.join(self.root, name), ignore_errors=True)
+                total -= sizes.pop(name)
+                removed += 1
+            finally:
+                with self._lock:
+                    self._leased.discard(name)
+        self._sizes = sizes
+        self.evicted += removed
+        if removed:
+            logger.info(f"🧹 Browser profiles: evicted {removed} least recently used ({total / _MB:.0f} MB left)")
+        return removed
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "root": self.root,
+            "profiles": len(self._sizes),
+            "size_mb": round(sum(self._sizes.values()) / _MB, 1),
+            "max_total_mb": round(self.max_total_bytes / _MB, 1),
+            "max_cache_mb": round(self.max_cache_bytes / _MB, 1),
+            "in_use": len(self._leased),
+            "leases": self.leases,
+            "busy_fallbacks": self.busy,
+            "evicted": self.evicted,
+        }
+
+
+_profiles: Optional[ProfileManager] = None
+
+
+def get_profile_manager() -> Optional[ProfileManager]:
+    """Process-wide profile manager, None unless PERSISTENT_PROFILES is enabled."""
+    global _profiles
+    if not Config.PERSISTENT_PROFILES:
+        return None
+    if _profiles is None:
+        _profiles = ProfileManager(Config.PROFILE_DIR, Config.PROFILE_CACHE_MAX_MB, Config.PROFILE_TOTAL_MAX_MB)
+    return _profiles
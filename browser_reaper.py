@@ -0,0 +1,137 @@
+"""
+Browser Reaper Module
+Background browser teardown with bounded concurrency, so responses never wait for cleanup
+
+Author: Volkan AYDIN
+Year: 2025
+License: CC BY-NC-SA 4.0 (Non-Commercial)
+"""
+
+import asyncio
+import time
+import logging
+from collections import deque
+from typing import Optional, Dict, Any, Callable, Set, Deque
+
+from scrape_watchdog import process_alive, kill_process_tree
+
+logger = logging.getLogger(__name__)
+
+
+class BrowserReaper:
+    """
+    Closes scrapers (page, context, browser, playwright driver) in background tasks.
+
+    submit() returns immediately; at most max_concurrent teardowns run at once. A teardown that
+    fails or exceeds timeout_sec, or leaves the driver process alive, ends with a SIGKILL of the
+    driver's process tree, so resources are always freed eventually. on_reaped() is called after
+    every teardown (e.g. to re-sample memory and wake queued jobs).
+    """
+
+    def __init__(
+        self,
+        max_concurrent: int = 4,
+        timeout_sec: float = 30.0,
+        on_reaped: Optional[Callable[[], None]] = None,
+        latency_samples: int = 256,
+    ):
+        self.max_concurrent = max(1, int(max_concurrent))
+        self.timeout_sec = max(1.0, float(timeout_sec))
+        self.on_reaped = on_reaped
+        self._semaphore = asyncio.Semaphore(self.max_concurrent)
+        self._tasks: Set[asyncio.Task] = set()
+        self._scheduled: Set[int] = set()
+        self._running = 0
+        # (total latency incl. waiting for a reaper slot, close duration) of recent teardowns
+        self._latencies: Deque[float] = deque(maxlen=latency_samples)
+        self._close_times: Deque[float] = deque(maxlen=latency_samples)
+        self.reaped = 0
+        self.failed = 0
+        self.killed = 0
+
+    def submit(self, scraper: Any) -> None:
+        """Schedule a scraper for teardown (no-op for None or a scraper already scheduled)."""
+        if scraper is None or id(scraper) in self._scheduled:
+            return
+        self._scheduled.add(id(scraper))
+        task = asyncio.create_task(self._reap(scraper, time.monotonic()))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    @property
+    def pending(self) -> int:
+        return len(self._tasks)
+
+    async def _reap(self, scraper: Any, submitted_at: float) -> None:
+        async with self._semaphore:
+            self._running += 1
+            started_at = time.monotonic()
+            failed = False
+            try:
+                await asyncio.wait_for(scraper.close(), timeout=self.timeout_sec)
+            except asyncio.TimeoutError:
+                failed = True
+                logger.error(f"❌ Browser teardown timeout ({self.timeout_sec:.0f}s), killing its processes")
+            except Exception as e:
+                error_msg = str(e)
+                # EPIPE errors are expected when the browser process already terminated
+                if 'EPIPE' not in error_msg and 'broken pipe' not in error_msg.lower():
+                    failed = True
+                    logger.error(f"❌ Browser teardown error: {e}")
+            finally:
+                self._running -= 1
+                self._scheduled.discard(id(scraper))
+            for attr in ("page", "context", "browser", "playwright"):
+                try:
+                    setattr(scraper, attr, None)
+                except Exception:
+                    pass
+
+            driver_pid = getattr(scraper, "driver_pid", None)
+            if driver_pid and process_alive(driver_pid):
+                self.killed += kill_process_tree(driver_pid)
+                if not failed:
+                    logger.warning(f"⚠️ Playwright driver {driver_pid} survived close, killed its process tree")
+            self._close_times.append(time.monotonic() - started_at)
+            self._latencies.append(time.monotonic() - submitted_at)
+            if failed:
+                self.failed += 1
+            else:
+                self.reaped += 1
+        if self.on_reaped is not None:
+            try:
+                self.on_reaped()
+            except Exception as e:
+                logger.warning(f"⚠️ Reaper callback failed: {e}")
+
+    async def drain(self, timeout_sec: Optional[float] = None) -> None:
+        """Wait for pending teardowns (used on shutdown)."""
+        if not self._tasks:
+            return
+        logger.info(f"🧹 Waiting for {len(self._tasks)} browser teardowns...")
+        done, pending = await asyncio.wait(set(self._tasks), timeout=timeout_sec)
+        if pending:
+            logger.warning(f"⚠️ {len(pending)} browser teardowns still pending at shutdown")
+
+    @staticmethod
+    def _percentiles(samples: Deque[float]) -> Dict[str, Optional[float]]:
+        if not samples:
+            return {"p50": None, "p95": None, "max": None}
+        ordered = sorted(samples)
+
+        def pct(q: float) -> float:
+            return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))], 3)
+
+        return {"p50": pct(0.5), "p95": pct(0.95), "max": round(ordered[-1], 3)}
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "max_concurrent": self.max_concurrent,
+            "pending": self.pending,
+            "running": self._running,
+            "reaped": self.reaped,
+            "failed": self.failed,
+            "processes_killed": self.killed,
+            "latency_sec": self._percentiles(self._latencies),
+            "close_sec": self._percentiles(self._close_times),
+        }
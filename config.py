@@ -49,4 +49,33 @@ class Config:
     NAVIGATE_POST_SLEEP_SEC = float(os.getenv('NAVIGATE_POST_SLEEP_SEC', '0.5'))
 
     # Proxy: time-based ban after failure (seconds); 0 = only count-based
-    PROXY_BAN_TIME_SEC = int(os.getenv('PROXY_BAN_TIME_SEC', '300'))
\ No newline at end of file
+    PROXY_BAN_TIME_SEC = int(os.getenv('PROXY_BAN_TIME_SEC', '300'))
+
+    # Proxy selection: p2c (better of two random, by latency/success/challenge EWMAs) | weighted | random
+    PROXY_SELECTION = os.getenv('PROXY_SELECTION', 'p2c').lower()
+    PROXY_EWMA_ALPHA = float(os.getenv('PROXY_EWMA_ALPHA', '0.2'))
+    PROXY_DOMAIN_STATS_MAX = int(os.getenv('PROXY_DOMAIN_STATS_MAX', '10000'))  # (domain, proxy) pairs; 0 = global stats only
+
+    # Shared state across worker processes (domain sessions, proxy health, rate limits, job status)
+    STATE_BACKEND = os.getenv('STATE_BACKEND', 'sqlite').lower()  # sqlite | redis
+    STATE_SQLITE_PATH = os.getenv('STATE_SQLITE_PATH', './data/state.db')
+    STATE_REDIS_URL = os.getenv('STATE_REDIS_URL', 'redis://localhost:6379/0')
+    STATE_KEY_PREFIX = os.getenv('STATE_KEY_PREFIX', 'fairscrapper:')
+    # Worker processes sharing the state (a private fallback store would split them)
+    API_WORKERS = max(1, int(os.getenv('API_WORKERS', '1')))
+
+    # Persistent browser profiles per (domain group, proxy): the disk HTTP cache survives between requests
+    PERSISTENT_PROFILES = os.getenv('PERSISTENT_PROFILES', 'false').lower() == 'true'
+    PROFILE_DIR = os.getenv('PROFILE_DIR', './data/profiles')
+    PROFILE_CACHE_MAX_MB = float(os.getenv('PROFILE_CACHE_MAX_MB', '256'))  # per profile (Chromium disk cache)
+    PROFILE_TOTAL_MAX_MB = float(os.getenv('PROFILE_TOTAL_MAX_MB', '4096'))  # all profiles, LRU eviction
+    PROFILE_SHARE_COOKIES = os.getenv('PROFILE_SHARE_COOKIES', 'false').lower() == 'true'
+
+    # Shared disk cache of static assets (JS, CSS, fonts) for all contexts and proxies
+    ASSET_CACHE_ENABLED = os.getenv('ASSET_CACHE_ENABLED', 'false').lower() == 'true'
+    ASSET_CACHE_DIR = os.getenv('ASSET_CACHE_DIR', './data/assets')
+    ASSET_CACHE_MAX_MB = float(os.getenv('ASSET_CACHE_MAX_MB', '1024'))
+    ASSET_CACHE_MAX_ENTRY_MB = float(os.getenv('ASSET_CACHE_MAX_ENTRY_MB', '10'))
+
+    # Count request/response bytes of every scrape from CDP Network events (per proxy, domain and API key)
+    BANDWIDTH_ACCOUNTING = os.getenv('BANDWIDTH_ACCOUNTING', 'true').lower() == 'true'
@@ -0,0 +1,243 @@
+"""
+Domain Limiter Module
+Per-target-domain concurrency, politeness (minimum interval between requests)
+and adaptive (AIMD) backoff when targets answer 429/503
+
+Author: Volkan AYDIN
+Year: 2025
+License: CC BY-NC-SA 4.0 (Non-Commercial)
+"""
+
+import asyncio
+import time
+import logging
+from typing import Optional, Dict, Any, Callable, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Responses that mean "slow down"
+THROTTLE_STATUSES = (429, 503)
+# Rate ceiling (requests/s) for domains without a minimum interval
+_UNBOUNDED_RATE = 10.0
+# Slowest adaptive rate (one request per 60 s)
+_MIN_RATE = 1.0 / 60
+
+
+def parse_domain_limits(spec: str) -> Dict[str, Tuple[Optional[int], Optional[float]]]:
+    """
+    Parse per-domain overrides: "example.com:2:1.5,slow-site.org:1:10"
+    -> {domain: (max_in_flight, min_interval_sec)}. Empty fields keep the default ("example.com::3").
+    An entry also applies to subdomains (example.com covers www.example.com).
+    """
+    limits: Dict[str, Tuple[Optional[int], Optional[float]]] = {}
+    for item in (spec or "").split(","):
+        parts = [p.strip() for p in item.strip().split(":")]
+        if not parts or not parts[0]:
+            continue
+        domain = parts[0].lower().lstrip(".")
+        try:
+            max_in_flight = int(parts[1]) if len(parts) > 1 and parts[1] else None
+            min_interval = float(parts[2]) if len(parts) > 2 and parts[2] else None
+        except ValueError:
+            logger.warning(f"⚠️ Invalid domain limit entry: {item}")
+            continue
+        limits[domain] = (max_in_flight, min_interval)
+    return limits
+
+
+class DomainState:
+    """Limiter state of one domain (or configured domain group)."""
+
+    __slots__ = (
+        "max_in_flight", "min_interval", "in_flight", "last_start", "started",
+        "rate", "backoff_until", "last_decrease", "throttled", "last_status",
+    )
+
+    def __init__(self, max_in_flight: int, min_interval: float):
+        self.max_in_flight = max_in_flight
+        self.min_interval = min_interval
+        self.in_flight = 0
+        self.last_start = 0.0
+        self.started = 0
+        # Adaptive rate limit in requests/s (None = not throttled, only min_interval applies)
+        self.rate: Optional[float] = None
+        self.backoff_until = 0.0
+        self.last_decrease = 0.0
+        self.throttled = 0
+        self.last_status: Optional[int] = None
+
+    def max_rate(self) -> float:
+        return 1.0 / self.min_interval if self.min_interval > 0 else _UNBOUNDED_RATE
+
+    def interval(self) -> float:
+        """Effective spacing between request starts (configured interval or adaptive rate, whichever is slower)."""
+        if self.rate is None:
+            return self.min_interval
+        return max(self.min_interval, 1.0 / self.rate)
+
+    def next_allowed_at(self) -> float:
+        return max(self.last_start + self.interval(), self.backoff_until)
+
+
+class DomainLimiter:
+    """
+    Limits in-flight requests per target domain and spaces request starts by a minimum interval.
+
+    Designed as a scheduler admission check: can_start() is a cheap O(1) test, so jobs for other
+    domains are dispatched while a throttled domain waits. When a domain is blocked only by its
+    interval, a timer calls on_ready() when it becomes eligible so the scheduler re-dispatches.
+
+    record_response() adapts the request rate per domain (AIMD): a 429/503 multiplies the rate by
+    backoff_factor (at most once per interval, so one burst of errors counts once) and honours
+    Retry-After; every successful response adds recovery_step requests/s until the configured
+    limit is reached again.
+    """
+
+    def __init__(
+        self,
+        default_max_in_flight: int = 2,
+        default_min_interval_sec: float = 1.0,
+        overrides: Optional[Dict[str, Tuple[Optional[int], Optional[float]]]] = None,
+        on_ready: Optional[Callable[[], None]] = None,
+        backoff_factor: float = 0.5,
+        recovery_step: float = 0.05,
+        max_backoff_sec: float = 300.0,
+    ):
+        self.default_max_in_flight = max(1, int(default_max_in_flight))
+        self.default_min_interval = max(0.0, float(default_min_interval_sec))
+        self.overrides = overrides or {}
+        self.on_ready = on_ready
+        self.backoff_factor = min(0.95, max(0.05, float(backoff_factor)))
+        self.recovery_step = max(0.0, float(recovery_step))
+        self.max_backoff_sec = max(0.0, float(max_backoff_sec))
+        self._states: Dict[str, DomainState] = {}
+        self._wake_handle: Optional[asyncio.TimerHandle] = None
+        self._wake_at = 0.0
+
+    def _limit_key(self, domain: str) -> Tuple[str, Tuple[Optional[int], Optional[float]]]:
+        """Configured entry covering domain (longest suffix match), else the domain itself with defaults."""
+        domain = domain.lower()
+        parts = domain.split(".")
+        for i in range(len(parts) - 1):
+            candidate = ".".join(parts[i:])
+            if candidate in self.overrides:
+                return candidate, self.overrides[candidate]
+        return domain, (None, None)
+
+    def _state(self, domain: str) -> DomainState:
+        key, (max_in_flight, min_interval) = self._limit_key(domain)
+        state = self._states.get(key)
+        if state is None:
+            state = self._states[key] = DomainState(
+                max_in_flight if max_in_flight is not None else self.default_max_in_flight,
+                min_interval if min_interval is not None else self.default_min_interval,
+            )
+        return state
+
+    def can_start(self, domain: Optional[str]) -> bool:
+        """True if a new request to domain may start now."""
+        if not domain:
+            return True
+        state = self._state(domain)
+        if state.in_flight >= state.max_in_flight:
+            # A finishing request releases a scheduler slot, which re-dispatches by itself
+            return False
+        next_allowed = state.next_allowed_at()
+        now = time.time()
+        if now < next_allowed:
+            self._arm_wakeup(next_allowed - now)
+            return False
+        return True
+
+    def on_start(self, domain: Optional[str]) -> None:
+        if not domain:
+            return
+        state = self._state(domain)
+        state.in_flight += 1
+        state.started += 1
+        state.last_start = time.time()
+
+    def on_finish(self, domain: Optional[str]) -> None:
+        if not domain:
+            return
+        state = self._state(domain)
+        state.in_flight = max(0, state.in_flight - 1)
+
+    def record_response(self, domain: Optional[str], status: Optional[int], retry_after: Optional[float] = None) -> None:
+        """Feed the main-document HTTP status (and Retry-After seconds) of a finished navigation."""
+        if not domain or status is None:
+            return
+        state = self._state(domain)
+        state.last_status = status
+        now = time.time()
+        if status in THROTTLE_STATUSES:
+            state.throttled += 1
+            if now - state.last_decrease >= state.interval():
+                current = state.rate if state.rate is not None else state.max_rate()
+                state.rate = max(_MIN_RATE, current * self.backoff_factor)
+                state.last_decrease = now
+                logger.warning(
+                    f"🐢 {domain} answered HTTP {status}: backing off to {state.rate:.3f} req/s"
+                    + (f", Retry-After {retry_after:.0f}s" if retry_after else "")
+                )
+            if retry_after:
+                state.backoff_until = max(state.backoff_until, now + min(retry_after, self.max_backoff_sec))
+        elif status < 400 and state.rate is not None:
+            state.rate += self.recovery_step
+            if state.rate >= state.max_rate():
+                state.rate = None
+                logger.info(f"✅ {domain} recovered: adaptive backoff lifted")
+
+    def _arm_wakeup(self, delay: float) -> None:
+        if self.on_ready is None:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        wake_at = loop.time() + delay
+        if self._wake_handle is not None and not self._wake_handle.cancelled() and self._wake_at <= wake_at:
+            return
+        if self._wake_handle is not None:
+            self._wake_handle.cancel()
+        self._wake_at = wake_at
+        self._wake_handle = loop.call_at(wake_at, self._wake)
+
+    def _wake(self) -> None:
+        self._wake_handle = None
+        try:
+            self.on_ready()
+        except Exception as e:
+            logger.warning(f"⚠️ Domain limiter wake-up failed: {e}")
+
+    def snapshot(self) -> Dict[str, Any]:
+        now = time.time()
+        domains = {}
+        for key, state in self._states.items():
+            if not state.in_flight and now - state.last_start > 3600 and now >= state.backoff_until:
+                continue
+            domains[key] = {
+                "in_flight": state.in_flight,
+                "max_in_flight": state.max_in_flight,
+                "min_interval_sec": state.min_interval,
+                "adaptive_rate": round(state.rate, 3) if state.rate is not None else None,
+                "backoff_remaining": round(max(0.0, state.backoff_until - now), 2),
+                "next_allowed_in": round(max(0.0, state.next_allowed_at() - now), 2),
+                "started": state.started,
+                "throttled": state.throttled,
+                "last_status": state.last_status,
+            }
+        return {
+            "default_max_in_flight": self.default_max_in_flight,
+            "default_min_interval_sec": self.default_min_interval,
+            "domains": domains,
+        }
+
+    def prune(self, max_idle_sec: float = 3600) -> None:
+        """Drop state of domains idle for max_idle_sec (keeps memory bounded on many domains)."""
+        now = time.time()
+        for key in [
+            k for k, s in self._states.items()
+            if not s.in_flight and now - s.last_start > max_idle_sec and now >= s.backoff_until
+        ]:
+            self._states.pop(key, None)
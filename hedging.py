@@ -0,0 +1,102 @@
+"""
+Hedging Module
+Per-domain navigation latency percentiles and a traffic-share budget for hedged (backup) navigations
+
+Author: Volkan AYDIN
+Year: 2025
+License: CC BY-NC-SA 4.0 (Non-Commercial)
+
+A hedge is a second navigation to the same URL on another proxy, started when the first one has
+not committed after the domain's usual (percentile) latency; the first to succeed is used.
+"""
+
+import time
+from collections import OrderedDict, deque
+from typing import Optional, Dict, Any
+
+
+class HedgePolicy:
+    """
+    Decides when a navigation gets a backup attempt (this worker's traffic only).
+
+    delay_for(domain): percentile of the last window navigation latencies (DOMContentLoaded) to the
+    domain, at least min_delay_sec; None until min_samples were seen (no hedging on unknown domains).
+    try_acquire(): hedge budget as a token bucket, each navigation adds max_ratio tokens (up to
+    burst), each hedge takes one, so hedges stay below max_ratio of navigations.
+    """
+
+    def __init__(
+        self,
+        percentile: float = 0.9,
+        min_samples: int = 20,
+        max_ratio: float = 0.05,
+        min_delay_sec: float = 1.0,
+        window: int = 100,
+        burst: float = 5.0,
+        max_domains: int = 1000,
+    ):
+        self.percentile = min(0.999, max(0.5, float(percentile)))
+        self.min_samples = max(1, int(min_samples))
+        self.max_ratio = min(1.0, max(0.0, float(max_ratio)))
+        self.min_delay_sec = max(0.1, float(min_delay_sec))
+        self.window = max(self.min_samples, int(window))
+        self.burst = max(1.0, float(burst))
+        self.max_domains = max(1, int(max_domains))
+        self._latencies: "OrderedDict[str, deque]" = OrderedDict()
+        self._tokens = 0.0
+        self.navigations = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.skipped_budget = 0
+        self.started_at = time.time()
+
+    def record(self, domain: Optional[str], latency_sec: Optional[float]) -> None:
+        """Latency of a successful navigation to domain."""
+        if not domain or latency_sec is None:
+            return
+        samples = self._latencies.pop(domain, None)
+        if samples is None:
+            samples = deque(maxlen=self.window)
+        samples.append(latency_sec)
+        self._latencies[domain] = samples
+        while len(self._latencies) > self.max_domains:
+            self._latencies.popitem(last=False)
+
+    def delay_for(self, domain: Optional[str]) -> Optional[float]:
+        """Seconds to wait for a commit before hedging a navigation to domain (None: do not hedge)."""
+        samples = self._latencies.get(domain) if domain else None
+        if samples is None or len(samples) < self.min_samples:
+            return None
+        ordered = sorted(samples)
+        value = ordered[min(len(ordered) - 1, int(self.percentile * len(ordered)))]
+        return max(self.min_delay_sec, value)
+
+    def note_navigation(self) -> None:
+        self.navigations += 1
+        self._tokens = min(self.burst, self._tokens + self.max_ratio)
+
+    def try_acquire(self) -> bool:
+        """Take one hedge from the budget; False if hedges already use their share of traffic."""
+        if self._tokens < 1.0:
+            self.skipped_budget += 1
+            return False
+        self._tokens -= 1.0
+        self.hedges += 1
+        return True
+
+    def record_outcome(self, backup_won: bool) -> None:
+        if backup_won:
+            self.hedge_wins += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "since": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(self.started_at)),
+            "percentile": self.percentile,
+            "max_ratio": self.max_ratio,
+            "navigations": self.navigations,
+            "hedges": self.hedges,
+            "hedge_ratio": round(self.hedges / self.navigations, 4) if self.navigations else None,
+            "backup_wins": self.hedge_wins,
+            "skipped_budget": self.skipped_budget,
+            "domains": len(self._latencies),
+        }
@@ -0,0 +1,213 @@
+"""
+Preflight Module
+Cheap reachability check of a target through the chosen proxy (DNS, TCP, CONNECT, TLS) before a browser is launched
+
+Author: Volkan AYDIN
+Year: 2025
+License: CC BY-NC-SA 4.0 (Non-Commercial)
+"""
+
+import asyncio
+import base64
+import socket
+import ssl
+import time
+import logging
+from collections import OrderedDict
+from typing import Optional, Dict, Any, List, Tuple
+from urllib.parse import urlparse
+
+from proxy_registry import ProxyEntry
+
+logger = logging.getLogger(__name__)
+
+# Handshake only: certificate problems are the browser's business
+_TLS_CONTEXT = ssl.create_default_context()
+_TLS_CONTEXT.check_hostname = False
+_TLS_CONTEXT.verify_mode = ssl.CERT_NONE
+# CONNECT answers meaning the proxy itself refused us (anything else >= 400: it could not reach the target)
+_PROXY_FAULT_STATUSES = (401, 403, 407)
+
+
+class PreflightError(Exception):
+    """Target or proxy found unreachable by the pre-flight check."""
+
+    def __init__(self, message: str, stage: str, blame: str):
+        super().__init__(message)
+        self.stage = stage
+        self.blame = blame
+
+
+class Preflight:
+    """
+    Checks that a URL's host can be reached the way the browser will reach it:
+
+    - direct: DNS lookup, TCP connect (every resolved address in turn), TLS handshake (https)
+    - HTTP proxy, https target: TCP to the proxy, CONNECT host:443, TLS handshake through the tunnel
+    - HTTP proxy, http target: TCP to the proxy only (plain proxying, the proxy resolves the target)
+    - SOCKS proxy: TCP to the proxy only (the proxy resolves the target)
+
+    A failure says which side is at fault (blame "target" or "proxy"). A timeout past the connection
+    to the proxy, or a dropped tunnel, only means "slow or flaky": the result is ok with inconclusive
+    set and the browser, with its longer timeout, decides. Conclusive results are cached per
+    (scheme, host, port, proxy) for cache_sec; concurrent checks of the same key share one probe.
+    """
+
+    def __init__(self, timeout_sec: float = 3.0, cache_sec: float = 30.0, max_entries: int = 5000):
+        self.timeout_sec = max(0.2, float(timeout_sec))
+        self.cache_sec = max(0.0, float(cache_sec))
+        self.max_entries = max(1, int(max_entries))
+        self._cache: "OrderedDict[Tuple[str, str, int, str], Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._inflight: Dict[Tuple[str, str, int, str], asyncio.Task] = {}
+        self.checks = 0
+        self.cache_hits = 0
+        self.failures = 0
+        self.inconclusive = 0
+
+    async def check(self, url: str, proxy: Optional[ProxyEntry] = None) -> Dict[str, Any]:
+        """{"ok", "inconclusive", "stage", "blame", "error", "ms", "cached"} for url through proxy (None: direct)."""
+        parsed = urlparse(url)
+        scheme = (parsed.scheme or "https").lower()
+        host = parsed.hostname or ""
+        port = parsed.port or (443 if scheme == "https" else 80)
+        key = (scheme, host, port, proxy.url if proxy is not None else "")
+        cached = self._cache.get(key)
+        if cached is not None:
+            if cached[0] > time.monotonic():
+                self._cache.move_to_end(key)
+                self.cache_hits += 1
+                return {**cached[1], "cached": True}
+            del self._cache[key]
+        task = self._inflight.get(key)
+        if task is None:
+            task = self._inflight[key] = asyncio.ensure_future(self._run(key, proxy))
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        # Shielded: one caller giving up must not cancel the probe for the others
+        return {**await asyncio.shield(task), "cached": False}
+
+    async def _run(self, key: Tuple[str, str, int, str], proxy: Optional[ProxyEntry]) -> Dict[str, Any]:
+        scheme, host, port, _ = key
+        progress = {"stage": "dns" if proxy is None else "proxy"}
+        started = time.monotonic()
+        result: Dict[str, Any] = {"ok": True, "inconclusive": False, "stage": None, "blame": None, "error": None}
+        try:
+            await asyncio.wait_for(self._probe(scheme, host, port, proxy, progress), timeout=self.timeout_sec)
+        except PreflightError as e:
+            result.update(ok=False, stage=e.stage, blame=e.blame, error=str(e))
+        except asyncio.TimeoutError:
+            stage = progress["stage"]
+            error = f"{_describe(stage, host, port)} timed out after {self.timeout_sec:.1f}s"
+            if stage == "proxy":
+                result.update(ok=False, stage=stage, blame="proxy", error=error)
+            else:
+                # Slow, not necessarily unreachable (a slow proxy looks the same): let the browser try
+                result.update(inconclusive=True, stage=stage, error=error)
+        except (OSError, asyncio.IncompleteReadError, asyncio.LimitOverrunError) as e:
+            stage = progress["stage"]
+            error = f"{_describe(stage, host, port)} failed: {str(e) or type(e).__name__}"
+            if proxy is not None and stage in ("connect", "tls"):
+                # Tunnel dropped: the proxy or the target, no way to tell from here
+                result.update(inconclusive=True, stage=stage, error=error)
+            else:
+                result.update(ok=False, stage=stage, blame="proxy" if stage == "proxy" else "target", error=error)
+        result["ms"] = round((time.monotonic() - started) * 1000)
+        self.checks += 1
+        if not result["ok"]:
+            self.failures += 1
+        if result["inconclusive"]:
+            self.inconclusive += 1
+        elif self.cache_sec:
+            self._cache[key] = (time.monotonic() + self.cache_sec, result)
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+        return result
+
+    async def _probe(self, scheme: str, host: str, port: int, proxy: Optional[ProxyEntry], progress: Dict[str, str]) -> None:
+        loop = asyncio.get_running_loop()
+        tls = scheme == "https"
+        if proxy is None:
+            progress["stage"] = "dns"
+            addresses = await _resolve(loop, host, port)
+            progress["stage"] = "tcp"
+            writer = await _connect_any(addresses, port)
+            try:
+                if tls:
+                    progress["stage"] = "tls"
+                    await _handshake(loop, writer, host)
+            finally:
+                writer.close()
+            return
+
+        proxy_parsed = urlparse(proxy.url)
+        progress["stage"] = "proxy"
+        reader, writer = await asyncio.open_connection(
+            proxy_parsed.hostname, proxy_parsed.port or 8080,
+            ssl=_TLS_CONTEXT if proxy_parsed.scheme == "https" else None,
+        )
+        try:
+            if proxy.type != "HTTP" or not tls:
+                return
+            progress["stage"] = "connect"
+            request = f"CONNECT {host}:{port} HTTP/1.1\r\nHost: {host}:{port}\r\n"
+            if proxy.username:
+                credentials = base64.b64encode(f"{proxy.username}:{proxy.password}".encode()).decode()
+                request += f"Proxy-Authorization: Basic {credentials}\r\n"
+            writer.write((request + "\r\n").encode())
+            head = await reader.readuntil(b"\r\n\r\n")
+            status_line = head.split(b"\r\n", 1)[0].decode("latin-1")
+            parts = status_line.split(" ", 2)
+            status = int(parts[1]) if len(parts) > 1 and parts[1].isdigit() else 0
+            if status != 200:
+                blame = "proxy" if status in _PROXY_FAULT_STATUSES or not status else "target"
+                raise PreflightError(f"Proxy could not open a tunnel to {host}:{port}: {status_line}", "connect", blame)
+            progress["stage"] = "tls"
+            await _handshake(loop, writer, host)
+        finally:
+            writer.close()
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "checks": self.checks,
+            "failures": self.failures,
+            "inconclusive": self.inconclusive,
+            "cache_hits": self.cache_hits,
+            "cached": len(self._cache),
+        }
+
+
+def _describe(stage: str, host: str, port: int) -> str:
+    return {
+        "dns": f"DNS lookup of {host}",
+        "tcp": f"TCP connect to {host}:{port}",
+        "tls": f"TLS handshake with {host}",
+        "proxy": "Connection to the proxy",
+        "connect": f"Proxy tunnel to {host}:{port}",
+    }.get(stage, f"Pre-flight of {host}")
+
+
+async def _resolve(loop: asyncio.AbstractEventLoop, host: str, port: int) -> List[str]:
+    try:
+        infos = await loop.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+    except socket.gaierror as e:
+        raise PreflightError(f"DNS lookup of {host} failed: {e}", "dns", "target")
+    if not infos:
+        raise PreflightError(f"DNS lookup of {host} returned no address", "dns", "target")
+    return list(dict.fromkeys(info[4][0] for info in infos))
+
+
+async def _connect_any(addresses: List[str], port: int) -> asyncio.StreamWriter:
+    # Like the browser: next address on failure (broken IPv6 must not fail a reachable target)
+    error: Optional[OSError] = None
+    for address in addresses:
+        try:
+            _, writer = await asyncio.open_connection(address, port)
+            return writer
+        except OSError as e:
+            error = e
+    raise error
+
+
+async def _handshake(loop: asyncio.AbstractEventLoop, writer: asyncio.StreamWriter, host: str) -> None:
+    # loop.start_tls works on any stream transport (StreamWriter.start_tls needs Python 3.11)
+    transport = await loop.start_tls(writer.transport, writer.transport.get_protocol(), _TLS_CONTEXT, server_hostname=host)
+    transport.close()
@@ -0,0 +1,198 @@
+"""
+Proxy Prober Module
+Concurrent proxy health checks over pooled HTTP connections (no browser)
+
+Author: Volkan AYDIN
+Year: 2025
+License: CC BY-NC-SA 4.0 (Non-Commercial)
+"""
+
+import asyncio
+import json
+import os
+import time
+import logging
+from typing import Optional, Dict, Any, List
+
+import aiohttp
+
+from proxy_registry import ProxyEntry, ProxyRegistry
+from shared_state import get_state
+
+logger = logging.getLogger(__name__)
+
+# Statuses the proxy itself answers with: auth required, upstream unreachable / timed out
+PROXY_STATUSES = (407, 502, 504)
+
+
+class ProxyProber:
+    """
+    Fetches probe_url through each proxy with one pooled aiohttp session, at most concurrency
+    checks at a time. Results of registry proxies feed the registry: a failure the proxy is to
+    blame for (connect error, 407/502/504) counts like a failed navigation (ban), a success
+    records the latency in the proxy's stats and lifts an existing ban. Timeouts and other
+    error statuses are left alone, and nothing is applied while probe_url itself is down
+    (checked directly first). SOCKS proxies are skipped (aiohttp speaks HTTP proxies only).
+
+    run() probes the whole registry every interval_sec; with several workers, one of them per
+    round does it (claimed in the shared state) and the others pick up the bans via sync().
+    """
+
+    def __init__(
+        self,
+        registry: ProxyRegistry,
+        probe_url: str = "http://httpbin.org/ip",
+        timeout_sec: float = 5.0,
+        concurrency: int = 100,
+        interval_sec: float = 3600,
+    ):
+        self.registry = registry
+        self.probe_url = probe_url
+        self.timeout_sec = max(0.5, float(timeout_sec))
+        self.concurrency = max(1, int(concurrency))
+        self.interval_sec = max(10.0, float(interval_sec))
+        self._session: Optional[aiohttp.ClientSession] = None
+        self.rounds = 0
+        self.last_round: Optional[Dict[str, Any]] = None
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.concurrency, ttl_dns_cache=300),
+                timeout=aiohttp.ClientTimeout(total=self.timeout_sec),
+            )
+        return self._session
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def probe(self, entry: ProxyEntry) -> Dict[str, Any]:
+        """One check: {"url", "working", "latency_ms", "status", "ip", "error", "blame"}."""
+        result: Dict[str, Any] = {
+            "url": entry.url, "working": False, "latency_ms": None, "status": None, "ip": None, "error": None,
+            "blame": None,
+        }
+        if entry.type != "HTTP":
+            result["error"] = f"{entry.type} proxies are not probed"
+            return result
+        auth = aiohttp.BasicAuth(entry.username, entry.password) if entry.username else None
+        started = time.monotonic()
+        try:
+            async with self._get_session().get(self.probe_url, proxy=entry.url, proxy_auth=auth) as response:
+                body = await response.read()
+                result["status"] = response.status
+        except asyncio.TimeoutError:
+            result["error"] = f"Timeout after {self.timeout_sec:.0f}s"
+            return result
+        except (aiohttp.ClientError, OSError, ValueError) as e:
+            result["error"] = str(e) or type(e).__name__
+            # Refused / reset / dropped by the proxy, or a bad proxy URL; payload errors are ambiguous
+            if isinstance(e, (aiohttp.ClientProxyConnectionError, aiohttp.ClientHttpProxyError,
+                              aiohttp.ServerDisconnectedError, aiohttp.ClientOSError, OSError, ValueError)):
+                result["blame"] = "proxy"
+            return result
+        result["latency_ms"] = round((time.monotonic() - started) * 1000)
+        result["working"] = response.status < 400
+        if not result["working"]:
+            result["error"] = f"HTTP {response.status}"
+            if response.status in PROXY_STATUSES:
+                result["blame"] = "proxy"
+        try:
+            result["ip"] = json.loads(body).get("origin")
+        except (ValueError, AttributeError):
+            pass
+        return result
+
+    def _apply(self, entry: ProxyEntry, result: Dict[str, Any]) -> None:
+        if self.registry.get(entry.url) is not entry:
+            return
+        if result["working"]:
+            self.registry.record_navigation(entry.index, None, result["latency_ms"] / 1000, True)
+            self.registry.mark_healthy(entry.url)
+        elif result["blame"] == "proxy":
+            self.registry.record_navigation(entry.index, None, None, False)
+            self.registry.mark_failed(entry.url)
+
+    async def target_up(self) -> bool:
+        """Direct check of probe_url (no proxy): False if it times out, errors or answers >= 400."""
+        try:
+            async with self._get_session().get(self.probe_url) as response:
+                await response.read()
+                return response.status < 400
+        except (asyncio.TimeoutError, aiohttp.ClientError, OSError, ValueError) as e:
+            logger.warning(f"⚠️ Proxy probe target {self.probe_url} unreachable: {str(e) or type(e).__name__}")
+            return False
+
+    async def probe_many(self, entries: List[ProxyEntry], apply: bool = True) -> List[Dict[str, Any]]:
+        """
+        Check entries concurrently; apply=True feeds registry proxies' results into bans and stats,
+        unless probe_url does not answer directly (an outage of the target would ban every proxy).
+        """
+        semaphore = asyncio.Semaphore(self.concurrency)
+        if apply and any(entry.type == "HTTP" for entry in entries) and not await self.target_up():
+            logger.warning("⚠️ Proxy probe target is down, results are not applied to the registry")
+            apply = False
+
+        async def _one(entry: ProxyEntry) -> Dict[str, Any]:
+            async with semaphore:
+                result = await self.probe(entry)
+            if apply and entry.type == "HTTP":
+                self._apply(entry, result)
+            return result
+
+        return await asyncio.gather(*(_one(entry) for entry in entries))
+
+    async def _claim_round(self) -> bool:
+        """True if this worker probes this round (no other worker did within the interval)."""
+        now = time.time()
+        pid = os.getpid()
+
+        def _claim(record):
+            if isinstance(record, dict) and now - record.get("at", 0) < self.interval_sec * 0.9:
+                return record
+            return {"at": now, "pid": pid}
+
+        try:
+            record = await get_state().aupdate("proxy_probe:round", _claim, ttl=self.interval_sec * 2)
+        except Exception as e:
+            logger.warning(f"Could not claim proxy probe round: {e}")
+            return True
+        return record.get("pid") == pid and record.get("at") == now
+
+    async def probe_all(self) -> Dict[str, Any]:
+        started = time.time()
+        # Current bans first, so lifted ones are cleared in the shared state too
+        await self.registry.refresh()
+        results = await self.probe_many(self.registry.entries)
+        skipped = sum(1 for e in self.registry.entries if e.type != "HTTP")
+        self.rounds += 1
+        self.last_round = {
+            "at": started,
+            "duration_sec": round(time.time() - started, 2),
+            "probed": len(results) - skipped,
+            "working": sum(1 for r in results if r["working"]),
+            "skipped": skipped,
+        }
+        return self.last_round
+
+    async def run(self) -> None:
+        """Background loop: probe all registry proxies every interval_sec (first round right away)."""
+        while True:
+            if self.registry.entries and await self._claim_round():
+                try:
+                    summary = await self.probe_all()
+                    logger.info(f"🩺 Proxy probe: {summary['working']}/{summary['probed']} working in {summary['duration_sec']}s")
+                except Exception as e:
+                    logger.warning(f"⚠️ Proxy probe round failed: {e}")
+            await asyncio.sleep(self.interval_sec)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "probe_url": self.probe_url,
+            "interval_sec": self.interval_sec,
+            "concurrency": self.concurrency,
+            "rounds": self.rounds,
+            "last_round": self.last_round,
+        }
@@ -0,0 +1,545 @@
+"""
+Proxy Registry Module
+Process-wide proxy list, parsed once, with failure counts and bans shared by all requests
+
+Author: Volkan AYDIN
+Year: 2025
+License: CC BY-NC-SA 4.0 (Non-Commercial)
+"""
+
+import asyncio
+import bisect
+import heapq
+import random
+import time
+import logging
+from array import array
+from collections import OrderedDict
+from typing import Optional, Dict, Any, List, Tuple
+
+from config import Config
+from shared_state import get_state
+
+logger = logging.getLogger(__name__)
+
+
+# Latency assumed for a proxy (or domain) without samples yet, in seconds
+_DEFAULT_LATENCY_SEC = 3.0
+# Upper bounds (ms) of the latency histogram buckets; the last bucket is everything slower
+_LATENCY_BUCKETS_MS = (50, 100, 200, 300, 500, 750, 1000, 1500, 2000, 3000, 5000, 7500, 10000, 15000, 20000, 30000)
+
+
+class ProxyStats:
+    """EWMA navigation latency, success rate and challenge rate of a proxy (or of a proxy for one domain)."""
+
+    __slots__ = ("latency", "success", "challenge", "samples", "challenge_samples", "histogram")
+
+    def __init__(self):
+        # Optimistic start, so new proxies get traffic until they have samples
+        self.latency: Optional[float] = None
+        self.success = 1.0
+        self.challenge = 0.0
+        self.samples = 0
+        self.challenge_samples = 0
+        # Latency counts per _LATENCY_BUCKETS_MS bucket, allocated on the first sample
+        self.histogram: Optional[array] = None
+
+    def record(self, latency_sec: Optional[float], ok: bool, alpha: float) -> None:
+        if latency_sec is not None:
+            self.latency = latency_sec if self.latency is None else self.latency + alpha * (latency_sec - self.latency)
+            if self.histogram is None:
+                self.histogram = array("I", bytes(4 * (len(_LATENCY_BUCKETS_MS) + 1)))
+            self.histogram[bisect.bisect_left(_LATENCY_BUCKETS_MS, latency_sec * 1000)] += 1
+        self.success += alpha * ((1.0 if ok else 0.0) - self.success)
+        self.samples += 1
+
+    def percentile_ms(self, q: float) -> Optional[int]:
+        """Latency percentile from the histogram (bucket upper bound; None without samples)."""
+        if self.histogram is None:
+            return None
+        target = q * sum(self.histogram)
+        seen = 0
+        for i, count in enumerate(self.histogram):
+            seen += count
+            if count and seen >= target:
+                return _LATENCY_BUCKETS_MS[min(i, len(_LATENCY_BUCKETS_MS) - 1)]
+        return None
+
+    def record_challenge(self, challenged: bool, alpha: float) -> None:
+        self.challenge += alpha * ((1.0 if challenged else 0.0) - self.challenge)
+        self.challenge_samples += 1
+
+    def score(self, default_latency: float = _DEFAULT_LATENCY_SEC) -> float:
+        """Expected useful pages per second: success x (1 - challenge) / latency."""
+        latency = self.latency if self.latency is not None else default_latency
+        return max(0.01, self.success) * max(0.01, 1.0 - self.challenge) / max(0.05, latency)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "latency_ms": round(self.latency * 1000) if self.latency is not None else None,
+            "success_rate": round(self.success, 3),
+            "challenge_rate": round(self.challenge, 3),
+            "samples": self.samples,
+        }
+
+
+class ProxyEntry:
+    """One configured proxy, its failure / ban state and its performance stats."""
+
+    __slots__ = (
+        "index", "url", "username", "password", "type", "failures", "last_fail", "banned_until", "stats",
+        "active", "bytes_sent", "bytes_received",
+    )
+
+    def __init__(self, index: int, url: str, username: str = "", password: str = "", proxy_type: str = "HTTP"):
+        self.index = index
+        self.url = url
+        self.username = username
+        self.password = password
+        self.type = proxy_type
+        self.failures = 0
+        self.last_fail = 0.0
+        self.banned_until = 0.0
+        self.stats = ProxyStats()
+        # Open browser contexts using this proxy, and traffic through it
+        self.active = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+    @classmethod
+    def parse(cls, proxy_item: str, index: int) -> "ProxyEntry":
+        """Parse a PROXY_LIST item: URL or URL:username:password (socks4:// / socks5:// set the type)."""
+        proxy_item = proxy_item.strip()
+        username = password = ""
+        # Check if it contains credentials (more than 2 colons)
+        if proxy_item.count(':') > 2:
+            # Format: http://proxy.com:8080:username:password
+            last_colon = proxy_item.rfind(':')
+            second_last_colon = proxy_item.rfind(':', 0, last_colon)
+            credentials = proxy_item[second_last_colon + 1:].split(':')
+            username = credentials[0] if len(credentials) > 0 else ""
+            password = credentials[1] if len(credentials) > 1 else ""
+            proxy_item = proxy_item[:second_last_colon]
+        proxy_type = "HTTP"
+        if proxy_item.startswith("socks4://"):
+            proxy_type = "SOCKS4"
+            proxy_item = proxy_item.replace("socks4://", "http://")
+        elif proxy_item.startswith("socks5://"):
+            proxy_type = "SOCKS5"
+            proxy_item = proxy_item.replace("socks5://", "http://")
+        return cls(index, proxy_item, username, password, proxy_type)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Proxy info dict as used by the scraper (setup_browser) and API responses."""
+        return {
+            "url": self.url,
+            "username": self.username,
+            "password": self.password,
+            "country": "Unknown",
+            "type": self.type,
+            "status": "working",
+            "speed": "unknown",
+            "last_tested": "2025-01-09",
+        }
+
+
+class ProxyRegistry:
+    """
+    The configured proxies, parsed once per process. A proxy is banned for ban_time_sec after a
+    failure, and for failure_ttl_sec (until its failures are forgotten) once it has max_failures.
+
+    Availability is a field check on the entry (O(1)); ban expiries sit in a min-heap, so the
+    number of banned proxies is kept in O(log n) per ban. Lapsed bans are popped from the heap
+    before any ban is applied or the count is read. Failures are also written to
+    the shared state (proxy:{url}) and read back every sync_interval_sec, so a proxy banned by
+    one worker is skipped by all of them.
+
+    choose() picks a proxy for a domain by its ProxyStats score (per domain once the pair has
+    min_domain_samples navigations, else the proxy's overall stats):
+    - "p2c": the better of two random available proxies (default; O(1), no herding on one proxy)
+    - "weighted": random with probability proportional to score (O(n))
+    - "random": uniform, ignoring stats
+    Stats are per worker process; per-domain stats are LRU-bounded by max_domain_stats.
+    """
+
+    def __init__(
+        self,
+        proxy_items: List[str],
+        max_failures: int = 3,
+        ban_time_sec: float = 300,
+        failure_ttl_sec: float = 3600,
+        sync_interval_sec: float = 10.0,
+        selection: str = "p2c",
+        ewma_alpha: float = 0.2,
+        max_domain_stats: int = 10000,
+        min_domain_samples: int = 3,
+    ):
+        self.entries: List[ProxyEntry] = [
+            ProxyEntry.parse(item, i) for i, item in enumerate(p for p in proxy_items if p.strip())
+        ]
+        self._by_url: Dict[str, ProxyEntry] = {entry.url: entry for entry in self.entries}
+        self.max_failures = max(1, int(max_failures))
+        self.ban_time_sec = max(0.0, float(ban_time_sec))
+        self.failure_ttl_sec = max(60.0, float(failure_ttl_sec), self.ban_time_sec)
+        self.sync_interval_sec = sync_interval_sec
+        # (banned_until, index); stale items (entry re-banned since) are skipped when popped
+        self._ban_heap: List[Tuple[float, int]] = []
+        self.banned = 0
+        self._synced_at = 0.0
+        self._sync_task: Optional[asyncio.Task] = None
+        self.selection = selection if selection in ("p2c", "weighted", "random") else "p2c"
+        self.ewma_alpha = min(1.0, max(0.01, float(ewma_alpha)))
+        self.max_domain_stats = max(0, int(max_domain_stats))
+        self.min_domain_samples = max(1, int(min_domain_samples))
+        # Totals over all entries, maintained with the per-entry counters
+        self.active_contexts = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        # (domain, proxy index) -> stats, least recently updated first
+        self._domain_stats: "OrderedDict[Tuple[str, int], ProxyStats]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def get(self, url: str) -> Optional[ProxyEntry]:
+        return self._by_url.get(url)
+
+    def _ban_expiry(self, failures: int, last_fail: float) -> float:
+        if failures >= self.max_failures:
+            return last_fail + self.failure_ttl_sec
+        return last_fail + self.ban_time_sec if self.ban_time_sec > 0 else 0.0
+
+    def _apply(self, entry: ProxyEntry, failures: int, last_fail: float, now: float) -> None:
+        was_banned = entry.banned_until > now
+        entry.failures = failures
+        entry.last_fail = last_fail
+        entry.banned_until = self._ban_expiry(failures, last_fail)
+        if entry.banned_until > now:
+            heapq.heappush(self._ban_heap, (entry.banned_until, entry.index))
+            if not was_banned:
+                self.banned += 1
+        elif was_banned:
+            self.banned -= 1
+
+    def _expire(self, now: float) -> None:
+        heap = self._ban_heap
+        # Also drop stale heads, so heap[0] is the next real unban
+        while heap and (heap[0][0] <= now or self.entries[heap[0][1]].banned_until != heap[0][0]):
+            banned_until, index = heapq.heappop(heap)
+            entry = self.entries[index]
+            if entry.banned_until == banned_until:
+                self.banned -= 1
+                # Failures below the count limit stay on record until the shared entry expires
+                if entry.failures >= self.max_failures:
+                    entry.failures = 0
+
+    def sync(self, force: bool = False) -> None:
+        """
+        Pick up failures recorded by other workers (throttled to sync_interval_sec).
+        On the event loop the read runs in the background and is applied when it completes.
+        """
+        now = time.time()
+        if not self.entries or (not force and now - self._synced_at < self.sync_interval_sec):
+            return
+        self._synced_at = now
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+        if loop is not None:
+            if self._sync_task is None or self._sync_task.done():
+                self._sync_task = loop.create_task(self.refresh())
+            return
+        try:
+            records = get_state().items("proxy:")
+        except Exception as e:
+            logger.warning(f"Could not read proxy health: {e}")
+            return
+        self._apply_records(records, time.time())
+
+    async def refresh(self) -> None:
+        """Read the shared proxy health now (off the event loop) and apply it."""
+        self._synced_at = time.time()
+        try:
+            records = await get_state().aitems("proxy:")
+        except Exception as e:
+            logger.warning(f"Could not read proxy health: {e}")
+            return
+        self._apply_records(records, time.time())
+
+    def _apply_records(self, records: Dict[str, Any], now: float) -> None:
+        # Lapsed bans leave the count first, or _apply would see them as still banned
+        self._expire(now)
+        seen = set()
+        for key, record in records.items():
+            entry = self._by_url.get(key[len("proxy:"):])
+            if entry is None or not isinstance(record, dict):
+                continue
+            seen.add(entry.index)
+            failures = int(record.get("count", 0))
+            last_fail = float(record.get("last_fail", 0))
+            if failures != entry.failures or last_fail != entry.last_fail:
+                self._apply(entry, failures, last_fail, now)
+        # No record: cleared by another worker (mark_healthy) or expired (failure_ttl_sec). Failures
+        # recorded here within the last sync interval may still be on their way to the shared state.
+        for entry in self.entries:
+            if entry.index in seen or not (entry.failures or entry.last_fail):
+                continue
+            if now - entry.last_fail > self.sync_interval_sec:
+                self._apply(entry, 0, 0.0, now)
+
+    def is_available(self, index: int) -> bool:
+        now = time.time()
+        self._expire(now)
+        return self.entries[index].banned_until <= now
+
+    def next_available(self, start: int = 0, exclude: Optional[int] = None) -> Optional[ProxyEntry]:
+        """First proxy that is not banned (nor index exclude), starting at index start (wrapping around)."""
+        self.sync()
+        now = time.time()
+        self._expire(now)
+        count = len(self.entries)
+        if not count or self.banned >= count:
+            return None
+        for offset in range(count):
+            entry = self.entries[(start + offset) % count]
+            if entry.banned_until <= now and entry.index != exclude:
+                return entry
+        return None
+
+    def _effective_stats(self, entry: ProxyEntry, domain: Optional[str]) -> ProxyStats:
+        if domain and self.max_domain_stats:
+            stats = self._domain_stats.get((domain, entry.index))
+            if stats is not None and stats.samples >= self.min_domain_samples:
+                return stats
+        return entry.stats
+
+    def _random_available(self, now: float, exclude: Optional[int] = None, tries: int = 8) -> Optional[ProxyEntry]:
+        count = len(self.entries)
+        for _ in range(tries):
+            entry = self.entries[random.randrange(count)]
+            if entry.banned_until <= now and entry.index != exclude:
+                return entry
+        # Mostly banned pool: walk from a random start
+        return self.next_available(random.randrange(count), exclude)
+
+    def choose(self, domain: Optional[str] = None, exclude: Optional[int] = None) -> Optional[ProxyEntry]:
+        """Pick an available proxy for domain other than index exclude (see class docstring); None if there is none."""
+        self.sync()
+        now = time.time()
+        self._expire(now)
+        count = len(self.entries)
+        if not count or self.banned >= count:
+            return None
+        if self.selection == "weighted":
+            available = [entry for entry in self.entries if entry.banned_until <= now and entry.index != exclude]
+            if not available:
+                return None
+            weights = [self._effective_stats(entry, domain).score() for entry in available]
+            return random.choices(available, weights=weights)[0]
+        first = self._random_available(now, exclude)
+        if self.selection == "random" or first is None or count - self.banned < 2:
+            return first
+        second = self._random_available(now, exclude)
+        if second is None or second is first:
+            return first
+        if self._effective_stats(second, domain).score() > self._effective_stats(first, domain).score():
+            return second
+        return first
+
+    def _domain_entry(self, domain: str, index: int) -> ProxyStats:
+        key = (domain, index)
+        stats = self._domain_stats.get(key)
+        if stats is None:
+            stats = self._domain_stats[key] = ProxyStats()
+            while len(self._domain_stats) > self.max_domain_stats:
+                self._domain_stats.popitem(last=False)
+        else:
+            self._domain_stats.move_to_end(key)
+        return stats
+
+    def record_navigation(self, index: int, domain: Optional[str], latency_sec: Optional[float], ok: bool) -> None:
+        """Outcome of one navigation through proxy index (ok: page loaded without a blocking status)."""
+        if not 0 <= index < len(self.entries):
+            return
+        self.entries[index].stats.record(latency_sec, ok, self.ewma_alpha)
+        if domain and self.max_domain_stats:
+            self._domain_entry(domain, index).record(latency_sec, ok, self.ewma_alpha)
+
+    def record_challenge(self, index: int, domain: Optional[str], challenged: bool) -> None:
+        """Whether a navigation through proxy index landed on a challenge page."""
+        if not 0 <= index < len(self.entries):
+            return
+        self.entries[index].stats.record_challenge(challenged, self.ewma_alpha)
+        if domain and self.max_domain_stats:
+            self._domain_entry(domain, index).record_challenge(challenged, self.ewma_alpha)
+
+    def proxy_stats(self, limit: int = 50) -> List[Dict[str, Any]]:
+        """Stats of the limit most used proxies (by samples)."""
+        now = time.time()
+        entries = heapq.nlargest(limit, (e for e in self.entries if e.stats.samples), key=lambda e: e.stats.samples)
+        return [
+            {
+                "index": entry.index,
+                "url": entry.url,
+                "banned": entry.banned_until > now,
+                "failures": entry.failures,
+                "score": round(entry.stats.score(), 3),
+                **entry.stats.to_dict(),
+            }
+            for entry in entries
+        ]
+
+    def mark_failed(self, url: str) -> Optional[ProxyEntry]:
+        """
+        Record a failure (shared with all workers) and ban the proxy accordingly.
+        The ban is decided on this worker's count; the shared count is written in the background
+        and failures from other workers arrive with the next sync().
+        """
+        now = time.time()
+
+        def _fail(record):
+            count = record.get("count", 0) if isinstance(record, dict) else 0
+            return {"count": count + 1, "last_fail": now}
+
+        state = get_state()
+        state.submit(state.update, f"proxy:{url}", _fail, ttl=self.failure_ttl_sec)
+        entry = self._by_url.get(url)
+        if entry is None:
+            return None
+        self._expire(now)
+        failures = entry.failures + 1
+        self._apply(entry, failures, now, now)
+        return entry
+
+    def mark_healthy(self, url: str) -> None:
+        """Forget a proxy's failures and lift its ban (e.g. it passed a health probe)."""
+        entry = self._by_url.get(url)
+        if entry is None or not (entry.failures or entry.banned_until):
+            return
+        state = get_state()
+        state.submit(state.delete, f"proxy:{url}")
+        now = time.time()
+        self._expire(now)
+        self._apply(entry, 0, 0.0, now)
+
+    def context_opened(self, entry: ProxyEntry) -> None:
+        entry.active += 1
+        self.active_contexts += 1
+
+    def context_closed(self, entry: ProxyEntry) -> None:
+        entry.active = max(0, entry.active - 1)
+        self.active_contexts = max(0, self.active_contexts - 1)
+
+    def record_bytes(self, entry: ProxyEntry, sent: int, received: int) -> None:
+        entry.bytes_sent += sent
+        entry.bytes_received += received
+        self.bytes_sent += sent
+        self.bytes_received += received
+
+    @staticmethod
+    def _row(entry: ProxyEntry, now: float) -> Dict[str, Any]:
+        stats = entry.stats
+        return {
+            "index": entry.index,
+            "url": entry.url,
+            "type": entry.type,
+            "state": "banned" if entry.banned_until > now else "healthy",
+            "banned_until": entry.banned_until if entry.banned_until > now else None,
+            "failures": entry.failures,
+            "last_fail": entry.last_fail or None,
+            **stats.to_dict(),
+            "latency_p50_ms": stats.percentile_ms(0.5),
+            "latency_p90_ms": stats.percentile_ms(0.9),
+            "latency_p99_ms": stats.percentile_ms(0.99),
+            "score": round(stats.score(), 3),
+            "active_contexts": entry.active,
+            "bytes_sent": entry.bytes_sent,
+            "bytes_received": entry.bytes_received,
+        }
+
+    _SORT_KEYS = {
+        "index": (lambda e: e.index, False),
+        "score": (lambda e: e.stats.score(), True),
+        "latency": (lambda e: e.stats.latency if e.stats.latency is not None else float("inf"), False),
+        "failures": (lambda e: e.failures, True),
+        "samples": (lambda e: e.stats.samples, True),
+        "bytes": (lambda e: e.bytes_sent + e.bytes_received, True),
+        "active": (lambda e: e.active, True),
+    }
+
+    def list_proxies(
+        self,
+        page: int = 1,
+        page_size: int = 50,
+        state: Optional[str] = None,
+        proxy_type: Optional[str] = None,
+        search: Optional[str] = None,
+        sort: str = "index",
+    ) -> Dict[str, Any]:
+        """
+        One page of proxy rows. Rows are built only for the page; filters are attribute checks and
+        a non-index sort is a partial sort (heapq) of the matches up to the requested page.
+        """
+        self.sync()
+        now = time.time()
+        self._expire(now)
+        page = max(1, int(page))
+        page_size = min(500, max(1, int(page_size)))
+        proxy_type = proxy_type.upper() if proxy_type else None
+        matches = [
+            e for e in self.entries
+            if (state is None or (state == "banned") == (e.banned_until > now))
+            and (proxy_type is None or e.type == proxy_type)
+            and (not search or search in e.url)
+        ]
+        key, descending = self._SORT_KEYS.get(sort, self._SORT_KEYS["index"])
+        end = page * page_size
+        if sort != "index":
+            select = heapq.nlargest if descending else heapq.nsmallest
+            matches_page = select(end, matches, key=key)[end - page_size:]
+        else:
+            matches_page = matches[end - page_size:end]
+        return {
+            **self.snapshot(),
+            "matched": len(matches),
+            "page": page,
+            "page_size": page_size,
+            "pages": (len(matches) + page_size - 1) // page_size,
+            "proxies": [self._row(entry, now) for entry in matches_page],
+        }
+
+    def snapshot(self) -> Dict[str, Any]:
+        self._expire(time.time())
+        return {
+            "total": len(self.entries),
+            "banned": self.banned,
+            "available": len(self.entries) - self.banned,
+            "next_unban_in_sec": round(max(0.0, self._ban_heap[0][0] - time.time()), 1) if self._ban_heap and self.banned else None,
+            "selection": self.selection,
+            "domain_stats": len(self._domain_stats),
+            "active_contexts": self.active_contexts,
+            "bytes_sent": self.bytes_sent,
+            "bytes_received": self.bytes_received,
+        }
+
+
+_registry: Optional[ProxyRegistry] = None
+
+
+def get_proxy_registry() -> ProxyRegistry:
+    """Process-wide proxy registry (empty when PROXY_ENABLED is false)."""
+    global _registry
+    if _registry is None:
+        _registry = ProxyRegistry(
+            Config.PROXY_LIST if Config.PROXY_ENABLED else [],
+            max_failures=Config.PROXY_MAX_FAILURES,
+            ban_time_sec=Config.PROXY_BAN_TIME_SEC,
+            failure_ttl_sec=max(Config.PROXY_TEST_INTERVAL, Config.PROXY_BAN_TIME_SEC, 60),
+            selection=Config.PROXY_SELECTION,
+            ewma_alpha=Config.PROXY_EWMA_ALPHA,
+            max_domain_stats=Config.PROXY_DOMAIN_STATS_MAX,
+        )
+        if _registry.entries:
+            logger.info(f"Loaded {len(_registry)} proxies from environment")
+    return _registry
@@ -0,0 +1,322 @@
+"""
+API Key Quotas Module
+Per-API-key token-bucket rate limits and concurrency/queue quotas
+
+Author: Volkan AYDIN
+Year: 2025
+License: CC BY-NC-SA 4.0 (Non-Commercial)
+
+Limits file (JSON), path from API_KEY_LIMITS_FILE:
+{
+    "default": {"rate": 1.0, "burst": 10, "max_concurrent": 5, "max_queued": 50, "priorities": ["default", "bulk"]},
+    "keys": {
+        "sk-demo-key-12345": {"rate": 5, "burst": 20, "max_concurrent": 10, "max_queued": 100, "priorities": null}
+    }
+}
+rate: sustained requests per second (token refill), burst: bucket size (at least 1).
+rate 0 blocks the key.
+priorities: priority classes the key may request.
+Any limit left out (or null) is unlimited. Keys not listed use "default".
+With a shared state backend, buckets and counters are shared by all worker processes.
+"""
+
+import json
+import os
+import time
+import logging
+from typing import Optional, Dict, Any, List, Set
+
+logger = logging.getLogger(__name__)
+
+_LIMIT_FIELDS = ("rate", "burst", "max_concurrent", "max_queued", "priorities")
+# Upper bound of any Retry-After we hand out (a near-zero rate would otherwise ask for days)
+MAX_RETRY_AFTER_SEC = 3600.0
+
+
+class KeyLimits:
+    """Limits for one API key (None = unlimited)."""
+
+    __slots__ = _LIMIT_FIELDS
+
+    def __init__(self, rate: Optional[float] = None, burst: Optional[float] = None,
+                 max_concurrent: Optional[int] = None, max_queued: Optional[int] = None,
+                 priorities: Optional[List[str]] = None):
+        # rate <= 0: the key is blocked
+        self.rate = max(0.0, float(rate)) if rate is not None else None
+        # Bucket size defaults to one second of traffic; a bucket below one token could never admit a request
+        if burst is None and self.rate is not None:
+            burst = self.rate
+        self.burst = max(1.0, float(burst)) if burst is not None else None
+        self.max_concurrent = int(max_concurrent) if max_concurrent is not None else None
+        self.max_queued = int(max_queued) if max_queued is not None else None
+        if isinstance(priorities, str):
+            priorities = [priorities]
+        self.priorities = [str(p) for p in priorities] if priorities is not None else None
+
+    @classmethod
+    def from_dict(cls, data: Optional[Dict[str, Any]], base: Optional["KeyLimits"] = None) -> "KeyLimits":
+        values = {f: getattr(base, f) for f in _LIMIT_FIELDS} if base else {}
+        for f in _LIMIT_FIELDS:
+            if data and f in data:
+                values[f] = data[f]
+        if data and isinstance(data.get("burst"), (int, float)) and data["burst"] < 1:
+            logger.warning(f"⚠️ API key limit burst {data['burst']} is below 1, using 1")
+        return cls(**values)
+
+    @property
+    def blocked(self) -> bool:
+        return self.rate is not None and self.rate <= 0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {f: getattr(self, f) for f in _LIMIT_FIELDS}
+
+
+class TokenBucket:
+    """Classic token bucket: `rate` tokens per second, at most `burst` tokens."""
+
+    __slots__ = ("rate", "burst", "tokens", "updated_at")
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated_at = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def try_take(self, amount: float = 1.0) -> float:
+        """Take tokens. Returns 0 on success, else seconds until enough tokens are available."""
+        now = time.monotonic()
+        self._refill(now)
+        if self.tokens >= amount:
+            self.tokens -= amount
+            return 0.0
+        if self.rate <= 0:
+            return float("inf")
+        return (amount - self.tokens) / self.rate
+
+    @staticmethod
+    def take_shared(state: Optional[Dict[str, float]], rate: float, burst: float, amount: float = 1.0):
+        """
+        Same algorithm on a stored {"tokens", "updated_at"} dict (wall clock, shared across processes).
+        Returns (new state, seconds to wait; 0 = taken).
+        """
+        now = time.time()
+        tokens = burst if not state else min(burst, state["tokens"] + max(0.0, now - state["updated_at"]) * rate)
+        if tokens >= amount:
+            return {"tokens": tokens - amount, "updated_at": now}, 0.0
+        wait = float("inf") if rate <= 0 else (amount - tokens) / rate
+        return {"tokens": tokens, "updated_at": now}, wait
+
+    def available(self) -> float:
+        self._refill(time.monotonic())
+        return self.tokens
+
+
+class QuotaExceeded(Exception):
+    """Raised when an API key is over its rate limit or queue quota."""
+
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = min(retry_after, MAX_RETRY_AFTER_SEC)
+
+
+class KeyBlocked(QuotaExceeded):
+    """Raised when an API key's limits block it entirely (rate 0)."""
+
+    def __init__(self, reason: str):
+        super().__init__(reason, MAX_RETRY_AFTER_SEC)
+
+
+class KeyQuotas:
+    """
+    Per-key rate limits and quotas, loaded from a JSON file and reloaded when it changes.
+    state: optional shared state backend (see shared_state.py) holding token buckets and counters.
+    """
+
+    _STAT_NAMES = ("accepted", "rate_limited", "queue_limited")
+
+    def __init__(self, path: Optional[str] = None, reload_interval_sec: float = 5.0, state=None):
+        self.path = path
+        self.reload_interval_sec = reload_interval_sec
+        self.state = state
+        self.default = KeyLimits()
+        self.limits: Dict[str, KeyLimits] = {}
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._stats: Dict[str, Dict[str, int]] = {}
+        self._mtime: Optional[float] = None
+        self._checked_at = 0.0
+        self.load()
+
+    def load(self) -> None:
+        """(Re)load limits from the file. Missing file or parse errors keep the previous limits."""
+        if not self.path:
+            return
+        try:
+            mtime = os.path.getmtime(self.path)
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            default = KeyLimits.from_dict(data.get("default"))
+            limits = {
+                key: KeyLimits.from_dict(values, base=default)
+                for key, values in (data.get("keys") or {}).items()
+            }
+        except FileNotFoundError:
+            logger.warning(f"⚠️ API key limits file not found: {self.path} (no per-key limits)")
+            return
+        except Exception as e:
+            logger.error(f"❌ Could not load API key limits from {self.path}: {e}")
+            return
+        self.default = default
+        self.limits = limits
+        self._mtime = mtime
+        # Buckets are rebuilt lazily with the new rate/burst
+        self._buckets.clear()
+        logger.info(f"🔑 Loaded API key limits for {len(limits)} keys from {self.path} (default {default.to_dict()})")
+
+    def _maybe_reload(self) -> None:
+        if not self.path:
+            return
+        now = time.monotonic()
+        if now - self._checked_at < self.reload_interval_sec:
+            return
+        self._checked_at = now
+        try:
+            if os.path.getmtime(self.path) != self._mtime:
+                self.load()
+        except OSError:
+            pass
+
+    def limits_for(self, api_key: str) -> KeyLimits:
+        return self.limits.get(api_key, self.default)
+
+    def _bucket(self, api_key: str, limits: KeyLimits) -> Optional[TokenBucket]:
+        if limits.rate is None:
+            return None
+        bucket = self._buckets.get(api_key)
+        if bucket is None:
+            bucket = self._buckets[api_key] = TokenBucket(limits.rate, limits.burst)
+        return bucket
+
+    async def _take_token(self, api_key: str, limits: KeyLimits) -> float:
+        """Take one token from the key's bucket; returns seconds to wait (0 = allowed)."""
+        if self.state is None:
+            bucket = self._bucket(api_key, limits)
+            return bucket.try_take() if bucket is not None else 0.0
+        if limits.rate is None:
+            return 0.0
+        result = {"wait": 0.0}
+
+        def _take(stored):
+            new_state, result["wait"] = TokenBucket.take_shared(stored, limits.rate, limits.burst)
+            return new_state
+
+        try:
+            # A bucket idle long enough to be full again carries no information
+            ttl = limits.burst / limits.rate + 60 if limits.rate > 0 else None
+            await self.state.aupdate(f"ratelimit:{api_key}", _take, ttl=ttl)
+        except Exception as e:
+            logger.warning(f"⚠️ Shared rate limit unavailable for {api_key[:20]}...: {e}")
+            bucket = self._bucket(api_key, limits)
+            return bucket.try_take() if bucket is not None else 0.0
+        return result["wait"]
+
+    async def _tokens_available(self, api_key: str, limits: KeyLimits) -> Optional[float]:
+        if limits.rate is None:
+            return None
+        if self.state is None:
+            return self._bucket(api_key, limits).available()
+        try:
+            stored = await self.state.aget(f"ratelimit:{api_key}")
+        except Exception:
+            stored = None
+        if not stored:
+            return limits.burst
+        return min(limits.burst, stored["tokens"] + max(0.0, time.time() - stored["updated_at"]) * limits.rate)
+
+    def _stat(self, api_key: str, name: str) -> None:
+        if self.state is not None:
+            # Counted on the state's writer thread, the request does not wait for it
+            self.state.submit(self._shared_stat, api_key, name)
+            return
+        self._local_stat(api_key, name)
+
+    def _shared_stat(self, api_key: str, name: str) -> None:
+        try:
+            self.state.incr(f"quota:{api_key}:{name}")
+        except Exception as e:
+            logger.warning(f"⚠️ Shared quota counter unavailable: {e}")
+            self._local_stat(api_key, name)
+
+    def _local_stat(self, api_key: str, name: str) -> None:
+        stats = self._stats.setdefault(api_key, {n: 0 for n in self._STAT_NAMES})
+        stats[name] += 1
+
+    async def _stats_for(self, api_key: str) -> Dict[str, int]:
+        stats = dict(self._stats.get(api_key, {n: 0 for n in self._STAT_NAMES}))
+        if self.state is not None:
+            try:
+                for key, value in (await self.state.aitems(f"quota:{api_key}:")).items():
+                    name = key.rsplit(":", 1)[-1]
+                    if name in stats:
+                        stats[name] += int(value)
+            except Exception:
+                pass
+        return stats
+
+    async def check_request(self, api_key: str, queued: int, retry_hint_sec: float = 1.0) -> None:
+        """
+        Admit a new request for api_key or raise QuotaExceeded.
+        queued: the key's currently queued (not yet running) requests.
+        retry_hint_sec: suggested Retry-After when the queue quota is full (e.g. average job duration).
+        """
+        self._maybe_reload()
+        limits = self.limits_for(api_key)
+        if limits.blocked:
+            self._stat(api_key, "rate_limited")
+            raise KeyBlocked("API key is blocked (rate limit 0)")
+        if limits.max_queued is not None and queued >= limits.max_queued:
+            self._stat(api_key, "queue_limited")
+            raise QuotaExceeded(
+                f"Queue quota exceeded ({queued}/{limits.max_queued} queued requests)",
+                max(1.0, retry_hint_sec),
+            )
+        wait = await self._take_token(api_key, limits)
+        if wait > 0:
+            self._stat(api_key, "rate_limited")
+            raise QuotaExceeded(f"Rate limit exceeded ({limits.rate:g} requests/s, burst {limits.burst:g})", wait)
+        self._stat(api_key, "accepted")
+
+    def allows_priority(self, api_key: str, priority: str) -> bool:
+        """True if api_key may request the (resolved) priority class."""
+        allowed = self.limits_for(api_key).priorities
+        return allowed is None or priority in allowed
+
+    def can_start(self, api_key: str, active: int) -> bool:
+        """True if api_key may start another concurrent scrape."""
+        limits = self.limits_for(api_key)
+        return limits.max_concurrent is None or active < limits.max_concurrent
+
+    async def usage(self, api_key: str, active: int, queued: int) -> Dict[str, Any]:
+        """Current usage of one key against its limits."""
+        limits = self.limits_for(api_key)
+        tokens = await self._tokens_available(api_key, limits)
+        return {
+            "limits": limits.to_dict(),
+            "active": active,
+            "queued": queued,
+            "tokens_available": round(tokens, 2) if tokens is not None else None,
+            "requests": await self._stats_for(api_key),
+        }
+
+    async def known_keys(self) -> Set[str]:
+        keys = set(self.limits) | set(self._stats)
+        if self.state is not None:
+            try:
+                keys |= {key[len("quota:"):].rsplit(":", 1)[0] for key in await self.state.aitems("quota:")}
+            except Exception:
+                pass
+        return keys
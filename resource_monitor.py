@@ -0,0 +1,374 @@
+"""
+Resource Monitor Module
+Memory-, cgroup- and file-descriptor-aware admission control for browser scrapes
+
+Author: Volkan AYDIN
+Year: 2025
+License: CC BY-NC-SA 4.0 (Non-Commercial)
+"""
+
+import os
+import time
+import logging
+from typing import Optional, Dict, Any, Tuple, List, Callable
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+_MB = 1024 * 1024
+# cgroup v1 reports "no limit" as a huge page-aligned number
+_CGROUP_V1_UNLIMITED = 1 << 60
+
+_CGROUP_V2_ROOT = "/sys/fs/cgroup"
+_CGROUP_V1_MEMORY = "/sys/fs/cgroup/memory"
+
+
+def _read_int(path: str) -> Optional[int]:
+    try:
+        with open(path, "r") as f:
+            value = f.read().strip()
+    except OSError:
+        return None
+    if value == "max":
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        return None
+
+
+def _read_stat_value(path: str, name: str) -> int:
+    """Value of one "name value" line in a cgroup memory.stat file (0 if missing)."""
+    try:
+        with open(path, "r") as f:
+            for line in f:
+                key, _, value = line.partition(" ")
+                if key == name:
+                    return int(value)
+    except (OSError, ValueError):
+        pass
+    return 0
+
+
+def _cgroup_dirs(mount: str, path: str) -> List[str]:
+    """This process' cgroup directory under mount and its ancestors up to mount (own first)."""
+    own = os.path.normpath(os.path.join(mount, path.lstrip("/")))
+    if not os.path.isdir(own):
+        # Namespaced container: /proc/self/cgroup shows a host path, the mount root is our cgroup
+        return [mount]
+    dirs = [own]
+    while own != os.path.normpath(mount) and own != os.path.dirname(own):
+        own = os.path.dirname(own)
+        dirs.append(own)
+    return dirs
+
+
+def _resolve_memory_cgroup() -> Tuple[Optional[str], List[str]]:
+    """("v2" or "v1", cgroup dirs from own to the root) of this process' memory controller, (None, []) if none."""
+    try:
+        with open("/proc/self/cgroup", "r") as f:
+            lines = f.read().splitlines()
+    except OSError:
+        lines = []
+    paths: Dict[str, str] = {}
+    for line in lines:
+        parts = line.split(":", 2)
+        if len(parts) != 3:
+            continue
+        if parts[0] == "0" and not parts[1]:
+            paths["v2"] = parts[2]
+        elif "memory" in parts[1].split(","):
+            paths["v1"] = parts[2]
+    try:
+        with open(os.path.join(_CGROUP_V2_ROOT, "cgroup.controllers"), "r") as f:
+            v2_memory = "memory" in f.read().split()
+    except OSError:
+        v2_memory = False
+    if v2_memory:
+        return "v2", _cgroup_dirs(_CGROUP_V2_ROOT, paths.get("v2", "/"))
+    if os.path.isdir(_CGROUP_V1_MEMORY):
+        return "v1", _cgroup_dirs(_CGROUP_V1_MEMORY, paths.get("v1", "/"))
+    return None, []
+
+
+# Resolved once: a process does not move between cgroups
+_memory_cgroup: Optional[Tuple[Optional[str], List[str]]] = None
+
+
+def read_cgroup_memory() -> Tuple[Optional[int], Optional[int]]:
+    """
+    (working set bytes, limit bytes) of this process' memory cgroup.
+    Working set = usage minus inactive file cache (reclaimable, same as the OOM killer sees it).
+    The cgroup comes from /proc/self/cgroup; the tightest memory limit of it and its ancestors
+    (e.g. a systemd MemoryMax on the slice) is the one reported, with that level's working set.
+    Limit is None when no level is limited or no cgroup memory controller is available.
+    """
+    global _memory_cgroup
+    if _memory_cgroup is None:
+        _memory_cgroup = _resolve_memory_cgroup()
+    version, dirs = _memory_cgroup
+    if version == "v2":
+        usage_name, limit_name, inactive_name = "memory.current", "memory.max", "inactive_file"
+    elif version == "v1":
+        usage_name, limit_name, inactive_name = "memory.usage_in_bytes", "memory.limit_in_bytes", "total_inactive_file"
+    else:
+        return None, None
+    own_used: Optional[int] = None
+    tightest: Optional[Tuple[int, int, int]] = None  # (headroom, working set, limit)
+    for directory in dirs:
+        current = _read_int(os.path.join(directory, usage_name))
+        if current is None:
+            # The host's root cgroup has no usage file
+            continue
+        used = max(0, current - _read_stat_value(os.path.join(directory, "memory.stat"), inactive_name))
+        if own_used is None:
+            own_used = used
+        limit = _read_int(os.path.join(directory, limit_name))
+        if limit is None or limit >= _CGROUP_V1_UNLIMITED:
+            continue
+        if tightest is None or limit - used < tightest[0]:
+            tightest = (limit - used, used, limit)
+    if tightest is not None:
+        return tightest[1], tightest[2]
+    return own_used, None
+
+
+def read_meminfo_available() -> Optional[int]:
+    """MemAvailable of the host (bytes), None if /proc/meminfo is unavailable."""
+    try:
+        with open("/proc/meminfo", "r") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+def read_process_table() -> Optional[Dict[int, Tuple[int, int]]]:
+    """{pid: (ppid, rss pages)} of all visible processes, None without /proc."""
+    try:
+        pids = [int(p) for p in os.listdir("/proc") if p.isdigit()]
+    except OSError:
+        return None
+    table: Dict[int, Tuple[int, int]] = {}
+    for pid in pids:
+        try:
+            with open(f"/proc/{pid}/stat", "r") as f:
+                data = f.read()
+            # comm (field 2) may contain spaces and parentheses: split after the last ')'
+            fields = data[data.rindex(")") + 2:].split()
+            table[pid] = (int(fields[1]), int(fields[21]))
+        except (OSError, ValueError, IndexError):
+            continue
+    return table
+
+
+def descendant_pids(root_pid: int, table: Dict[int, Tuple[int, int]]) -> List[int]:
+    """All descendants of root_pid in a process table (children before grandchildren)."""
+    children: Dict[int, List[int]] = {}
+    for pid, (ppid, _) in table.items():
+        children.setdefault(ppid, []).append(pid)
+    result: List[int] = []
+    queue = list(children.get(root_pid, ()))
+    while queue:
+        pid = queue.pop(0)
+        result.append(pid)
+        queue.extend(children.get(pid, ()))
+    return result
+
+
+def read_child_tree_rss(root_pid: Optional[int] = None) -> Tuple[Optional[int], int]:
+    """
+    (summed RSS bytes, process count) of all descendants of root_pid (default: this process),
+    i.e. the playwright drivers and their Chromium process trees. (None, 0) without /proc.
+    """
+    table = read_process_table()
+    if table is None:
+        return None, 0
+    page_size = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+    pids = descendant_pids(root_pid or os.getpid(), table)
+    return sum(table[pid][1] for pid in pids) * page_size, len(pids)
+
+
+def read_fd_usage() -> Tuple[Optional[int], Optional[int]]:
+    """(open fds, soft RLIMIT_NOFILE) of this process; None where unavailable."""
+    try:
+        open_fds = len(os.listdir("/proc/self/fd"))
+    except OSError:
+        open_fds = None
+    limit = None
+    if resource is not None:
+        try:
+            soft, _ = resource.getrlimit(resource.RLIMIT_NOFILE)
+            if soft != resource.RLIM_INFINITY:
+                limit = soft
+        except (OSError, ValueError):
+            pass
+    return open_fds, limit
+
+
+class ResourceSample:
+    """One reading of memory, browser RSS and file descriptors."""
+
+    __slots__ = (
+        "taken_at", "memory_used", "memory_limit", "memory_available",
+        "browser_rss", "browser_processes", "open_fds", "fd_limit",
+    )
+
+    def __init__(self, browser_rss: Optional[Tuple[Optional[int], int]] = None):
+        self.taken_at = time.monotonic()
+        self.memory_used, self.memory_limit = read_cgroup_memory()
+        if self.memory_limit is not None and self.memory_used is not None:
+            self.memory_available: Optional[int] = max(0, self.memory_limit - self.memory_used)
+        else:
+            # No cgroup limit: the host's available memory is the real bound
+            self.memory_available = read_meminfo_available()
+        self.browser_rss, self.browser_processes = browser_rss if browser_rss is not None else read_child_tree_rss()
+        self.open_fds, self.fd_limit = read_fd_usage()
+
+    def free_fds(self) -> Optional[int]:
+        if self.open_fds is None or self.fd_limit is None:
+            return None
+        return self.fd_limit - self.open_fds
+
+
+class ResourceMonitor:
+    """
+    Admission control from live resource signals instead of the load average.
+
+    A new scrape may start when available memory (cgroup limit minus working set, or the host's
+    MemAvailable) still covers one more scrape - memory_headroom_mb, or the measured average
+    browser RSS per running scrape if that is larger - on top of what recently started scrapes
+    have not allocated yet, and when enough file descriptors are free.
+
+    Samples are cached for sample_ttl_sec (admission checks run on every dispatch) and invalidated
+    when a scrape finishes, so the scheduler's re-dispatch on release sees the freed memory at once.
+    The browser RSS (a scan of all of /proc) is re-read at most every rss_interval_sec, invalidated or not.
+    Where a signal is unavailable (no /proc, no cgroup) it does not restrict admission.
+    """
+
+    def __init__(
+        self,
+        memory_headroom_mb: float = 512,
+        fd_headroom: int = 64,
+        reject_below_mb: float = 256,
+        ramp_up_sec: float = 10.0,
+        sample_ttl_sec: float = 0.5,
+        rss_interval_sec: float = 2.0,
+        idle_browsers: Optional[Callable[[], int]] = None,
+    ):
+        self.memory_headroom = max(0.0, float(memory_headroom_mb)) * _MB
+        self.fd_headroom = max(0, int(fd_headroom))
+        self.reject_below = max(0.0, float(reject_below_mb)) * _MB
+        self.ramp_up_sec = max(0.0, float(ramp_up_sec))
+        self.sample_ttl_sec = max(0.0, float(sample_ttl_sec))
+        self.rss_interval_sec = max(self.sample_ttl_sec, float(rss_interval_sec))
+        self._rss: Optional[Tuple[Optional[int], int]] = None
+        self._rss_at = 0.0
+        # Browsers kept alive between requests (warm contexts) also count in the measured RSS
+        self.idle_browsers = idle_browsers
+        self._sample: Optional[ResourceSample] = None
+        self._starts: List[float] = []
+        self._active = 0
+        self.blocked = 0
+
+    def sample(self) -> ResourceSample:
+        sample = self._sample
+        now = time.monotonic()
+        if sample is None or now - sample.taken_at > self.sample_ttl_sec:
+            if self._rss is None or now - self._rss_at > self.rss_interval_sec:
+                self._rss = read_child_tree_rss()
+                self._rss_at = now
+            sample = self._sample = ResourceSample(self._rss)
+        return sample
+
+    def invalidate(self) -> None:
+        self._sample = None
+
+    def _ramping(self) -> int:
+        """Scrapes started within ramp_up_sec (their browser has not reached its full RSS yet)."""
+        cutoff = time.monotonic() - self.ramp_up_sec
+        self._starts = [t for t in self._starts if t > cutoff]
+        return len(self._starts)
+
+    def per_scrape_bytes(self, sample: Optional[ResourceSample] = None) -> float:
+        """Memory one more scrape is expected to need."""
+        sample = sample or self.sample()
+        browsers = self._active + (self.idle_browsers() if self.idle_browsers else 0)
+        measured = (sample.browser_rss or 0) / browsers if browsers else 0.0
+        return max(self.memory_headroom, measured)
+
+    def can_start(self) -> bool:
+        """True if resources allow one more concurrent scrape."""
+        if self._active == 0:
+            # Nothing running means nothing will be released: never block the only job
+            return True
+        sample = self.sample()
+        if sample.memory_available is not None:
+            needed = self.per_scrape_bytes(sample) * (1 + self._ramping())
+            if sample.memory_available < needed:
+                self.blocked += 1
+                return False
+        free_fds = sample.free_fds()
+        if free_fds is not None and free_fds < self.fd_headroom:
+            self.blocked += 1
+            return False
+        return True
+
+    def overload_reason(self) -> Optional[str]:
+        """Reason to reject new requests outright (memory or fds nearly exhausted), else None."""
+        sample = self.sample()
+        if sample.memory_available is not None and sample.memory_available < self.reject_below:
+            return f"memory nearly exhausted ({sample.memory_available / _MB:.0f} MB available)"
+        free_fds = sample.free_fds()
+        if free_fds is not None and free_fds < max(8, self.fd_headroom // 4):
+            return f"file descriptors nearly exhausted ({free_fds} free)"
+        return None
+
+    def on_start(self) -> None:
+        self._active += 1
+        self._starts.append(time.monotonic())
+        self.invalidate()
+
+    def on_finish(self) -> None:
+        self._active = max(0, self._active - 1)
+        self.invalidate()
+
+    def describe(self) -> str:
+        """Short summary for log lines."""
+        sample = self.sample()
+        parts = []
+        if sample.memory_available is not None:
+            parts.append(f"mem free {sample.memory_available / _MB:.0f} MB")
+        if sample.browser_rss is not None:
+            parts.append(f"browsers {sample.browser_rss / _MB:.0f} MB")
+        free_fds = sample.free_fds()
+        if free_fds is not None:
+            parts.append(f"fds free {free_fds}")
+        return ", ".join(parts) or "no resource data"
+
+    def snapshot(self) -> Dict[str, Any]:
+        sample = self.sample()
+
+        def mb(value):
+            return round(value / _MB, 1) if value is not None else None
+
+        return {
+            "memory_used_mb": mb(sample.memory_used),
+            "memory_limit_mb": mb(sample.memory_limit),
+            "memory_available_mb": mb(sample.memory_available),
+            "browser_rss_mb": mb(sample.browser_rss),
+            "browser_processes": sample.browser_processes,
+            "open_fds": sample.open_fds,
+            "fd_limit": sample.fd_limit,
+            "memory_headroom_mb": mb(self.memory_headroom),
+            "per_scrape_estimate_mb": mb(self.per_scrape_bytes(sample)),
+            "fd_headroom": self.fd_headroom,
+            "ramping_up": self._ramping(),
+            "blocked_checks": self.blocked,
+        }
@@ -0,0 +1,528 @@
+"""
+Scrape Scheduler Module
+Priority classes with weighted fair queuing across API keys
+
+Author: Volkan AYDIN
+Year: 2025
+License: CC BY-NC-SA 4.0 (Non-Commercial)
+"""
+
+import asyncio
+import heapq
+import math
+import time
+import logging
+from collections import deque
+from typing import Optional, Dict, Any, List, Tuple, Callable, Deque
+
+logger = logging.getLogger(__name__)
+
+
+def parse_priority_classes(spec: str) -> List[Tuple[str, int]]:
+    """
+    Parse a priority class spec into [(name, reserved_slots)], highest priority first.
+    Format: "interactive:2,default,bulk:0" (reserved slots optional, default 0).
+    """
+    classes: List[Tuple[str, int]] = []
+    for item in (spec or "").split(","):
+        item = item.strip()
+        if not item:
+            continue
+        name, _, reserved = item.partition(":")
+        name = name.strip()
+        if not name or any(name == c[0] for c in classes):
+            continue
+        try:
+            reserved_slots = max(0, int(reserved)) if reserved.strip() else 0
+        except ValueError:
+            logger.warning(f"⚠️ Invalid reserved slots for priority class '{name}': {reserved}")
+            reserved_slots = 0
+        classes.append((name, reserved_slots))
+    return classes
+
+
+def parse_key_weights(spec: str) -> Dict[str, float]:
+    """Parse "sk-a:3,sk-b:0.5" into {api_key: weight}. Keys without a weight use 1."""
+    weights: Dict[str, float] = {}
+    for item in (spec or "").split(","):
+        item = item.strip()
+        if not item:
+            continue
+        key, _, weight = item.rpartition(":")
+        if not key:
+            continue
+        try:
+            weights[key.strip()] = max(0.01, float(weight))
+        except ValueError:
+            logger.warning(f"⚠️ Invalid weight for API key {key[:20]}...: {weight}")
+    return weights
+
+
+class ScrapeJob:
+    """A scrape request waiting for, or holding, a scheduler slot."""
+
+    __slots__ = (
+        "job_id", "api_key", "priority", "domain", "url",
+        "enqueued_at", "started_at", "future", "seq",
+    )
+
+    def __init__(self, job_id: str, api_key: str, priority: str, domain: Optional[str] = None, url: Optional[str] = None):
+        self.job_id = job_id
+        self.api_key = api_key
+        self.priority = priority
+        self.domain = domain
+        self.url = url
+        self.enqueued_at = time.time()
+        self.started_at: Optional[float] = None
+        self.future: Optional[asyncio.Future] = None
+        self.seq = 0
+
+
+class ScrapeScheduler:
+    """
+    Admission scheduler for scrape slots.
+
+    - Priority classes are served in strict order, except that each class may reserve a
+      minimum number of concurrent slots: a class below its reservation is served first, and
+      other classes cannot take the slots it still has reserved.
+    - Within a class, API keys share slots by weighted fair queuing (stride scheduling: each
+      dispatch advances the key's pass by 1/weight; the backlogged key with the lowest pass goes next).
+    - Admission checks (callables job -> bool) can veto individual jobs; a vetoed job is skipped
+      and later jobs may overtake it. Key checks (callables api_key -> bool) veto all jobs of a key
+      at once (e.g. per-key concurrency quotas). Call notify() when a vetoed job may have become eligible.
+    - Per class, moving averages (EWMA) of job duration and arrival rate drive wait estimates:
+      estimate_admission() predicts when a new job would start, for early rejection against a deadline.
+    """
+
+    def __init__(
+        self,
+        max_concurrent: int,
+        classes: List[Tuple[str, int]],
+        key_weights: Optional[Dict[str, float]] = None,
+        default_class: str = "default",
+        initial_duration_sec: float = 30.0,
+        duration_alpha: float = 0.2,
+        arrival_window_sec: float = 60.0,
+    ):
+        self.max_concurrent = max(1, int(max_concurrent))
+        if not classes:
+            classes = [(default_class, 0)]
+        if default_class not in [c[0] for c in classes]:
+            classes = list(classes) + [(default_class, 0)]
+        self.class_order: List[str] = [c[0] for c in classes]
+        self.reserved: Dict[str, int] = {name: reserved for name, reserved in classes}
+        if sum(self.reserved.values()) > self.max_concurrent:
+            logger.warning(
+                f"⚠️ Reserved slots ({sum(self.reserved.values())}) exceed max concurrent ({self.max_concurrent})"
+            )
+        self.default_class = default_class
+        self.key_weights: Dict[str, float] = dict(key_weights or {})
+        self.duration_alpha = duration_alpha
+        self.arrival_window_sec = max(1.0, float(arrival_window_sec))
+
+        self._queues: Dict[str, Dict[str, Deque[ScrapeJob]]] = {c: {} for c in self.class_order}
+        self._pass: Dict[str, Dict[str, float]] = {c: {} for c in self.class_order}
+        self._vtime: Dict[str, float] = {c: 0.0 for c in self.class_order}
+        self._active: Dict[str, ScrapeJob] = {}
+        self._active_by_class: Dict[str, int] = {c: 0 for c in self.class_order}
+        self._queued: Dict[str, ScrapeJob] = {}
+        self._avg_duration: Dict[str, float] = {c: float(initial_duration_sec) for c in self.class_order}
+        # Exponentially decayed arrival counters (time constant arrival_window_sec) -> arrivals per second
+        self._arrival_rate: Dict[str, float] = {c: 0.0 for c in self.class_order}
+        self._last_arrival: Dict[str, float] = {}
+        self._admission_checks: List[Callable[[ScrapeJob], bool]] = []
+        self._key_checks: List[Callable[[str], bool]] = []
+        self._start_listeners: List[Callable[[ScrapeJob], None]] = []
+        self._release_listeners: List[Callable[[ScrapeJob], None]] = []
+        self._active_by_key: Dict[str, int] = {}
+        self._queued_by_key: Dict[str, int] = {}
+        self._seq = 0
+        self.total_started = 0
+        self.total_finished = 0
+
+    # --- public API ---
+
+    def resolve_class(self, priority: Optional[str]) -> str:
+        """Return a known priority class name (unknown/empty -> default class)."""
+        if priority and priority in self._queues:
+            return priority
+        return self.default_class
+
+    def add_admission_check(self, check: Callable[[ScrapeJob], bool]) -> None:
+        """Register a predicate that must return True for a job to start."""
+        self._admission_checks.append(check)
+
+    def add_key_check(self, check: Callable[[str], bool]) -> None:
+        """Register a predicate that must return True for any job of an API key to start."""
+        self._key_checks.append(check)
+
+    def add_start_listener(self, listener: Callable[[ScrapeJob], None]) -> None:
+        """Called synchronously when a job is granted a slot (before any other job is picked)."""
+        self._start_listeners.append(listener)
+
+    def add_release_listener(self, listener: Callable[[ScrapeJob], None]) -> None:
+        """Called when a running job returns its slot (before the next jobs are dispatched)."""
+        self._release_listeners.append(listener)
+
+    def active_for_key(self, api_key: str) -> int:
+        return self._active_by_key.get(api_key, 0)
+
+    def queued_for_key(self, api_key: str) -> int:
+        return self._queued_by_key.get(api_key, 0)
+
+    @property
+    def active_count(self) -> int:
+        return len(self._active)
+
+    @property
+    def queued_count(self) -> int:
+        return len(self._queued)
+
+    def active_jobs(self) -> List[ScrapeJob]:
+        return list(self._active.values())
+
+    def has_job(self, job_id: str) -> bool:
+        return job_id in self._active or job_id in self._queued
+
+    async def acquire(self, job: ScrapeJob) -> None:
+        """Queue the job and wait until it is granted a slot. On cancellation the job is removed (or its slot released)."""
+        job.priority = self.resolve_class(job.priority)
+        job.future = asyncio.get_running_loop().create_future()
+        self._enqueue(job)
+        self._dispatch()
+        try:
+            await job.future
+        except asyncio.CancelledError:
+            if job.job_id in self._active:
+                self.release(job)
+            else:
+                self._remove(job)
+            raise
+
+    def release(self, job: ScrapeJob) -> None:
+        """Return the job's slot and start the next eligible jobs."""
+        if self._active.pop(job.job_id, None) is None:
+            return
+        self._active_by_class[job.priority] = max(0, self._active_by_class[job.priority] - 1)
+        self._dec(self._active_by_key, job.api_key)
+        self.total_finished += 1
+        if job.started_at:
+            duration = time.time() - job.started_at
+            avg = self._avg_duration[job.priority]
+            self._avg_duration[job.priority] = avg + self.duration_alpha * (duration - avg)
+        self._notify_listeners(self._release_listeners, job)
+        self._dispatch()
+
+    def notify(self) -> None:
+        """Re-run dispatch (e.g. when an admission check may now pass)."""
+        self._dispatch()
+
+    def average_duration(self, priority: str) -> float:
+        return self._avg_duration.get(priority, self._avg_duration[self.default_class])
+
+    def arrival_rate(self, priority: str) -> float:
+        """Moving average of arrivals per second for a class (decays while no requests arrive)."""
+        last = self._last_arrival.get(priority)
+        if last is None:
+            return 0.0
+        return self._arrival_rate.get(priority, 0.0) * math.exp(-(time.time() - last) / self.arrival_window_sec)
+
+    def higher_priority_load(self, priority: str) -> float:
+        """Slot utilization expected from arrivals of classes above priority (they overtake queued jobs)."""
+        load = 0.0
+        for cls in self.class_order:
+            if cls == priority:
+                break
+            load += self.arrival_rate(cls) * self.average_duration(cls)
+        return load / self.max_concurrent
+
+    def estimate_admission(self, priority: Optional[str], api_key: str, deadline_sec: Optional[float] = None) -> Dict[str, Any]:
+        """
+        Expected wait of a job that would be enqueued now, and whether it can finish within deadline_sec.
+
+        The wait is the simulated dispatch position of the job given running and queued work, stretched
+        by 1 / (1 - load) for higher-priority arrivals that will overtake it meanwhile. retry_after_sec
+        is how long the backlog needs to drain (net of expected arrivals) until the deadline fits.
+        """
+        cls = self.resolve_class(priority)
+        probe = ScrapeJob("__estimate__", api_key, cls)
+        probe.seq = self._seq + 1
+        free_at = self._slot_free_times()
+        base_wait = 0.0
+        for job in self._simulated_order(extra=probe):
+            start_in = heapq.heappop(free_at)
+            if job is probe:
+                base_wait = start_in
+                break
+            heapq.heappush(free_at, start_in + self.average_duration(job.priority))
+        higher = min(0.95, self.higher_priority_load(cls))
+        wait = base_wait / (1.0 - higher)
+        duration = self.average_duration(cls)
+        result: Dict[str, Any] = {
+            "priority": cls,
+            "estimated_wait_sec": round(wait, 1),
+            "expected_duration_sec": round(duration, 1),
+            "feasible": True,
+            "retry_after_sec": 0.0,
+        }
+        if deadline_sec is not None and wait + duration > deadline_sec:
+            result["feasible"] = False
+            # Work ahead of a job arriving later drains at (1 - load of this and higher classes) seconds per second
+            target_base = max(0.0, deadline_sec - duration) * (1.0 - higher)
+            drain = 1.0 - min(0.95, higher + self.arrival_rate(cls) * duration / self.max_concurrent)
+            result["retry_after_sec"] = round(max(0.0, base_wait - target_base) / drain, 1)
+        return result
+
+    def job_status(self, job_id: str, api_key: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """Status of one job: state, position in dispatch order and estimated wait (None if not api_key's job)."""
+        now = time.time()
+        job = self._active.get(job_id)
+        if job is not None and api_key is not None and job.api_key != api_key:
+            return None
+        if job is not None:
+            return {
+                "job_id": job.job_id,
+                "state": "running",
+                "priority": job.priority,
+                "domain": job.domain,
+                "queued_for": round((job.started_at or now) - job.enqueued_at, 3),
+                "running_for": round(now - (job.started_at or now), 3),
+            }
+        job = self._queued.get(job_id)
+        if job is None or (api_key is not None and job.api_key != api_key):
+            return None
+        for entry in self.queue_estimates():
+            if entry["job_id"] == job_id:
+                return entry
+        return None
+
+    def queue_estimates(self, api_key: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        Queued jobs in expected dispatch order with position and estimated wait.
+        Estimates assume each running job takes its class's average duration and admission checks pass.
+        """
+        now = time.time()
+        free_at = self._slot_free_times()
+        estimates = []
+        for position, job in enumerate(self._simulated_order(), 1):
+            start_in = heapq.heappop(free_at)
+            heapq.heappush(free_at, start_in + self.average_duration(job.priority))
+            if api_key is not None and job.api_key != api_key:
+                continue
+            estimates.append({
+                "job_id": job.job_id,
+                "state": "queued",
+                "priority": job.priority,
+                "domain": job.domain,
+                "position": position,
+                "queued_for": round(now - job.enqueued_at, 3),
+                "estimated_wait_sec": round(start_in, 1),
+                "expected_start": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(now + start_in)),
+            })
+        return estimates
+
+    def snapshot(self, api_key: Optional[str] = None) -> Dict[str, Any]:
+        """Aggregate scheduler state for status endpoints and logs (per-key counts: api_key's only, if given)."""
+        classes = {}
+        for name in self.class_order:
+            classes[name] = {
+                "reserved": self.reserved[name],
+                "active": self._active_by_class[name],
+                "queued": sum(len(q) for q in self._queues[name].values()),
+                "avg_duration_sec": round(self._avg_duration[name], 2),
+                "arrivals_per_min": round(self.arrival_rate(name) * 60, 2),
+            }
+        keys: Dict[str, Dict[str, int]] = {}
+        tenants = set(self._active_by_key) | set(self._queued_by_key) if api_key is None else {api_key}
+        for key in tenants:
+            keys[key[:20]] = {"active": self.active_for_key(key), "queued": self.queued_for_key(key)}
+        oldest = min((j.started_at for j in self._active.values() if j.started_at), default=None)
+        return {
+            "max_concurrent": self.max_concurrent,
+            "active": len(self._active),
+            "queued": len(self._queued),
+            "started": self.total_started,
+            "finished": self.total_finished,
+            "oldest_active_sec": round(time.time() - oldest, 1) if oldest else None,
+            "classes": classes,
+            "api_keys": keys,
+        }
+
+    # --- internals ---
+
+    def _weight(self, api_key: str) -> float:
+        return self.key_weights.get(api_key, 1.0)
+
+    @staticmethod
+    def _notify_listeners(listeners: List[Callable[[ScrapeJob], None]], job: ScrapeJob) -> None:
+        for listener in listeners:
+            try:
+                listener(job)
+            except Exception as e:
+                logger.warning(f"⚠️ Scheduler listener error for job {job.job_id}: {e}")
+
+    @staticmethod
+    def _dec(counter: Dict[str, int], key: str) -> None:
+        value = counter.get(key, 0) - 1
+        if value > 0:
+            counter[key] = value
+        else:
+            counter.pop(key, None)
+
+    def _enqueue(self, job: ScrapeJob) -> None:
+        self._seq += 1
+        job.seq = self._seq
+        self._arrival_rate[job.priority] = self.arrival_rate(job.priority) + 1.0 / self.arrival_window_sec
+        self._last_arrival[job.priority] = time.time()
+        queues = self._queues[job.priority]
+        q = queues.get(job.api_key)
+        if not q:
+            # Key becomes backlogged: no credit for idle time
+            passes = self._pass[job.priority]
+            passes[job.api_key] = max(passes.get(job.api_key, 0.0), self._vtime[job.priority])
+            q = queues.setdefault(job.api_key, deque())
+        q.append(job)
+        self._queued[job.job_id] = job
+        self._queued_by_key[job.api_key] = self._queued_by_key.get(job.api_key, 0) + 1
+
+    def _remove(self, job: ScrapeJob) -> None:
+        if self._queued.pop(job.job_id, None) is None:
+            return
+        self._dec(self._queued_by_key, job.api_key)
+        q = self._queues[job.priority].get(job.api_key)
+        if q is not None:
+            try:
+                q.remove(job)
+            except ValueError:
+                pass
+            if not q:
+                self._queues[job.priority].pop(job.api_key, None)
+        # A removed job may have blocked nothing, but dispatch is cheap
+        self._dispatch()
+
+    def _is_admissible(self, job: ScrapeJob) -> bool:
+        for check in self._admission_checks:
+            try:
+                if not check(job):
+                    return False
+            except Exception as e:
+                logger.warning(f"⚠️ Admission check error for job {job.job_id}: {e}")
+        return True
+
+    def _is_key_admissible(self, api_key: str) -> bool:
+        for check in self._key_checks:
+            try:
+                if not check(api_key):
+                    return False
+            except Exception as e:
+                logger.warning(f"⚠️ Key check error for {api_key[:20]}...: {e}")
+        return True
+
+    def _pick_in_class(self, cls: str) -> Optional[ScrapeJob]:
+        """Eligible job of the backlogged key with the lowest pass (ties: oldest job)."""
+        passes = self._pass[cls]
+        candidates = sorted(
+            self._queues[cls].items(),
+            key=lambda kv: (passes.get(kv[0], 0.0), kv[1][0].seq),
+        )
+        for key, q in candidates:
+            if not self._is_key_admissible(key):
+                continue
+            for job in q:
+                if self._is_admissible(job):
+                    return job
+        return None
+
+    def _pick(self) -> Optional[ScrapeJob]:
+        free = self.max_concurrent - len(self._active)
+        if free <= 0:
+            return None
+        # Classes below their reserved minimum first
+        for cls in self.class_order:
+            if self._queues[cls] and self._active_by_class[cls] < self.reserved[cls]:
+                job = self._pick_in_class(cls)
+                if job is not None:
+                    return job
+        # Then strict priority, never taking slots still reserved for other classes
+        for cls in self.class_order:
+            if not self._queues[cls]:
+                continue
+            unmet_others = sum(
+                max(0, self.reserved[c] - self._active_by_class[c]) for c in self.class_order if c != cls
+            )
+            if free - unmet_others <= 0:
+                continue
+            job = self._pick_in_class(cls)
+            if job is not None:
+                return job
+        return None
+
+    def _start(self, job: ScrapeJob) -> None:
+        cls = job.priority
+        q = self._queues[cls].get(job.api_key)
+        if q is not None:
+            q.remove(job)
+            if not q:
+                self._queues[cls].pop(job.api_key, None)
+        self._queued.pop(job.job_id, None)
+        self._dec(self._queued_by_key, job.api_key)
+        passes = self._pass[cls]
+        current = passes.get(job.api_key, self._vtime[cls])
+        self._vtime[cls] = max(self._vtime[cls], current)
+        passes[job.api_key] = current + 1.0 / self._weight(job.api_key)
+        self._active[job.job_id] = job
+        self._active_by_class[cls] += 1
+        self._active_by_key[job.api_key] = self._active_by_key.get(job.api_key, 0) + 1
+        self.total_started += 1
+        job.started_at = time.time()
+        self._notify_listeners(self._start_listeners, job)
+        if job.future is not None and not job.future.done():
+            job.future.set_result(True)
+
+    def _dispatch(self) -> None:
+        while len(self._active) < self.max_concurrent:
+            job = self._pick()
+            if job is None:
+                break
+            self._start(job)
+
+    def _slot_free_times(self) -> List[float]:
+        """Heap of seconds until each usable slot is free (running jobs assumed to take their class average)."""
+        now = time.time()
+        free_at = []
+        for job in self._active.values():
+            remaining = self.average_duration(job.priority) - (now - (job.started_at or now))
+            free_at.append(max(0.0, remaining))
+        # Idle slots, minus those held back for classes that are below their reservation and have nothing queued
+        held_back = sum(
+            max(0, self.reserved[c] - self._active_by_class[c]) for c in self.class_order if not self._queues[c]
+        )
+        free_at.extend([0.0] * max(0, self.max_concurrent - len(free_at) - held_back))
+        if not free_at:
+            free_at.append(0.0)
+        heapq.heapify(free_at)
+        return free_at
+
+    def _simulated_order(self, extra: Optional[ScrapeJob] = None) -> List[ScrapeJob]:
+        """
+        Expected dispatch order of queued jobs (strict priority + stride scheduling, ignoring admission checks).
+        extra: a hypothetical job placed as if it were enqueued now.
+        """
+        order: List[ScrapeJob] = []
+        for cls in self.class_order:
+            passes = dict(self._pass[cls])
+            heap = []
+            queues = {key: list(q) for key, q in self._queues[cls].items()}
+            if extra is not None and extra.priority == cls:
+                if extra.api_key not in queues:
+                    passes[extra.api_key] = max(passes.get(extra.api_key, 0.0), self._vtime[cls])
+                queues.setdefault(extra.api_key, []).append(extra)
+            for key, jobs in queues.items():
+                heapq.heappush(heap, (passes.get(key, 0.0), jobs[0].seq, key, 0))
+            while heap:
+                p, _, key, idx = heapq.heappop(heap)
+                jobs = queues[key]
+                order.append(jobs[idx])
+                if idx + 1 < len(jobs):
+                    heapq.heappush(heap, (p + 1.0 / self._weight(key), jobs[idx + 1].seq, key, idx + 1))
+        return order
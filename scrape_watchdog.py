@@ -0,0 +1,236 @@
+"""
+Scrape Watchdog Module
+Kills the browser process trees of stuck scrape jobs and reaps orphaned Chromium processes
+
+Author: Volkan AYDIN
+Year: 2025
+License: CC BY-NC-SA 4.0 (Non-Commercial)
+"""
+
+import asyncio
+import contextvars
+import os
+import signal
+import time
+import logging
+from typing import Optional, Dict, Any, List, Callable, Set, Tuple
+
+from resource_monitor import read_process_table, descendant_pids
+
+logger = logging.getLogger(__name__)
+
+# Job id of the scrape running in the current asyncio task (set by track(), read by attach())
+current_job_id: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("current_job_id", default=None)
+
+def _read_argv(pid: int) -> List[str]:
+    try:
+        with open(f"/proc/{pid}/cmdline", "rb") as f:
+            return f.read().decode("utf-8", "replace").split("\0")
+    except OSError:
+        return []
+
+
+def _is_playwright_driver(argv: List[str]) -> bool:
+    """The playwright driver: node ... cli.js run-driver."""
+    return "run-driver" in argv[1:]
+
+
+def _start_time(pid: int) -> Optional[int]:
+    """Process start time (clock ticks since boot), to tell a recorded process from a reused PID."""
+    try:
+        with open(f"/proc/{pid}/stat", "r") as f:
+            data = f.read()
+        return int(data[data.rindex(")") + 2:].split()[19])
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def kill_pids(pids: List[int]) -> int:
+    """SIGKILL the given processes; returns how many were signalled."""
+    sigkill = getattr(signal, "SIGKILL", signal.SIGTERM)
+    killed = 0
+    for pid in pids:
+        try:
+            os.kill(pid, sigkill)
+            killed += 1
+        except (ProcessLookupError, PermissionError):
+            continue
+        except OSError as e:
+            logger.debug(f"Could not kill {pid}: {e}")
+    return killed
+
+
+def process_alive(pid: int) -> bool:
+    """True if pid exists and is not a zombie."""
+    try:
+        with open(f"/proc/{pid}/stat", "r") as f:
+            data = f.read()
+        return data[data.rindex(")") + 2:].split()[0] != "Z"
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        os.kill(pid, 0)
+        return True
+    except (ProcessLookupError, PermissionError, OSError):
+        return False
+
+
+def kill_process_tree(root_pid: int, table=None) -> int:
+    """SIGKILL root_pid and all its descendants; returns how many were signalled."""
+    if table is None:
+        table = read_process_table()
+    # Collect the tree before killing (once the root dies its children are re-parented),
+    # then kill the root first so it cannot react to its children dying
+    return kill_pids([root_pid] + (descendant_pids(root_pid, table) if table else []))
+
+
+class WatchedJob:
+    """A running scrape job, its hard deadline and the scrapers (browsers) it created."""
+
+    __slots__ = ("job_id", "deadline_at", "on_expire", "scrapers", "killed")
+
+    def __init__(self, job_id: str, deadline_at: float, on_expire: Optional[Callable[[], None]]):
+        self.job_id = job_id
+        self.deadline_at = deadline_at
+        self.on_expire = on_expire
+        self.scrapers: List[Any] = []
+        self.killed = False
+
+
+class ScrapeWatchdog:
+    """
+    Hard deadline enforcement for scrape jobs.
+
+    asyncio timeouts cannot free a hung playwright call or a wedged renderer (and bare `except:`
+    clauses in cleanup code can swallow the cancellation), so past its deadline the watchdog
+    SIGKILLs the job's playwright driver and its whole Chromium process tree - pending playwright
+    calls then fail fast - and calls on_expire (which returns the job's scheduler slot).
+
+    It also reaps orphaned browser processes of this worker: every sweep records the playwright
+    drivers this process started (its own children) and their process trees. When a recorded
+    driver is gone, the processes recorded under it that are still alive (same PID and start
+    time) are orphans, e.g. Chromium left behind by a crashed cleanup. Processes of other apps,
+    services or workers are never touched. A process must look orphaned on two consecutive sweeps
+    before it is killed.
+    """
+
+    def __init__(self, grace_sec: float = 30.0, interval_sec: float = 10.0, reap_orphans: bool = True):
+        self.grace_sec = max(0.0, float(grace_sec))
+        self.interval_sec = max(1.0, float(interval_sec))
+        self.reap_orphans = reap_orphans
+        self._jobs: Dict[str, WatchedJob] = {}
+        self._orphan_candidates: Set[int] = set()
+        # Recorded drivers {pid: start time} and the processes seen under them {pid: (start time, driver pid)}
+        self._drivers: Dict[int, Optional[int]] = {}
+        self._descendants: Dict[int, Tuple[Optional[int], int]] = {}
+        self.jobs_killed = 0
+        self.processes_killed = 0
+        self.orphans_reaped = 0
+        self.last_sweep_at: Optional[float] = None
+
+    def track(self, job_id: str, timeout_sec: float, on_expire: Optional[Callable[[], None]] = None) -> contextvars.Token:
+        """Watch a job that must finish within timeout_sec (+ grace). Sets the job as current for attach()."""
+        self._jobs[job_id] = WatchedJob(job_id, time.time() + timeout_sec + self.grace_sec, on_expire)
+        return current_job_id.set(job_id)
+
+    def untrack(self, job_id: str, token: Optional[contextvars.Token] = None) -> None:
+        self._jobs.pop(job_id, None)
+        if token is not None:
+            try:
+                current_job_id.reset(token)
+            except ValueError:
+                pass
+
+    def attach(self, scraper: Any) -> None:
+        """Register a scraper with the job running in the current task (no-op outside a watched job)."""
+        watched = self._jobs.get(current_job_id.get())
+        if watched is not None:
+            watched.scrapers.append(scraper)
+
+    def _expire(self, watched: WatchedJob, table) -> None:
+        watched.killed = True
+        killed = 0
+        for scraper in watched.scrapers:
+            driver_pid = getattr(scraper, "driver_pid", None)
+            if driver_pid:
+                killed += kill_process_tree(driver_pid, table)
+        self.jobs_killed += 1
+        self.processes_killed += killed
+        overdue = time.time() - watched.deadline_at + self.grace_sec
+        logger.critical(
+            f"🔪 Watchdog: job {watched.job_id} stuck {overdue:.0f}s past its timeout, "
+            f"killed {killed} browser processes and reclaimed its slot"
+        )
+        if watched.on_expire is not None:
+            try:
+                watched.on_expire()
+            except Exception as e:
+                logger.warning(f"⚠️ Watchdog expire callback failed for job {watched.job_id}: {e}")
+
+    def _find_orphans(self, table) -> List[int]:
+        """Processes recorded under a driver of this worker that outlived it."""
+        my_pid = os.getpid()
+        # Record new drivers (children of this process) and refresh the trees of live ones
+        for pid, (ppid, _) in table.items():
+            if ppid == my_pid and pid not in self._drivers and _is_playwright_driver(_read_argv(pid)):
+                self._drivers[pid] = _start_time(pid)
+        live_drivers = set()
+        for driver, started in list(self._drivers.items()):
+            if driver in table and _start_time(driver) == started:
+                live_drivers.add(driver)
+                for pid in descendant_pids(driver, table):
+                    if pid not in self._descendants:
+                        self._descendants[pid] = (_start_time(pid), driver)
+            else:
+                del self._drivers[driver]
+
+        orphans = []
+        for pid, (started, driver) in list(self._descendants.items()):
+            if pid not in table or _start_time(pid) != started:
+                # Exited (or PID reused by an unrelated process)
+                del self._descendants[pid]
+            elif driver not in live_drivers:
+                orphans.append(pid)
+        return orphans
+
+    def sweep(self) -> None:
+        """One watchdog pass: kill overdue jobs, then reap orphans."""
+        now = time.time()
+        self.last_sweep_at = now
+        overdue = [w for w in self._jobs.values() if not w.killed and now > w.deadline_at]
+        if not overdue and not self.reap_orphans:
+            return
+        table = read_process_table()
+        for watched in overdue:
+            self._expire(watched, table)
+        if not self.reap_orphans or table is None:
+            return
+        orphans = set(self._find_orphans(table))
+        confirmed = sorted(orphans & self._orphan_candidates)
+        self._orphan_candidates = orphans - set(confirmed)
+        if confirmed:
+            killed = kill_pids(confirmed)
+            self.orphans_reaped += killed
+            self.processes_killed += killed
+            logger.warning(f"🧹 Watchdog: reaped {killed} orphaned browser processes")
+
+    async def run(self) -> None:
+        """Background loop; cancel the task to stop."""
+        while True:
+            await asyncio.sleep(self.interval_sec)
+            try:
+                self.sweep()
+            except Exception as e:
+                logger.warning(f"⚠️ Watchdog sweep failed: {e}")
+
+    def snapshot(self) -> Dict[str, Any]:
+        now = time.time()
+        return {
+            "watched_jobs": len(self._jobs),
+            "overdue_jobs": sum(1 for w in self._jobs.values() if now > w.deadline_at),
+            "jobs_killed": self.jobs_killed,
+            "processes_killed": self.processes_killed,
+            "orphans_reaped": self.orphans_reaped,
+            "grace_sec": self.grace_sec,
+            "last_sweep_sec_ago": round(now - self.last_sweep_at, 1) if self.last_sweep_at else None,
+        }
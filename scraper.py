@@ -9,20 +9,58 @@ License: CC BY-NC-SA 4.0 (Non-Commercial)
 
 import asyncio
 import time
-import json
+import weakref
 import random
 import os
 import socks
 import socket
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
 from typing import Optional, Dict, Any
 from playwright.async_api import async_playwright
 from config import Config
+from browser_profiles import get_profile_manager
+from asset_cache import get_asset_cache
+from proxy_registry import get_proxy_registry
 import logging
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+
+# Main-document statuses that count as a failed navigation for proxy stats (with all 5xx)
+_BLOCKED_STATUSES = (403, 407, 429)
+# Site storage reset of one origin on a persistent profile: drop the profile's localStorage and
+# IndexedDB, then write the domain session's localStorage items
+_RESET_STORAGE_JS = """
+async (items) => {
+    localStorage.clear();
+    const databases = indexedDB.databases ? await indexedDB.databases() : [];
+    await Promise.all(databases.filter(db => db.name).map(db => new Promise(resolve => {
+        const request = indexedDB.deleteDatabase(db.name);
+        request.onsuccess = request.onerror = request.onblocked = () => resolve();
+    })));
+    for (const item of items) localStorage.setItem(item.name, item.value);
+}
+"""
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Parse a Retry-After header (delta-seconds or HTTP-date) into seconds from now."""
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError, IndexError, OverflowError):
+        return None
+
+
 class WebScraper:
     """Web scraper with proxy support and JavaScript execution"""
     
@@ -33,88 +71,45 @@ class WebScraper:
         self.page = None
         self.proxy_list = []
         self.current_proxy_index = 0
-        self.proxy_failures = {}
+        # HTTP status and Retry-After (seconds) of the last main-document navigation
+        self.last_response_status: Optional[int] = None
+        self.last_retry_after: Optional[float] = None
+        # PID of the playwright driver process (parent of the Chromium process tree), for the watchdog
+        self.driver_pid: Optional[int] = None
+        # Leased persistent profile dir (PERSISTENT_PROFILES), None for an ephemeral context
+        self.profile_dir: Optional[str] = None
+        # Persistent profile context closed (it has no Browser object to ask)
+        self._context_closed = False
+        # Registry proxy in use (None: no proxy or an explicit proxy list), for latency/success/challenge stats
+        self.proxy_entry = None
+        # Entry whose active context count includes this scraper's context
+        self._proxy_context = None
+        self.last_navigation_sec: Optional[float] = None
+        self._challenge_recorded = True
+        # Main frame of the current navigation committed (response received, document replaced), for hedging
+        self.navigation_committed = False
+        self._commit_listener_page = None
+        # Byte counter of the current scrape (set by the API per request), pages with a CDP traffic listener
+        self.traffic = None
+        self._watched_pages = weakref.WeakSet()
         self.load_proxy_list()
     
     def load_proxy_list(self):
-        """Load proxy list from environment"""
-        try:
-            if not self.config.PROXY_ENABLED:
-                logger.info("Proxy is disabled")
-                self.proxy_list = []
-                return
-                
-            if self.config.PROXY_LIST and len(self.config.PROXY_LIST) > 0:
-                self.proxy_list = []
-                for proxy_item in self.config.PROXY_LIST:
-                    if proxy_item.strip():  # Skip empty strings
-                        # Parse proxy item - can be URL or URL:username:password format
-                        # Check if it contains credentials (more than 2 colons)
-                        if proxy_item.count(':') > 2:
-                            # Format: http://proxy.com:8080:username:password
-                            last_colon = proxy_item.rfind(':')
-                            second_last_colon = proxy_item.rfind(':', 0, last_colon)
-                            
-                            proxy_url = proxy_item[:second_last_colon]
-                            credentials_part = proxy_item[second_last_colon + 1:]
-                            credentials = credentials_part.split(':')
-                            
-                            username = credentials[0] if len(credentials) > 0 else ""
-                            password = credentials[1] if len(credentials) > 1 else ""
-                        else:
-                            # Format: http://proxy.com:8080 (no credentials)
-                            proxy_url = proxy_item.strip()
-                            username = ""
-                            password = ""
-                        
-                        # Determine proxy type from URL
-                        proxy_type = "HTTP"
-                        if proxy_url.startswith("socks4://"):
-                            proxy_type = "SOCKS4"
-                            proxy_url = proxy_url.replace("socks4://", "http://")
-                        elif proxy_url.startswith("socks5://"):
-                            proxy_type = "SOCKS5"
-                            proxy_url = proxy_url.replace("socks5://", "http://")
-                        elif proxy_url.startswith("http://") or proxy_url.startswith("https://"):
-                            proxy_type = "HTTP"
-                        
-                        proxy_info = {
-                            "url": proxy_url,
-                            "username": username,
-                            "password": password,
-                            "country": "Unknown",
-                            "type": proxy_type,
-                            "status": "working",
-                            "speed": "unknown",
-                            "last_tested": "2025-01-09"
-                        }
-                        self.proxy_list.append(proxy_info)
-                logger.info(f"Loaded {len(self.proxy_list)} proxies from environment")
-            else:
-                logger.info("No proxy list found in environment")
-                self.proxy_list = []
-                
-        except Exception as e:
-            logger.error(f"Error loading proxy list: {e}")
-            self.proxy_list = []
+        """Use the process-wide proxy registry (parsed once, failure/ban state shared by all requests)"""
+        self.proxies = get_proxy_registry()
+        self.proxy_list = self.proxies.entries
     
+    def get_proxy_failures(self, proxy_url) -> Optional[Dict[str, Any]]:
+        """Failure record {"count", "last_fail"} of a proxy (None if healthy)."""
+        entry = self.proxies.get(proxy_url)
+        if entry is None or not entry.failures:
+            return None
+        return {"count": entry.failures, "last_fail": entry.last_fail}
+
     def _is_proxy_available(self, proxy_url):
         """Check if proxy is available (under failure count and not in time-based ban)."""
-        ban_time_sec = getattr(self.config, "PROXY_BAN_TIME_SEC", 0) or 0
-        now = time.time()
-        entry = self.proxy_failures.get(proxy_url)
-        if entry is None:
-            return True
-        if isinstance(entry, dict):
-            count = entry.get("count", 0)
-            last_fail = entry.get("last_fail", 0)
-            if count >= self.config.PROXY_MAX_FAILURES:
-                return False
-            if ban_time_sec > 0 and (now - last_fail) < ban_time_sec:
-                return False
-            return True
-        # Legacy: int count only
-        return int(entry) < self.config.PROXY_MAX_FAILURES
+        entry = self.proxies.get(proxy_url)
+        return entry is None or self.proxies.is_available(entry.index)
 
     def get_next_proxy(self):
         """Get next working proxy from the list (respects failure count and optional time-based ban)."""
@@ -124,23 +119,23 @@ class WebScraper:
         if not self.proxy_list:
             return None  # No proxy available
         
-        # Use the current proxy index (set by API)
-        if self.current_proxy_index < len(self.proxy_list):
-            proxy = self.proxy_list[self.current_proxy_index]
-            proxy_url = proxy.get('url', '')
-            if self._is_proxy_available(proxy_url):
-                logger.info(f"🔄 Using proxy {self.current_proxy_index + 1}/{len(self.proxy_list)}: {proxy_url}")
-                return proxy
-            logger.warning(f"⚠️ Proxy {proxy_url} unavailable (failures or ban), skipping")
-        
-        for i, proxy in enumerate(self.proxy_list):
-            proxy_url = proxy.get('url', '')
-            if self._is_proxy_available(proxy_url):
-                logger.info(f"🔄 Fallback to proxy {i + 1}/{len(self.proxy_list)}: {proxy_url}")
-                return proxy
+        if self.proxy_list is not self.proxies.entries:
+            # Explicit proxy list (e.g. /test-proxy): no health tracking
+            self.proxy_entry = None
+            return self.proxy_list[self.current_proxy_index % len(self.proxy_list)].to_dict()
         
-        logger.error("❌ No working proxies available")
-        return None
+        # Use the current proxy index (set by API), else the next available one after it
+        entry = self.proxies.next_available(self.current_proxy_index)
+        self.proxy_entry = entry
+        if entry is None:
+            logger.error("❌ No working proxies available")
+            return None
+        if entry.index == self.current_proxy_index:
+            logger.info(f"🔄 Using proxy {entry.index + 1}/{len(self.proxy_list)}: {entry.url}")
+        else:
+            logger.warning(f"⚠️ Proxy {self.current_proxy_index + 1} unavailable (failures or ban), using proxy {entry.index + 1}/{len(self.proxy_list)}: {entry.url}")
+            self.current_proxy_index = entry.index
+        return entry.to_dict()
     
     def get_current_proxy_info(self):
         """Get current proxy information for response"""
@@ -150,28 +145,136 @@ class WebScraper:
         if self.current_proxy_index < len(self.proxy_list):
             proxy = self.proxy_list[self.current_proxy_index]
             return {
-                "url": proxy.get('url', ''),
-                "type": proxy.get('type', 'HTTP'),
+                "url": proxy.url,
+                "type": proxy.type,
                 "index": self.current_proxy_index + 1,
                 "total": len(self.proxy_list)
             }
         return None
     
     def mark_proxy_failed(self, proxy_url):
-        """Mark a proxy as failed (count + optional time-based ban)."""
-        now = time.time()
-        entry = self.proxy_failures.get(proxy_url)
-        if isinstance(entry, dict):
-            self.proxy_failures[proxy_url] = {"count": entry.get("count", 0) + 1, "last_fail": now}
-        else:
-            count = (entry or 0) + 1
-            self.proxy_failures[proxy_url] = {"count": count, "last_fail": now}
-        logger.warning(f"Proxy {proxy_url} marked as failed (failures: {self.proxy_failures[proxy_url]['count']})")
+        """Mark a proxy as failed (count + optional time-based ban), visible to all workers."""
+        entry = self.proxies.mark_failed(proxy_url)
+        if entry is not None:
+            logger.warning(f"Proxy {proxy_url} marked as failed (failures: {entry.failures})")
     
-    async def setup_browser(self, storage_state: Optional[Dict[str, Any]] = None):
-        """Setup browser with proxy configuration and optional storage state"""
+    def _record_navigation(self, url: str, started: float, ok: bool) -> None:
+        """Feed a navigation's latency and outcome to the proxy stats (selection weights)."""
+        self.last_navigation_sec = time.monotonic() - started
+        # The next challenge check belongs to this navigation
+        self._challenge_recorded = False
+        if self.proxy_entry is not None:
+            self.proxies.record_navigation(self.proxy_entry.index, urlparse(url).hostname, self.last_navigation_sec, ok)
+
+    def _on_frame_navigated(self, frame) -> None:
+        if frame.parent_frame is None:
+            self.navigation_committed = True
+
+    def record_challenge(self, challenged: bool) -> None:
+        """Feed the first challenge check after a navigation to the proxy stats."""
+        if self._challenge_recorded:
+            return
+        self._challenge_recorded = True
+        if self.proxy_entry is not None and self.page is not None:
+            try:
+                domain = urlparse(self.page.url).hostname
+            except Exception:
+                domain = None
+            self.proxies.record_challenge(self.proxy_entry.index, domain, challenged)
+
+    async def watch_traffic(self, page) -> None:
+        """Count a page's network bytes (CDP Network events) for the current scrape and proxy."""
+        if not getattr(self.config, "BANDWIDTH_ACCOUNTING", False) or page is None or page in self._watched_pages:
+            return
+        self._watched_pages.add(page)
+        try:
+            session = await self.context.new_cdp_session(page)
+            session.on("Network.requestWillBeSent", self._on_request_sent)
+            session.on("Network.responseReceived", self._on_response_received)
+            session.on("Network.loadingFinished", self._on_loading_finished)
+            session.on("Network.loadingFailed", self._on_loading_failed)
+            await session.send("Network.enable")
+        except Exception as e:
+            logger.debug(f"Traffic accounting unavailable for page: {e}")
+
+    def _add_traffic(self, sent: int = 0, received: int = 0, requests: int = 0) -> None:
+        if self.traffic is not None:
+            self.traffic.requests += requests
+            self.traffic.bytes_sent += sent
+            self.traffic.bytes_received += received
+        if self.proxy_entry is not None:
+            self.proxies.record_bytes(self.proxy_entry, sent, received)
+
+    def _on_request_sent(self, params: Dict[str, Any]) -> None:
+        request = params.get("request") or {}
+        url = request.get("url", "")
+        if url.startswith(("data:", "blob:")):
+            return
+        # Estimate: request line + headers + body (the wire format may compress headers)
+        sent = len(request.get("method", "GET")) + len(url) + 12
+        sent += sum(len(k) + len(str(v)) + 4 for k, v in (request.get("headers") or {}).items())
+        sent += len(request.get("postData") or "")
+        self._add_traffic(sent=sent, requests=1)
+
+    def _on_response_received(self, params: Dict[str, Any]) -> None:
+        response = params.get("response") or {}
+        if self.traffic is not None and (response.get("fromDiskCache") or response.get("fromServiceWorker") or response.get("fromPrefetchCache")):
+            self.traffic.cached += 1
+
+    def _on_loading_finished(self, params: Dict[str, Any]) -> None:
+        # Bytes on the wire (compressed body + headers); 0 for cache hits
+        self._add_traffic(received=int(params.get("encodedDataLength") or 0))
+
+    def _on_loading_failed(self, params: Dict[str, Any]) -> None:
+        if self.traffic is not None:
+            self.traffic.failed += 1
+
+    def _get_driver_pid(self) -> Optional[int]:
+        """PID of the playwright driver subprocess (private API, None if unavailable)."""
+        try:
+            return self.playwright._impl_obj._connection._transport._proc.pid
+        except AttributeError:
+            return None
+
+    def is_alive(self) -> bool:
+        """True while the browser (or the persistent profile context) is usable."""
+        if self.browser is not None:
+            return self.browser.is_connected()
+        return self.context is not None and not self._context_closed
+
+    async def _isolate_profile_state(self, domain: str, storage_state: Optional[Dict[str, Any]]) -> None:
+        """
+        Replace a persistent profile's cookies, localStorage and IndexedDB with the domain session's
+        (the profile of a site and proxy is shared by every API key).
+        """
+        await self.context.clear_cookies()
+        if storage_state and storage_state.get("cookies"):
+            await self.context.add_cookies(storage_state["cookies"])
+        session_items = {
+            o["origin"]: o.get("localStorage") or []
+            for o in (storage_state or {}).get("origins") or () if o.get("origin")
+        }
+        profile_state = await self.context.storage_state()
+        origins = {o["origin"] for o in profile_state.get("origins") or () if o.get("origin")}
+        # IndexedDB-only origins are not listed: always reset the site's own origin
+        origins |= set(session_items) | {f"https://{domain}"}
+        page = self.context.pages[0] if self.context.pages else await self.context.new_page()
+        # Storage is per origin: load a blank stand-in document of each one (as Playwright restores storage_state)
+        await page.route("**/*", lambda route: route.fulfill(
+            status=200, content_type="text/html", body="<html></html>", headers={"Cache-Control": "no-store"},
+        ))
+        try:
+            for origin in sorted(origins):
+                await page.goto(origin)
+                await page.evaluate(_RESET_STORAGE_JS, session_items.get(origin, []))
+        finally:
+            await page.unroute("**/*")
+
+    async def setup_browser(self, storage_state: Optional[Dict[str, Any]] = None, domain: Optional[str] = None):
+        """Setup browser with proxy configuration and optional storage state (persistent profile per domain if enabled)"""
         try:
             self.playwright = await async_playwright().start()
+            self.driver_pid = self._get_driver_pid()
             
             # Browser arguments
             browser_args = [
@@ -235,12 +338,13 @@ class WebScraper:
             else:
                 logger.info("No proxy configured, running without proxy")
             
-            # Launch browser
-            self.browser = await self.playwright.chromium.launch(
-                headless=self.config.HEADLESS,
-                args=browser_args
-            )
-            
+            # Persistent profile (disk HTTP cache) of (domain group, proxy), unless another browser uses it
+            profiles = get_profile_manager()
+            if profiles is not None and domain:
+                self.profile_dir = profiles.acquire(domain, proxy_info.get('url') if proxy_info else None)
+                if self.profile_dir is None:
+                    logger.info(f"Profile for {domain} is in use, starting an ephemeral context")
+
             # Create context with proxy and optional storage state
             viewport = getattr(self, "_viewport_override", None) or {"width": 1920, "height": 1080}
             context_kwargs: Dict[str, Any] = {
@@ -248,7 +352,7 @@ class WebScraper:
                 "viewport": viewport,
                 "user_agent": self.config.USER_AGENT,
             }
-            if storage_state:
+            if storage_state and not self.profile_dir:
                 context_kwargs["storage_state"] = storage_state
 
             # Stealth: browser-like headers (inspired by cloudscraper stealth)
@@ -275,7 +379,32 @@ class WebScraper:
                     "Sec-Fetch-Dest": "document",
                 }
 
-            self.context = await self.browser.new_context(**context_kwargs)
+            if self.profile_dir:
+                # Browser and context in one: launch_persistent_context owns the profile dir
+                self.browser = None
+                self.context = await self.playwright.chromium.launch_persistent_context(
+                    self.profile_dir,
+                    headless=self.config.HEADLESS,
+                    args=browser_args + profiles.browser_args(),
+                    **context_kwargs
+                )
+                self._context_closed = False
+                self.context.on("close", lambda _: setattr(self, "_context_closed", True))
+                if not self.config.PROFILE_SHARE_COOKIES:
+                    # Isolation: the profile only contributes its cache, browser state comes from the domain session
+                    await self._isolate_profile_state(domain, storage_state)
+                logger.info(f"Using persistent profile {os.path.basename(self.profile_dir)} for {domain}")
+            else:
+                # Launch browser
+                self.browser = await self.playwright.chromium.launch(
+                    headless=self.config.HEADLESS,
+                    args=browser_args
+                )
+                self.context = await self.browser.new_context(**context_kwargs)
+
+            if self.proxy_entry is not None:
+                self._proxy_context = self.proxy_entry
+                self.proxies.context_opened(self._proxy_context)
 
             # Optional: reduce bot detection when USE_STEALTH=true
             if os.getenv("USE_STEALTH", "").lower() in ("1", "true", "yes"):
@@ -289,8 +418,20 @@ class WebScraper:
                 except Exception as e:
                     logger.warning(f"Stealth apply failed: {e}")
             
-            # Create page
-            self.page = await self.context.new_page()
+            # Shared static asset cache (not with a persistent profile: routing would disable its disk cache)
+            asset_cache = get_asset_cache()
+            if asset_cache is not None and not self.profile_dir:
+                await asset_cache.attach(self.context, proxy_info.get('url') if proxy_info else None)
+
+            # Count bytes of every page of the context (popups included)
+            self.context.on("page", lambda page: asyncio.ensure_future(self.watch_traffic(page)))
+
+            # Create page (a persistent context opens with one)
+            if self.profile_dir and self.context.pages:
+                self.page = self.context.pages[0]
+            else:
+                self.page = await self.context.new_page()
+            await self.watch_traffic(self.page)
             
             # Set timeout
             self.page.set_default_timeout(self.config.TIMEOUT)
@@ -303,17 +444,30 @@ class WebScraper:
     
     async def navigate_to_url(self, url):
         """Navigate to a specific URL with robust timeout handling"""
+        self.last_response_status = None
+        self.last_retry_after = None
+        self.navigation_committed = False
+        if self._commit_listener_page is not self.page:
+            self.page.on("framenavigated", self._on_frame_navigated)
+            self._commit_listener_page = self.page
+        started = time.monotonic()
         try:
             try:
                 # Use configured timeout if available, otherwise fallback to 30000ms
                 goto_timeout = getattr(self.config, "TIMEOUT", 30000)
-                await self.page.goto(url, wait_until="domcontentloaded", timeout=goto_timeout)
-                logger.info("Page loaded successfully")
+                response = await self.page.goto(url, wait_until="domcontentloaded", timeout=goto_timeout)
+                if response is not None:
+                    self.last_response_status = response.status
+                    self.last_retry_after = parse_retry_after(response.headers.get("retry-after"))
+                logger.info(f"Page loaded successfully (HTTP {self.last_response_status})")
+                status = self.last_response_status
+                self._record_navigation(url, started, status is None or (status < 500 and status not in _BLOCKED_STATUSES))
             except Exception as e:
                 error_msg = str(e)
                 # Hard failures: connection lost, EPIPE, browser closed -> re-raise
                 if "EPIPE" in error_msg or ("browser" in error_msg.lower() and "closed" in error_msg.lower()):
                     logger.error(f"❌ Critical navigation error for {url}: {error_msg}")
+                    self._record_navigation(url, started, False)
                     raise
 
                 # Soft timeout: check if page is still usable
@@ -327,10 +481,12 @@ class WebScraper:
                 if not current_url or "about:blank" in current_url:
                     # Real failure, propagate
                     logger.error(f"❌ Page failed to load (still about:blank): {error_msg}")
+                    self._record_navigation(url, started, False)
                     raise
                 else:
-                    # URL changed; continue with partially loaded/challenge page
+                    # URL changed; continue with partially loaded/challenge page (slow, but usable)
                     logger.info(f"⚠️ Continuing despite navigation timeout; current URL: {current_url}")
+                    self._record_navigation(url, started, True)
 
             # Wait a bit to allow JavaScript to run (configurable via NAVIGATE_POST_SLEEP_SEC)
             post_sleep = 0.1 if getattr(self, "_light_mode", False) else getattr(self.config, "NAVIGATE_POST_SLEEP_SEC", 0.5)
@@ -417,6 +573,20 @@ class WebScraper:
     
     async def close(self):
         """Close browser and cleanup with robust error handling"""
+        try:
+            await self._close_browser()
+        finally:
+            if self._proxy_context is not None:
+                self.proxies.context_closed(self._proxy_context)
+                self._proxy_context = None
+            # Give the persistent profile back, also when the close was cancelled or timed out
+            if self.profile_dir:
+                profiles = get_profile_manager()
+                if profiles is not None:
+                    profiles.release(self.profile_dir)
+                self.profile_dir = None
+
+    async def _close_browser(self):
         errors = []
         
         # Track if browser was already disconnected to skip playwright cleanup
@@ -0,0 +1,424 @@
+"""
+Session Store Module
+Persistent per-domain browser sessions, loaded lazily and written behind
+
+Author: Volkan AYDIN
+Year: 2025
+License: CC BY-NC-SA 4.0 (Non-Commercial)
+"""
+
+import asyncio
+import base64
+import hashlib
+import json
+import time
+import zlib
+import logging
+from collections import OrderedDict
+from typing import Optional, Dict, Any, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Sentinel for "delete this domain's session" in the write-behind queue
+_DELETE = object()
+# Accounted size of a cache entry besides its data (key, entry object, dict slot)
+_ENTRY_OVERHEAD = 160
+
+
+def compress_session(session: Dict[str, Any]) -> Tuple[bytes, int]:
+    """(zlib-compressed compact JSON, uncompressed size); storage_state shrinks ~4-8x."""
+    raw = json.dumps(session, separators=(",", ":")).encode("utf-8")
+    return zlib.compress(raw, 6), len(raw)
+
+
+def decompress_session(data: bytes) -> Dict[str, Any]:
+    return json.loads(zlib.decompress(data))
+
+
+def decode_session(stored: Any) -> Optional[Dict[str, Any]]:
+    if not isinstance(stored, dict):
+        return None
+    if "z" not in stored:
+        # Uncompressed record written by an older version
+        return stored
+    return decompress_session(base64.b64decode(stored["z"]))
+
+
+class CacheEntry:
+    """Compressed session of one domain (data None = the store has no session for it)."""
+
+    __slots__ = ("data", "size", "expires_at", "loaded_at", "last_used")
+
+    def __init__(self, data: Optional[bytes], expires_at: Optional[float]):
+        self.data = data
+        self.size = (len(data) if data else 0) + _ENTRY_OVERHEAD
+        self.expires_at = expires_at
+        self.loaded_at = time.monotonic()
+        self.last_used = self.loaded_at
+
+
+class SessionCache:
+    """
+    LRU cache of compressed sessions bounded by max_bytes and max_entries.
+
+    Entries also leave the cache when the session expires (expires_at, wall clock) or after
+    idle_ttl_sec without use; sweep() removes those, the LRU bound handles the rest. Evicted
+    entries are only dropped from memory - the persistent store still has them.
+    """
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, max_entries: int = 10000, idle_ttl_sec: float = 3600.0):
+        self.max_bytes = max(1024, int(max_bytes))
+        self.max_entries = max(1, int(max_entries))
+        self.idle_ttl_sec = max(0.0, float(idle_ttl_sec))
+        self._entries: "OrderedDict[str, CacheEntry]" = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+        self.expired = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _expired(self, entry: CacheEntry, now_wall: float, now_mono: float) -> bool:
+        if entry.expires_at is not None and entry.expires_at <= now_wall:
+            return True
+        return bool(self.idle_ttl_sec) and now_mono - entry.last_used > self.idle_ttl_sec
+
+    def lookup(self, domain: str, max_age_sec: float = 0.0) -> Optional[CacheEntry]:
+        """Live entry for domain (counted as hit), None on a miss. max_age_sec > 0 treats older entries as misses."""
+        entry = self._entries.get(domain)
+        now_mono = time.monotonic()
+        if entry is not None and self._expired(entry, time.time(), now_mono):
+            self.discard(domain)
+            self.expired += 1
+            entry = None
+        if entry is None or (max_age_sec and now_mono - entry.loaded_at > max_age_sec):
+            self.misses += 1
+            return None
+        entry.last_used = now_mono
+        self._entries.move_to_end(domain)
+        self.hits += 1
+        return entry
+
+    def put(self, domain: str, data: Optional[bytes], expires_at: Optional[float]) -> None:
+        self.discard(domain)
+        entry = CacheEntry(data, expires_at)
+        self._entries[domain] = entry
+        self.bytes += entry.size
+        while self._entries and (self.bytes > self.max_bytes or len(self._entries) > self.max_entries):
+            _, oldest = self._entries.popitem(last=False)
+            self.bytes -= oldest.size
+            self.evicted += 1
+
+    def peek(self, domain: str) -> Optional[CacheEntry]:
+        """Cached entry for domain as is (no hit/miss accounting, no expiry check)."""
+        return self._entries.get(domain)
+
+    def discard(self, domain: str) -> None:
+        entry = self._entries.pop(domain, None)
+        if entry is not None:
+            self.bytes -= entry.size
+
+    def sweep(self) -> int:
+        """Remove expired and idle entries; returns how many were removed."""
+        now_wall, now_mono = time.time(), time.monotonic()
+        stale = [domain for domain, entry in self._entries.items() if self._expired(entry, now_wall, now_mono)]
+        for domain in stale:
+            self.discard(domain)
+        self.expired += len(stale)
+        return len(stale)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "sessions": sum(1 for entry in self._entries.values() if entry.data is not None),
+            "memory_bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+            "evicted": self.evicted,
+            "expired": self.expired,
+        }
+
+
+class DomainSessionStore:
+    """
+    Domain sessions ({created_at, proxy_index, storage_state}) kept in the shared state, so they
+    survive restarts and are seen by all workers.
+
+    A domain's session is loaded on its first use and then served from a bounded in-memory cache
+    of compressed sessions (SessionCache); the load runs in a thread. put() and drop() update the
+    cache at once and queue the write; run() flushes queued writes in a thread, so several updates
+    of one domain between flushes cost a single write. run() also
+    sweeps expired and idle cache entries every sweep_interval_sec. With several workers, cached
+    entries are re-read after refresh_sec so sessions stored by other workers are picked up.
+    """
+
+    def __init__(
+        self,
+        state,
+        ttl_sec: float,
+        refresh_sec: float = 0.0,
+        flush_interval_sec: float = 1.0,
+        cache_max_bytes: int = 64 * 1024 * 1024,
+        cache_max_entries: int = 10000,
+        cache_idle_ttl_sec: float = 3600.0,
+        sweep_interval_sec: float = 60.0,
+    ):
+        self.state = state
+        self.ttl_sec = float(ttl_sec)
+        self.refresh_sec = max(0.0, float(refresh_sec))
+        self.flush_interval_sec = max(0.05, float(flush_interval_sec))
+        self.sweep_interval_sec = max(1.0, float(sweep_interval_sec))
+        self.cache = SessionCache(cache_max_bytes, cache_max_entries, cache_idle_ttl_sec)
+        # domain -> (compressed session, uncompressed size, created_at) or _DELETE, waiting for the next flush
+        self._pending: Dict[str, Any] = {}
+        self._wakeup = asyncio.Event()
+        self.loads = 0
+        self.writes = 0
+        self.write_errors = 0
+        self.bytes_raw = 0
+        self.bytes_stored = 0
+
+    @staticmethod
+    def _key(domain: str) -> str:
+        return f"session:{domain}"
+
+    def _expires_at(self, session: Optional[Dict[str, Any]]) -> Optional[float]:
+        if not session or not isinstance(session.get("created_at"), (int, float)):
+            return None
+        return session["created_at"] + self.ttl_sec
+
+    async def _load(self, domain: str) -> Optional[Dict[str, Any]]:
+        self.loads += 1
+        started = time.monotonic()
+        data: Optional[bytes] = None
+        session: Optional[Dict[str, Any]] = None
+        try:
+            stored = await self.state.aget(self._key(domain))
+            if isinstance(stored, dict) and "z" in stored:
+                data = base64.b64decode(stored["z"])
+                session = decompress_session(data)
+            else:
+                session = decode_session(stored)
+                if session is not None:
+                    data, _ = compress_session(session)
+        except Exception as e:
+            logger.warning(f"⚠️ Could not load domain session for {domain}: {e}")
+            return None
+        newer = self.cache.peek(domain)
+        if newer is not None and newer.loaded_at >= started:
+            # put() or drop() while the load was in flight: theirs is the current value
+            return decompress_session(newer.data) if newer.data is not None else None
+        self.cache.put(domain, data, self._expires_at(session))
+        return session
+
+    async def get(self, domain: str) -> Optional[Dict[str, Any]]:
+        pending = self._pending.get(domain)
+        if pending is not None:
+            return None if pending is _DELETE else decompress_session(pending[0])
+        entry = self.cache.lookup(domain, self.refresh_sec)
+        if entry is None:
+            return await self._load(domain)
+        return decompress_session(entry.data) if entry.data is not None else None
+
+    def put(self, domain: str, session: Dict[str, Any]) -> None:
+        data, raw_size = compress_session(session)
+        self.cache.put(domain, data, self._expires_at(session))
+        self._pending[domain] = (data, raw_size, session.get("created_at", time.time()))
+        self._wakeup.set()
+
+    def drop(self, domain: str) -> bool:
+        """Forget a domain's session (all workers once flushed). True if this worker had one cached or queued."""
+        pending = self._pending.get(domain)
+        if pending is not None:
+            existed = pending is not _DELETE
+        else:
+            entry = self.cache.peek(domain)
+            existed = entry is not None and entry.data is not None
+        self.cache.put(domain, None, None)
+        self._pending[domain] = _DELETE
+        self._wakeup.set()
+        return existed
+
+    def _write(self, batch: Dict[str, Any]) -> None:
+        now = time.time()
+        for domain, pending in batch.items():
+            try:
+                if pending is _DELETE:
+                    self.state.delete(self._key(domain))
+                    continue
+                data, raw_size, created_at = pending
+                remaining = self.ttl_sec - (now - created_at)
+                if remaining <= 0:
+                    self.state.delete(self._key(domain))
+                    continue
+                encoded = base64.b64encode(data).decode("ascii")
+                self.state.set(self._key(domain), {"z": encoded, "n": raw_size}, ttl=remaining)
+                self.writes += 1
+                self.bytes_raw += raw_size
+                self.bytes_stored += len(encoded)
+            except Exception as e:
+                self.write_errors += 1
+                logger.warning(f"⚠️ Could not persist domain session for {domain}: {e}")
+
+    async def flush(self) -> None:
+        """Write all queued session updates."""
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, {}
+        await asyncio.to_thread(self._write, batch)
+
+    async def run(self) -> None:
+        """Background loop: write-behind (batching updates within flush_interval_sec) and cache sweeps."""
+        next_sweep = time.monotonic() + self.sweep_interval_sec
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=max(0.0, next_sweep - time.monotonic()))
+            except asyncio.TimeoutError:
+                pass
+            if self._wakeup.is_set():
+                self._wakeup.clear()
+                await asyncio.sleep(self.flush_interval_sec)
+                try:
+                    await self.flush()
+                except Exception as e:
+                    logger.warning(f"⚠️ Session flush failed: {e}")
+            if time.monotonic() >= next_sweep:
+                removed = self.cache.sweep()
+                if removed:
+                    logger.info(f"🧹 Session cache: {removed} expired/idle entries removed ({len(self.cache)} cached)")
+                next_sweep = time.monotonic() + self.sweep_interval_sec
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "cache": self.cache.stats(),
+            "pending_writes": len(self._pending),
+            "loads": self.loads,
+            "writes": self.writes,
+            "write_errors": self.write_errors,
+            "compression_ratio": round(self.bytes_raw / self.bytes_stored, 2) if self.bytes_stored else None,
+        }
+
+
+def storage_state_hash(storage_state: Optional[Dict[str, Any]]) -> str:
+    """
+    Stable hash of cookies and localStorage origins. Cookie expiry is bucketed to the hour, so
+    sliding expiries refreshed on every response do not count as a change.
+    """
+    storage_state = storage_state or {}
+    cookies = sorted(
+        (
+            c.get("domain"), c.get("path"), c.get("name"), c.get("value"),
+            int(c["expires"] // 3600) if isinstance(c.get("expires"), (int, float)) and c["expires"] > 0 else -1,
+        )
+        for c in storage_state.get("cookies") or ()
+    )
+    origins = sorted(
+        (o.get("origin"), sorted((i.get("name"), i.get("value")) for i in o.get("localStorage") or ()))
+        for o in storage_state.get("origins") or ()
+    )
+    canonical = json.dumps([cookies, origins], separators=(",", ":"))
+    return hashlib.sha1(canonical.encode("utf-8")).hexdigest()
+
+
+def storage_state_is_empty(storage_state: Optional[Dict[str, Any]]) -> bool:
+    if not storage_state:
+        return True
+    if storage_state.get("cookies"):
+        return False
+    return not any(o.get("localStorage") for o in storage_state.get("origins") or ())
+
+
+class CaptureState:
+    """Capture bookkeeping of one domain."""
+
+    __slots__ = ("last_capture", "empty_streak")
+
+    def __init__(self):
+        self.last_capture = 0.0
+        self.empty_streak = 0
+
+
+class SessionCapturePolicy:
+    """
+    Decides when a successful scrape must capture the browser state (context.storage_state(), a CDP
+    round trip that serialises every cookie and localStorage entry).
+
+    - Throttle: a domain is captured at most once per min_interval_sec (per worker), unless the
+      sticky proxy changed.
+    - Stateless domains: after stateless_after captures in a row without cookies or localStorage,
+      the domain is only re-probed every stateless_recheck_sec.
+    - Change detection: is_changed() compares the hash of cookies and origins with the stored
+      session's, so an unchanged state is not written again.
+    Per-domain bookkeeping is an LRU bounded by max_domains.
+    """
+
+    def __init__(
+        self,
+        min_interval_sec: float = 300.0,
+        stateless_after: int = 3,
+        stateless_recheck_sec: float = 3600.0,
+        max_domains: int = 10000,
+    ):
+        self.min_interval_sec = max(0.0, float(min_interval_sec))
+        self.stateless_after = max(1, int(stateless_after))
+        self.stateless_recheck_sec = max(0.0, float(stateless_recheck_sec))
+        self.max_domains = max(1, int(max_domains))
+        self._domains: "OrderedDict[str, CaptureState]" = OrderedDict()
+        self.captured = 0
+        self.written = 0
+        self.unchanged = 0
+        self.skipped_throttled = 0
+        self.skipped_stateless = 0
+
+    def _state(self, domain: str) -> CaptureState:
+        state = self._domains.get(domain)
+        if state is None:
+            state = self._domains[domain] = CaptureState()
+            while len(self._domains) > self.max_domains:
+                self._domains.popitem(last=False)
+        else:
+            self._domains.move_to_end(domain)
+        return state
+
+    def should_capture(self, domain: str, session: Optional[Dict[str, Any]], proxy_index: Optional[int]) -> bool:
+        state = self._state(domain)
+        since_capture = time.monotonic() - state.last_capture
+        if state.empty_streak >= self.stateless_after and since_capture < self.stateless_recheck_sec:
+            self.skipped_stateless += 1
+            return False
+        proxy_unchanged = session is not None and session.get("proxy_index") == proxy_index
+        if proxy_unchanged and since_capture < self.min_interval_sec:
+            self.skipped_throttled += 1
+            return False
+        return True
+
+    def record_capture(self, domain: str, storage_state: Optional[Dict[str, Any]]) -> str:
+        """Register a capture; returns the state hash."""
+        state = self._state(domain)
+        state.last_capture = time.monotonic()
+        state.empty_streak = state.empty_streak + 1 if storage_state_is_empty(storage_state) else 0
+        self.captured += 1
+        return storage_state_hash(storage_state)
+
+    def is_changed(self, session: Optional[Dict[str, Any]], state_hash: str, proxy_index: Optional[int]) -> bool:
+        if session is not None and session.get("state_hash") == state_hash and session.get("proxy_index") == proxy_index:
+            self.unchanged += 1
+            return False
+        self.written += 1
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "captured": self.captured,
+            "written": self.written,
+            "unchanged": self.unchanged,
+            "skipped_throttled": self.skipped_throttled,
+            "skipped_stateless": self.skipped_stateless,
+            "stateless_domains": sum(1 for s in self._domains.values() if s.empty_streak >= self.stateless_after),
+        }
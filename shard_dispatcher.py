@@ -0,0 +1,307 @@
+"""
+Shard Dispatcher Module
+Front dispatcher that routes requests to worker processes by target domain (consistent hashing)
+
+Author: Volkan AYDIN
+Year: 2025
+License: CC BY-NC-SA 4.0 (Non-Commercial)
+
+Each shard is a separate `uvicorn api:app` process on a local port with its own event loop,
+scheduler and browser pool. Requests for the same domain go to the same shard, so its warm
+browser contexts, caches and session cookies stay local. When the home shard of a domain is
+saturated (SHARD_SPILL_THRESHOLD requests in flight) or down, the request spills over to the
+next shard on the hash ring.
+"""
+
+import asyncio
+import bisect
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import time
+import logging
+from contextlib import asynccontextmanager
+from typing import Optional, Dict, Any, List, Tuple
+from urllib.parse import urlparse
+
+import aiohttp
+from fastapi import FastAPI, Request, HTTPException, Header
+from fastapi.responses import Response, JSONResponse
+
+logger = logging.getLogger(__name__)
+
+# Headers that belong to one connection and must not be forwarded
+_HOP_BY_HOP = {
+    "connection", "keep-alive", "proxy-authenticate", "proxy-authorization", "te", "trailers",
+    "transfer-encoding", "upgrade", "host", "content-length",
+}
+
+
+def _hash(value: str) -> int:
+    return int.from_bytes(hashlib.md5(value.encode("utf-8")).digest()[:8], "big")
+
+
+class HashRing:
+    """Consistent hash ring with virtual nodes: adding or losing a shard moves only ~1/n of the domains."""
+
+    def __init__(self, nodes: List[int], vnodes: int = 64):
+        self.nodes = list(nodes)
+        points = sorted((_hash(f"shard-{node}#{v}"), node) for node in self.nodes for v in range(vnodes))
+        self._hashes = [h for h, _ in points]
+        self._owners = [node for _, node in points]
+
+    def preference(self, key: str) -> List[int]:
+        """All nodes in ring order starting at key's position (home shard first)."""
+        if not self._hashes:
+            return []
+        start = bisect.bisect(self._hashes, _hash(key)) % len(self._hashes)
+        order: List[int] = []
+        for i in range(len(self._owners)):
+            node = self._owners[(start + i) % len(self._owners)]
+            if node not in order:
+                order.append(node)
+                if len(order) == len(self.nodes):
+                    break
+        return order
+
+
+class Shard:
+    """One worker process and its routing counters."""
+
+    __slots__ = (
+        "index", "port", "process", "in_flight", "forwarded", "spilled_in", "spilled_out",
+        "errors", "restarts", "started_at",
+    )
+
+    def __init__(self, index: int, port: int):
+        self.index = index
+        self.port = port
+        self.process: Optional[subprocess.Popen] = None
+        self.in_flight = 0
+        self.forwarded = 0
+        # Requests taken over from a saturated home shard / given away because this shard was saturated
+        self.spilled_in = 0
+        self.spilled_out = 0
+        self.errors = 0
+        self.restarts = 0
+        self.started_at = 0.0
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    def alive(self) -> bool:
+        return self.process is not None and self.process.poll() is None
+
+
+class ShardDispatcher:
+    """
+    Starts shard processes, picks a shard per request and forwards it.
+
+    pick() walks the domain's ring order and takes the first live shard with fewer than
+    spill_threshold requests in flight. If every shard is saturated the home shard gets the
+    request anyway (its own queue, quotas and 429s apply), so affinity is kept under overload.
+    Requests without a target domain go to the least loaded shard.
+    """
+
+    def __init__(self, shard_count: int, base_port: int, spill_threshold: int, app_target: str = "api:app"):
+        self.shards = [Shard(i, base_port + i) for i in range(max(1, int(shard_count)))]
+        self.ring = HashRing([shard.index for shard in self.shards])
+        self.spill_threshold = max(1, int(spill_threshold))
+        self.app_target = app_target
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._supervisor_task: Optional[asyncio.Task] = None
+
+    # --- process management ---
+
+    def _spawn(self, shard: Shard) -> None:
+        env = dict(os.environ)
+        env["SHARD_INDEX"] = str(shard.index)
+        shard.process = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", self.app_target, "--host", "127.0.0.1", "--port", str(shard.port)],
+            env=env,
+        )
+        shard.started_at = time.time()
+        logger.info(f"🧩 Shard {shard.index} started on port {shard.port} (pid {shard.process.pid})")
+
+    async def _wait_ready(self, shard: Shard, timeout_sec: float = 60.0) -> bool:
+        deadline = time.monotonic() + timeout_sec
+        while time.monotonic() < deadline and shard.alive():
+            try:
+                _, writer = await asyncio.open_connection("127.0.0.1", shard.port)
+                writer.close()
+                return True
+            except OSError:
+                await asyncio.sleep(0.25)
+        return False
+
+    async def start(self) -> None:
+        for shard in self.shards:
+            self._spawn(shard)
+        ready = await asyncio.gather(*(self._wait_ready(shard) for shard in self.shards))
+        for shard, ok in zip(self.shards, ready):
+            if not ok:
+                logger.error(f"❌ Shard {shard.index} did not start listening on port {shard.port}")
+        self._session = aiohttp.ClientSession(
+            timeout=aiohttp.ClientTimeout(total=None, sock_connect=5),
+            auto_decompress=False,
+        )
+        self._supervisor_task = asyncio.create_task(self._supervise())
+
+    async def _supervise(self, interval_sec: float = 5.0) -> None:
+        """Restart shard processes that exited (their domains spill to the next shard meanwhile)."""
+        while True:
+            await asyncio.sleep(interval_sec)
+            for shard in self.shards:
+                if shard.process is not None and not shard.alive():
+                    logger.warning(f"⚠️ Shard {shard.index} exited with code {shard.process.returncode}, restarting")
+                    shard.restarts += 1
+                    self._spawn(shard)
+
+    async def stop(self) -> None:
+        if self._supervisor_task:
+            self._supervisor_task.cancel()
+            try:
+                await self._supervisor_task
+            except asyncio.CancelledError:
+                pass
+        if self._session is not None:
+            await self._session.close()
+        for shard in self.shards:
+            if shard.alive():
+                shard.process.terminate()
+        for shard in self.shards:
+            if shard.process is None:
+                continue
+            try:
+                await asyncio.to_thread(shard.process.wait, 30)
+            except subprocess.TimeoutExpired:
+                logger.warning(f"⚠️ Shard {shard.index} did not stop, killing it")
+                shard.process.kill()
+
+    # --- routing ---
+
+    def pick(self, domain: Optional[str]) -> Tuple[Shard, Optional[Shard]]:
+        """(shard to use, home shard it spilled from or None)."""
+        live = [shard for shard in self.shards if shard.alive()] or self.shards
+        if not domain:
+            return min(live, key=lambda s: s.in_flight), None
+        order = [self.shards[i] for i in self.ring.preference(domain.lower())]
+        home = order[0]
+        for shard in order:
+            if shard.alive() and shard.in_flight < self.spill_threshold:
+                return shard, (home if shard is not home else None)
+        if home.alive():
+            return home, None
+        return min(live, key=lambda s: s.in_flight), home
+
+    @staticmethod
+    def request_domain(request: Request, body: bytes) -> Optional[str]:
+        """Target hostname of a scrape request (JSON body "url", or ?url= query parameter)."""
+        url = request.query_params.get("url")
+        if not url and body and request.url.path.rstrip("/") == "/scrape":
+            try:
+                payload = json.loads(body)
+                url = payload.get("url") if isinstance(payload, dict) else None
+            except ValueError:
+                url = None
+        if not url:
+            return None
+        try:
+            return urlparse(str(url)).hostname
+        except ValueError:
+            return None
+
+    async def forward(self, request: Request) -> Response:
+        body = await request.body()
+        domain = self.request_domain(request, body)
+        shard, spilled_from = self.pick(domain)
+        if spilled_from is not None:
+            spilled_from.spilled_out += 1
+            shard.spilled_in += 1
+            logger.info(f"↪️ {domain}: shard {spilled_from.index} saturated or down, spilled to shard {shard.index}")
+        headers = {k: v for k, v in request.headers.items() if k.lower() not in _HOP_BY_HOP}
+        if request.client:
+            headers["X-Forwarded-For"] = request.client.host
+        url = shard.base_url + request.url.path
+        if request.url.query:
+            url += "?" + request.url.query
+        shard.in_flight += 1
+        shard.forwarded += 1
+        try:
+            async with self._session.request(request.method, url, headers=headers, data=body) as upstream:
+                content = await upstream.read()
+                response_headers = {
+                    k: v for k, v in upstream.headers.items() if k.lower() not in _HOP_BY_HOP
+                }
+                response_headers["X-Shard"] = str(shard.index)
+                return Response(content=content, status_code=upstream.status, headers=response_headers)
+        except aiohttp.ClientError as e:
+            shard.errors += 1
+            logger.error(f"❌ Shard {shard.index} unreachable: {e}")
+            return JSONResponse(
+                status_code=503,
+                content={"success": False, "error": "Worker unavailable, try again"},
+                headers={"Retry-After": "5", "X-Shard": str(shard.index)},
+            )
+        finally:
+            shard.in_flight -= 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "shards": [
+                {
+                    "index": shard.index,
+                    "port": shard.port,
+                    "pid": shard.process.pid if shard.process is not None else None,
+                    "alive": shard.alive(),
+                    "in_flight": shard.in_flight,
+                    "forwarded": shard.forwarded,
+                    "spilled_in": shard.spilled_in,
+                    "spilled_out": shard.spilled_out,
+                    "errors": shard.errors,
+                    "restarts": shard.restarts,
+                    "uptime_sec": round(time.time() - shard.started_at, 1) if shard.alive() else None,
+                }
+                for shard in self.shards
+            ],
+            "spill_threshold": self.spill_threshold,
+            "total_in_flight": sum(shard.in_flight for shard in self.shards),
+            "total_spilled": sum(shard.spilled_in for shard in self.shards),
+        }
+
+
+def create_dispatcher_app(
+    shard_count: int,
+    base_port: int,
+    spill_threshold: int,
+    valid_api_keys: List[str],
+) -> FastAPI:
+    """Front ASGI app: POST /shards shows routing stats, every other request is forwarded to a shard."""
+    dispatcher = ShardDispatcher(shard_count, base_port, spill_threshold)
+
+    @asynccontextmanager
+    async def lifespan(app: FastAPI):
+        logger.info(f"🧩 Starting {len(dispatcher.shards)} shards on ports {base_port}-{base_port + len(dispatcher.shards) - 1} (spill over at {dispatcher.spill_threshold} in flight)")
+        await dispatcher.start()
+        yield
+        logger.info("🛑 Stopping shards...")
+        await dispatcher.stop()
+
+    app = FastAPI(title="Web Scraper API (dispatcher)", lifespan=lifespan, docs_url=None, redoc_url=None)
+    app.state.dispatcher = dispatcher
+
+    @app.post("/shards")
+    async def shard_status(x_api_key: str = Header(None)):
+        """Per-shard load and spill-over counts"""
+        if not x_api_key or x_api_key not in valid_api_keys:
+            raise HTTPException(status_code=401, detail="Invalid API key")
+        return dispatcher.snapshot()
+
+    @app.api_route("/{path:path}", methods=["GET", "POST", "PUT", "PATCH", "DELETE", "OPTIONS", "HEAD"])
+    async def proxy(request: Request, path: str):
+        return await dispatcher.forward(request)
+
+    return app
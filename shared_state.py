@@ -0,0 +1,306 @@
+"""
+Shared State Module
+Process-shared key/value state (SQLite WAL or Redis-compatible) for multi-worker deployments
+
+Author: Volkan AYDIN
+Year: 2025
+License: CC BY-NC-SA 4.0 (Non-Commercial)
+
+Holds state that must be the same in every uvicorn worker: domain sessions, proxy health,
+API key rate limits and job status. Values are JSON; every key can have a TTL.
+
+Backends (STATE_BACKEND):
+- sqlite (default): one local database file in WAL mode, shared by all workers on the host.
+- redis: any Redis-compatible server (Redis, Valkey, KeyDB, Dragonfly or a local stand-in),
+  requires `pip install redis`. Falls back to sqlite when the package or server is unavailable.
+"""
+
+import abc
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+import logging
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Optional, Dict, Any, Callable
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+
+class StateBackend(abc.ABC):
+    """
+    Synchronous key/value store with TTLs, counters and atomic read-modify-write.
+
+    The calls block (SQLite locks, Redis round trips): on the event loop use the a* variants, which
+    run them in a thread, or submit() for writes nobody waits for.
+    """
+
+    name = "base"
+    _writer: Optional[ThreadPoolExecutor] = None
+
+    @abc.abstractmethod
+    def get(self, key: str) -> Optional[Any]:
+        ...
+
+    @abc.abstractmethod
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        ...
+
+    @abc.abstractmethod
+    def delete(self, key: str) -> bool:
+        """Delete a key; True if it existed."""
+
+    @abc.abstractmethod
+    def incr(self, key: str, amount: int = 1, ttl: Optional[float] = None) -> int:
+        """Atomically add to an integer value (missing = 0). ttl is applied when the key is created."""
+
+    @abc.abstractmethod
+    def update(self, key: str, fn: Callable[[Optional[Any]], Any], ttl: Optional[float] = None) -> Any:
+        """Atomically replace the value with fn(current value or None); returns the new value."""
+
+    @abc.abstractmethod
+    def items(self, prefix: str) -> Dict[str, Any]:
+        """All live keys starting with prefix."""
+
+    def purge_expired(self) -> int:
+        """Remove expired keys (backends with native expiry do nothing)."""
+        return 0
+
+    async def aget(self, key: str) -> Optional[Any]:
+        return await asyncio.to_thread(self.get, key)
+
+    async def aset(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        await asyncio.to_thread(self.set, key, value, ttl)
+
+    async def adelete(self, key: str) -> bool:
+        return await asyncio.to_thread(self.delete, key)
+
+    async def aincr(self, key: str, amount: int = 1, ttl: Optional[float] = None) -> int:
+        return await asyncio.to_thread(self.incr, key, amount, ttl)
+
+    async def aupdate(self, key: str, fn: Callable[[Optional[Any]], Any], ttl: Optional[float] = None) -> Any:
+        return await asyncio.to_thread(self.update, key, fn, ttl)
+
+    async def aitems(self, prefix: str) -> Dict[str, Any]:
+        return await asyncio.to_thread(self.items, prefix)
+
+    async def apurge_expired(self) -> int:
+        return await asyncio.to_thread(self.purge_expired)
+
+    def submit(self, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> None:
+        """
+        Run a write (e.g. state.set, state.incr) on this backend's writer thread without waiting for it.
+        Writes run one at a time in submission order; failures are logged.
+        """
+        if self._writer is None:
+            self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"state-{self.name}")
+        future = self._writer.submit(fn, *args, **kwargs)
+        future.add_done_callback(_log_write_failure)
+
+
+def _log_write_failure(future: Future) -> None:
+    error = future.exception()
+    if error is not None:
+        logger.warning(f"⚠️ Shared state write failed: {error}")
+
+
+class SQLiteState(StateBackend):
+    """SQLite database in WAL mode: readers never block the writer, all local workers share one file."""
+
+    name = "sqlite"
+
+    def __init__(self, path: str):
+        self.path = path
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        # Autocommit mode; transactions are opened explicitly with BEGIN IMMEDIATE
+        self._conn = sqlite3.connect(path, timeout=5.0, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS kv_expires ON kv (expires_at)")
+
+    @staticmethod
+    def _expiry(ttl: Optional[float]) -> Optional[float]:
+        return time.time() + ttl if ttl else None
+
+    def _read(self, key: str) -> Optional[Any]:
+        row = self._conn.execute("SELECT value, expires_at FROM kv WHERE key = ?", (key,)).fetchone()
+        if row is None or (row[1] is not None and row[1] <= time.time()):
+            return None
+        return json.loads(row[0])
+
+    def _write(self, key: str, value: Any, expires_at: Optional[float]) -> None:
+        self._conn.execute(
+            "INSERT OR REPLACE INTO kv (key, value, expires_at) VALUES (?, ?, ?)",
+            (key, json.dumps(value), expires_at),
+        )
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            return self._read(key)
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        with self._lock:
+            self._write(key, value, self._expiry(ttl))
+
+    def delete(self, key: str) -> bool:
+        with self._lock:
+            cursor = self._conn.execute(
+                "DELETE FROM kv WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)", (key, time.time())
+            )
+            return cursor.rowcount > 0
+
+    def _transaction(self, key: str, fn: Callable[[Optional[Any]], Any], ttl: Optional[float], keep_expiry: bool) -> Any:
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute("SELECT value, expires_at FROM kv WHERE key = ?", (key,)).fetchone()
+                live = row is not None and (row[1] is None or row[1] > time.time())
+                current = json.loads(row[0]) if live else None
+                value = fn(current)
+                expires_at = row[1] if (live and keep_expiry) else self._expiry(ttl)
+                self._write(key, value, expires_at)
+                self._conn.execute("COMMIT")
+                return value
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def incr(self, key: str, amount: int = 1, ttl: Optional[float] = None) -> int:
+        return self._transaction(key, lambda current: int(current or 0) + amount, ttl, keep_expiry=True)
+
+    def update(self, key: str, fn: Callable[[Optional[Any]], Any], ttl: Optional[float] = None) -> Any:
+        return self._transaction(key, fn, ttl, keep_expiry=False)
+
+    def items(self, prefix: str) -> Dict[str, Any]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT key, value FROM kv WHERE key >= ? AND key < ? AND (expires_at IS NULL OR expires_at > ?)",
+                (prefix, prefix + "\uffff", time.time()),
+            ).fetchall()
+        return {key: json.loads(value) for key, value in rows}
+
+    def purge_expired(self) -> int:
+        with self._lock:
+            return self._conn.execute("DELETE FROM kv WHERE expires_at IS NOT NULL AND expires_at <= ?", (time.time(),)).rowcount
+
+
+class RedisState(StateBackend):
+    """Redis-compatible server (RESP protocol), keys namespaced by prefix."""
+
+    name = "redis"
+
+    def __init__(self, url: str, prefix: str = "fairscrapper:"):
+        import redis  # optional dependency
+
+        self._redis = redis
+        self.prefix = prefix
+        self.client = redis.Redis.from_url(url, decode_responses=True, socket_timeout=5.0)
+        self.client.ping()
+
+    def _key(self, key: str) -> str:
+        return self.prefix + key
+
+    @staticmethod
+    def _ttl_ms(ttl: Optional[float]) -> Optional[int]:
+        return max(1, int(ttl * 1000)) if ttl else None
+
+    def get(self, key: str) -> Optional[Any]:
+        raw = self.client.get(self._key(key))
+        return json.loads(raw) if raw is not None else None
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        self.client.set(self._key(key), json.dumps(value), px=self._ttl_ms(ttl))
+
+    def delete(self, key: str) -> bool:
+        return self.client.delete(self._key(key)) > 0
+
+    def incr(self, key: str, amount: int = 1, ttl: Optional[float] = None) -> int:
+        full_key = self._key(key)
+        if not ttl:
+            return int(self.client.incrby(full_key, amount))
+        # One transaction: a key created here always gets its TTL
+        with self.client.pipeline(transaction=True) as pipe:
+            pipe.set(full_key, 0, px=self._ttl_ms(ttl), nx=True)
+            pipe.incrby(full_key, amount)
+            _, value = pipe.execute()
+        return int(value)
+
+    def update(self, key: str, fn: Callable[[Optional[Any]], Any], ttl: Optional[float] = None) -> Any:
+        full_key = self._key(key)
+        with self.client.pipeline() as pipe:
+            while True:
+                try:
+                    pipe.watch(full_key)
+                    raw = pipe.get(full_key)
+                    value = fn(json.loads(raw) if raw is not None else None)
+                    pipe.multi()
+                    pipe.set(full_key, json.dumps(value), px=self._ttl_ms(ttl))
+                    pipe.execute()
+                    return value
+                except self._redis.WatchError:
+                    continue
+
+    def items(self, prefix: str) -> Dict[str, Any]:
+        pattern = self._key(prefix)
+        for char in "\\*?[]":
+            pattern = pattern.replace(char, "\\" + char)
+        keys = list(self.client.scan_iter(match=pattern + "*", count=500))
+        if not keys:
+            return {}
+        start = len(self.prefix)
+        return {
+            key[start:]: json.loads(raw)
+            for key, raw in zip(keys, self.client.mget(keys))
+            if raw is not None
+        }
+
+
+_state: Optional[StateBackend] = None
+_state_lock = threading.Lock()
+
+
+def create_state(backend: Optional[str] = None) -> StateBackend:
+    """
+    Build the configured backend (STATE_BACKEND). redis falls back to sqlite if unavailable, but only
+    with a single worker: with API_WORKERS > 1 a worker on a private store would split sessions, bans,
+    quotas and job status from the others, so startup fails instead.
+    """
+    backend = (backend or Config.STATE_BACKEND).lower()
+    if backend == "redis":
+        try:
+            state = RedisState(Config.STATE_REDIS_URL, Config.STATE_KEY_PREFIX)
+            logger.info(f"🗄️ Shared state: redis ({Config.STATE_REDIS_URL})")
+            return state
+        except ImportError as e:
+            if Config.API_WORKERS > 1:
+                raise RuntimeError("STATE_BACKEND=redis with API_WORKERS > 1 but redis is not installed: pip install redis") from e
+            logger.warning("STATE_BACKEND=redis but redis is not installed: pip install redis (using sqlite)")
+        except Exception as e:
+            if Config.API_WORKERS > 1:
+                raise RuntimeError(f"Redis state backend unavailable with API_WORKERS > 1: {e}") from e
+            logger.warning(f"⚠️ Redis state backend unavailable ({e}), using sqlite")
+    elif backend != "sqlite":
+        logger.warning(f"⚠️ Unknown STATE_BACKEND '{backend}', using sqlite")
+    state = SQLiteState(Config.STATE_SQLITE_PATH)
+    logger.info(f"🗄️ Shared state: sqlite ({Config.STATE_SQLITE_PATH})")
+    return state
+
+
+def get_state() -> StateBackend:
+    """Process-wide shared state backend (created on first use, i.e. inside each worker process)."""
+    global _state
+    if _state is None:
+        with _state_lock:
+            if _state is None:
+                _state = create_state()
+    return _state
@@ -0,0 +1,86 @@
+"""
+Quotas Tests
+Limits-file edge cases of the per-API-key rate limits and quotas
+
+Author: Volkan AYDIN
+Year: 2025
+License: CC BY-NC-SA 4.0 (Non-Commercial)
+"""
+
+import asyncio
+import json
+import math
+
+import pytest
+
+from quotas import KeyQuotas, KeyLimits, QuotaExceeded, KeyBlocked, MAX_RETRY_AFTER_SEC
+
+
+def _quotas(tmp_path, limits) -> KeyQuotas:
+    path = tmp_path / "limits.json"
+    path.write_text(json.dumps(limits), encoding="utf-8")
+    return KeyQuotas(str(path))
+
+
+def _check(quotas: KeyQuotas, api_key: str, queued: int = 0) -> None:
+    asyncio.run(quotas.check_request(api_key, queued))
+
+
+def test_rate_zero_blocks_the_key(tmp_path):
+    quotas = _quotas(tmp_path, {"keys": {"k": {"rate": 0}}})
+    for _ in range(3):
+        with pytest.raises(KeyBlocked) as info:
+            _check(quotas, "k")
+        assert math.isfinite(info.value.retry_after)
+    # Other keys are not affected
+    _check(quotas, "other")
+
+
+def test_negative_rate_blocks_the_key(tmp_path):
+    quotas = _quotas(tmp_path, {"default": {"rate": -1}})
+    assert quotas.limits_for("any").blocked
+    with pytest.raises(KeyBlocked):
+        _check(quotas, "any")
+
+
+def test_burst_below_one_is_raised_to_one(tmp_path):
+    quotas = _quotas(tmp_path, {"keys": {"k": {"rate": 0.001, "burst": 0.2}}})
+    assert quotas.limits_for("k").burst == 1.0
+    _check(quotas, "k")
+    with pytest.raises(QuotaExceeded) as info:
+        _check(quotas, "k")
+    assert not isinstance(info.value, KeyBlocked)
+    # 1000 s to the next token, capped
+    assert 0 < info.value.retry_after <= MAX_RETRY_AFTER_SEC
+
+
+def test_retry_after_is_capped():
+    assert QuotaExceeded("slow", float("inf")).retry_after == MAX_RETRY_AFTER_SEC
+    assert QuotaExceeded("slow", 5.0).retry_after == 5.0
+
+
+def test_default_burst_is_one_second_of_traffic():
+    assert KeyLimits(rate=0.5).burst == 1.0
+    assert KeyLimits(rate=5).burst == 5.0
+    assert KeyLimits().burst is None
+
+
+def test_keys_inherit_default_limits(tmp_path):
+    quotas = _quotas(tmp_path, {"default": {"max_queued": 2}, "keys": {"k": {"rate": 10}}})
+    assert quotas.limits_for("k").max_queued == 2
+    with pytest.raises(QuotaExceeded):
+        _check(quotas, "k", queued=2)
+
+
+def test_priorities_limit_classes(tmp_path):
+    quotas = _quotas(tmp_path, {"default": {"priorities": ["default"]}, "keys": {"vip": {"priorities": None}}})
+    assert quotas.allows_priority("any", "default")
+    assert not quotas.allows_priority("any", "interactive")
+    assert quotas.allows_priority("vip", "interactive")
+
+
+def test_unreadable_file_keeps_previous_limits(tmp_path):
+    quotas = _quotas(tmp_path, {"keys": {"k": {"rate": 0}}})
+    (tmp_path / "limits.json").write_text("{not json", encoding="utf-8")
+    quotas.load()
+    assert quotas.limits_for("k").blocked
@@ -0,0 +1,189 @@
+"""
+Warm Contexts Module
+Per-domain cache of idle live browser contexts, reused by the next request for the same domain
+
+Author: Volkan AYDIN
+Year: 2025
+License: CC BY-NC-SA 4.0 (Non-Commercial)
+"""
+
+import asyncio
+import time
+import logging
+from collections import OrderedDict
+from typing import Optional, Dict, Any, Callable, List
+
+from resource_monitor import read_child_tree_rss
+
+logger = logging.getLogger(__name__)
+
+_MB = 1024 * 1024
+
+
+class WarmEntry:
+    """One parked scraper (browser + context, no open pages)."""
+
+    __slots__ = ("scraper", "domain", "parked_at", "rss", "uses")
+
+    def __init__(self, scraper: Any, domain: str, rss: int, uses: int):
+        self.scraper = scraper
+        self.domain = domain
+        self.parked_at = time.monotonic()
+        self.rss = rss
+        self.uses = uses
+
+
+class WarmContextPool:
+    """
+    Keeps a successful scraper's browser context alive for idle_sec after its request, so the next
+    request for the same domain gets its HTTP cache, service workers, open connections and
+    JS-set state instead of a context rebuilt from storage_state.
+
+    park() closes the scraper's pages (a reused context always starts on a fresh page) and keeps
+    it under its domain; checkout() hands out the most recently parked one. The pool is bounded
+    by max_entries and max_memory_mb (RSS of the parked browsers' process trees, oldest evicted
+    first), and a scraper is retired after max_uses requests. Evicted scrapers go to reap().
+    """
+
+    def __init__(
+        self,
+        reap: Callable[[Any], None],
+        max_entries: int = 4,
+        max_memory_mb: float = 1024,
+        idle_sec: float = 180.0,
+        max_uses: int = 50,
+    ):
+        self.reap = reap
+        self.max_entries = max(1, int(max_entries))
+        self.max_memory = max(0.0, float(max_memory_mb)) * _MB
+        self.idle_sec = max(1.0, float(idle_sec))
+        self.max_uses = max(1, int(max_uses))
+        # id(scraper) -> entry, least recently parked first
+        self._entries: "OrderedDict[int, WarmEntry]" = OrderedDict()
+        # id(scraper) -> requests served, for scrapers currently checked out
+        self._uses: Dict[int, int] = {}
+        self.hits = 0
+        self.misses = 0
+        self.parked = 0
+        self.evicted = 0
+        self.expired = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def memory_bytes(self) -> int:
+        return sum(entry.rss for entry in self._entries.values())
+
+    def _evict(self, key: int) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.reap(entry.scraper)
+
+    def evict_oldest(self) -> bool:
+        """Free the least recently parked browser (e.g. under memory pressure). False if the pool is empty."""
+        if not self._entries:
+            return False
+        self._evict(next(iter(self._entries)))
+        self.evicted += 1
+        return True
+
+    def discard(self, domain: str) -> int:
+        """Drop all parked scrapers of a domain (e.g. its session was invalidated)."""
+        keys = [key for key, entry in self._entries.items() if entry.domain == domain]
+        for key in keys:
+            self._evict(key)
+        return len(keys)
+
+    async def park(self, scraper: Any, domain: Optional[str]) -> None:
+        """Keep a scraper whose request succeeded; anything not reusable is reaped instead."""
+        uses = self._uses.pop(id(scraper), 0) + 1
+        context = getattr(scraper, "context", None)
+        if not domain or context is None or uses >= self.max_uses or not scraper.is_alive():
+            self.reap(scraper)
+            return
+        try:
+            for page in list(context.pages):
+                await asyncio.wait_for(page.close(), timeout=5.0)
+        except Exception as e:
+            logger.warning(f"⚠️ Could not reset warm context for {domain}: {e}")
+            self.reap(scraper)
+            return
+        scraper.page = None
+        driver_pid = getattr(scraper, "driver_pid", None)
+        # A scan of all of /proc: off the event loop
+        rss = (await asyncio.to_thread(read_child_tree_rss, driver_pid))[0] if driver_pid else None
+        self._entries[id(scraper)] = WarmEntry(scraper, domain, rss or 0, uses)
+        self.parked += 1
+        while len(self._entries) > self.max_entries or (self.max_memory and self.memory_bytes > self.max_memory):
+            self.evict_oldest()
+
+    async def checkout(self, domain: Optional[str], viewport: Optional[Dict[str, int]] = None) -> Optional[Any]:
+        """A warm scraper for domain with a fresh page, or None."""
+        if not domain:
+            return None
+        for key in reversed([k for k, e in self._entries.items() if e.domain == domain]):
+            entry = self._entries.pop(key)
+            scraper = entry.scraper
+            if time.monotonic() - entry.parked_at > self.idle_sec or not scraper.is_alive():
+                self.expired += 1
+                self.reap(scraper)
+                continue
+            try:
+                scraper.page = await scraper.context.new_page()
+                await scraper.watch_traffic(scraper.page)
+                if viewport:
+                    await scraper.page.set_viewport_size(viewport)
+                scraper.page.set_default_timeout(scraper.config.TIMEOUT)
+            except Exception as e:
+                logger.warning(f"⚠️ Warm context for {domain} unusable ({e}), starting a new browser")
+                self.reap(scraper)
+                continue
+            scraper.last_response_status = None
+            scraper.last_retry_after = None
+            self._uses[id(scraper)] = entry.uses
+            self.hits += 1
+            return scraper
+        self.misses += 1
+        return None
+
+    def forget(self, scraper: Any) -> None:
+        """A checked-out scraper is being torn down instead of parked."""
+        self._uses.pop(id(scraper), None)
+
+    def sweep(self) -> int:
+        now = time.monotonic()
+        stale: List[int] = [key for key, entry in self._entries.items() if now - entry.parked_at > self.idle_sec]
+        for key in stale:
+            self._evict(key)
+        self.expired += len(stale)
+        return len(stale)
+
+    async def run(self, interval_sec: float = 15.0) -> None:
+        """Background sweeper for contexts idle longer than idle_sec."""
+        while True:
+            await asyncio.sleep(interval_sec)
+            removed = self.sweep()
+            if removed:
+                logger.info(f"🧹 Warm contexts: {removed} idle browsers closed ({len(self._entries)} warm)")
+
+    def clear(self) -> None:
+        for key in list(self._entries):
+            self._evict(key)
+
+    def snapshot(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "warm": len(self._entries),
+            "domains": sorted({entry.domain for entry in self._entries.values()}),
+            "memory_mb": round(self.memory_bytes / _MB, 1),
+            "max_entries": self.max_entries,
+            "max_memory_mb": round(self.max_memory / _MB, 1),
+            "idle_sec": self.idle_sec,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+            "parked": self.parked,
+            "evicted": self.evicted,
+            "expired": self.expired,
+        }